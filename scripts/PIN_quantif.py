@@ -7,14 +7,12 @@
 ################################################################################
 
 import numpy as np
-import pandas as pd
 
 from os.path import exists
 from vplants.tissue_analysis.misc import rtuple
 from vplants.tissue_analysis.misc import stuple
 from vplants.tissue_analysis.spatial_image_analysis import SpatialImageAnalysis
 from vplants.tissue_analysis.signal_quantification import MembraneQuantif
-from vplants.tissue_analysis.signal_quantification import POSS_QUANTIF_METHODS
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -27,6 +25,22 @@ sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from nomenclature import splitext_zip
 from segmentation_pipeline import read_image
+from segmentation_pipeline import read_image_header
+from segmentation_pipeline import crop_bbox as crop_image
+from label_statistics import label_statistics
+from label_statistics import stats2dict
+from wall_quantification import QUANTIF_METHODS
+from lazy_reader import LazyChannels
+from wall_quantification import quantify_walls
+from wall_quantification import wall_signal_table
+from wall_quantification import tiled_quantify_walls
+from wall_quantification import select_walls
+from wall_quantification import wall_geometry
+from wall_quantification import cached_wall_index
+from wall_quantification import wall_index_dirname
+from wall_quantification import crop_array
+from label_adjacency import CellLayers
+from label_adjacency import cached_cell_layers
 
 
 # - DEFAULT variables:
@@ -40,6 +54,10 @@ DEF_MIN_AREA = 5.  # to avoid too small walls arising from segmentation errors
 DEF_MEMB_CH = 'PI'
 # -- Channel name for the 'membrane-targetted signal' image:
 DEF_SIG_CH = 'PIN1'
+# -- Maximal distance to membrane of the wall index, reused for smaller distances:
+DEF_INDEX_DIST = 1.0
+# -- Real height added on each side of a z-tile, should be greater than the walls height:
+DEF_TILE_HALO = 10.
 
 
 # PARAMETERS:
@@ -49,8 +67,8 @@ parser = argparse.ArgumentParser(description='Performs quantification of membran
 # positional arguments:
 parser.add_argument('membrane_im', type=str,
                     help="file containing the 'membrane labelling' channel.")
-parser.add_argument('signal_im', type=str,
-                    help="file containing the 'membrane-targetted signal of interest'.")
+parser.add_argument('signal_im', type=str, nargs='+',
+                    help="file(s) containing the 'membrane-targetted signal(s) of interest', or their channel names if 'membrane_im' is a multi-channel image (CZI, LSM).")
 parser.add_argument('segmented_im', type=str,
                     help="segmented image corresponding to the 'membrane labelling' channel")
 
@@ -63,42 +81,142 @@ parser.add_argument('--walls', type=str, default='all',
                     help="restrict to this list of walls, availables are: {}".format(POSS_LABELS))
 parser.add_argument('--back_id', type=int, default=None,
                     help="background id to be found in the segmented image")
-parser.add_argument('--membrane_dist', type=float, default=DEF_MEMBRANE_DIST,
-                    help="distance to the membrane to consider when computing 'membrane-targetted signal' intensity, '{}' by default".format(DEF_MEMBRANE_DIST))
+parser.add_argument('--membrane_dist', type=float, nargs='+', default=[DEF_MEMBRANE_DIST],
+                    help="distance(s) to the membrane to consider when computing 'membrane-targetted signal' intensity, all quantified in a single pass with one table per distance, '{}' by default".format(DEF_MEMBRANE_DIST))
 parser.add_argument('--quantif_method', type=str, default=DEF_QUANTIF,
                     help="quantification method to use to estimate 'membrane-targetted signal' intensity value for a given wall, '{}' by default".format(DEF_QUANTIF))
 parser.add_argument('--membrane_ch_name', type=str, default=DEF_MEMB_CH,
                     help="channel name for the 'membrane labelling' channel, '{}' by default".format(DEF_MEMB_CH))
-parser.add_argument('--signal_ch_name', type=str, default=DEF_SIG_CH,
-                    help="channel name for the 'membrane-targetted signal of interest', '{}' by default".format(DEF_SIG_CH))
+parser.add_argument('--signal_ch_name', type=str, nargs='+', default=[DEF_SIG_CH],
+                    help="channel name(s) for the 'membrane-targetted signal(s) of interest', in the order of 'signal_im', '{}' by default".format(DEF_SIG_CH))
+parser.add_argument('--channel_names', type=str, nargs='+', default=None,
+                    help="list of channel names found in 'membrane_im', if it is a multi-channel image (CZI, LSM)")
 parser.add_argument('--walls_min_area', type=float, default=DEF_MIN_AREA,
                     help="miminal REAL area to consider a wall (contact between two labels) as valid, '{}µm2' by default".format(DEF_MIN_AREA))
 parser.add_argument('--force', action='store_true',
                     help="if given, force computation of values even if the *.CSV already exists, else skip it, 'False' by default")
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of processes used to quantify the walls, split in chunks, '1' by default")
+parser.add_argument('--out_fmt', type=str, default='csv', choices=['csv', 'parquet', 'feather', 'npz'],
+                    help="format of the wall table, binary formats are faster to load ('parquet' & 'feather' require 'pyarrow'), 'csv' by default")
 parser.add_argument('--real_bary', action='store_true',
                     help="if given, export real-world barycenters to CSV, else use voxel unit, 'False' by default")
+parser.add_argument('--max_mem', type=float, default=None,
+                    help="if given, memory ceiling (in Mb) used to quantify the walls by z-tiles, reading only the required slices of single channel images ('--n_jobs' is not used), the wall areas are then the contact areas of the labels, 'None' by default")
+parser.add_argument('--tile_halo', type=float, default=DEF_TILE_HALO,
+                    help="real height added on each side of a z-tile, walls higher than this are not quantified, '{}µm' by default".format(DEF_TILE_HALO))
 parser.add_argument('--bounding_box', type=int, nargs='+', default=None,
                     help="if given, used to crop the image around these voxel coordinates, use '0' for the beginning and '-1' for the end")
 
 
 args = parser.parse_args()
+seg_im_fname = args.segmented_im
+
+# -- Tiled quantification, images are then read by z-tiles:
+max_mem = args.max_mem
+tiled = max_mem is not None
+tile_halo = args.tile_halo
+
+# -- Image cropping:
+bounding_box =  args.bounding_box
+bbox_suffix = ""
+if bounding_box:
+    print "Got a cropping bounding box: {}".format(bounding_box)
+    # - Shape of the segmented image, from its header only (the images are read cropped):
+    shape = read_image_header(seg_im_fname)[0]
+    axis = ['x', 'y', 'z']
+    axis = axis[:len(shape)]
+    # - Define lower and upper bounds:
+    lower_bounds = bounding_box[::2]
+    upper_bounds = bounding_box[1::2]
+    # -- Change '-1' into max shape value for given axis:
+    for n, upper_bound in enumerate(upper_bounds):
+        if upper_bound == -1:
+            upper_bounds[n] = shape[n] - 1
+    # - Check lower bound values are positive and strictly inferior to the max shape of the image:
+    for n, lower_bound in enumerate(lower_bounds):
+        try:
+            assert lower_bound >= 0
+        except AssertionError:
+            raise ValueError("Lower bound '{}' ({}) is negative, please check!".format(axis[n], lower_bound))
+        try:
+            assert lower_bound < shape[n] - 1
+        except AssertionError:
+            raise ValueError("Lower bound '{}' ({}) is not strictly inferior to the max shape ({}), please check!".format(axis[n], lower_bound, shape[n] - 1))
+    # - Check upper bound values are strictly positive and inferior to the max shape of the image:
+    for n, upper_bound in enumerate(upper_bounds):
+        try:
+            assert upper_bound > 0
+        except AssertionError:
+            raise ValueError("Upper bound '{}' ({}) is not superior to zero, please check!".format(axis[n], upper_bound))
+        try:
+            assert upper_bound <= shape[n] - 1
+        except AssertionError:
+            raise ValueError("Upper bound '{}' ({}) is greater than the max shape ({}), please check!".format(axis[n], upper_bound, shape[n] - 1))
+    # - Add the cropping values to the filename:
+    for n, (lower, upper) in enumerate(zip(lower_bounds, upper_bounds)):
+        if lower != 0  or upper != shape[n] - 1:
+            bbox_suffix += '-{}{}_{}'.format(axis[n], lower, upper)
+    # - Voxel bounds, upper excluded, of the quantified sub-volume:
+    crop_bbox = [[lower, upper + 1] for lower, upper in zip(lower_bounds, upper_bounds)]
+else:
+    crop_bbox = None
 
 # - Variables definition from mandatory arguments parsing:
 # -- Membrane labelling signal image:
 memb_im_fname = args.membrane_im
-print "\n\n# - Reading membrane labelling signal image file {}...".format(memb_im_fname)
-memb_im = read_image(memb_im_fname)
-print "Done."
-# -- Membrane-targetted signal image:
-sig_im_fname = args.signal_im
-print "\n\n# - Reading membrane-targetted signal image file {}...".format(sig_im_fname)
-sig_im = read_image(sig_im_fname)
-print "Done."
+membrane_ch_name = args.membrane_ch_name
+channel_names = args.channel_names
+if tiled:
+    try:
+        assert channel_names is None
+    except AssertionError:
+        raise ValueError("Multi-channel images can not be quantified by tiles!")
+    memb_im = None
+else:
+    print "\n\n# - Reading membrane labelling signal image file {}...".format(memb_im_fname)
+    # - Channels of CZI & LSM images are read whole then cropped, the others are read cropped:
+    multi_ch = memb_im_fname.endswith(".czi") or memb_im_fname.endswith(".lsm")
+    memb_im = read_image(memb_im_fname, channel_names, lazy=True, bbox=None if multi_ch else crop_bbox)
+if isinstance(memb_im, dict) or isinstance(memb_im, LazyChannels):
+    # - Multi-channel image: signals are given by their channel names
+    multi_ch_im = memb_im
+    memb_im = multi_ch_im[membrane_ch_name]
+else:
+    multi_ch_im = None
+if memb_im is not None and multi_ch and crop_bbox is not None:
+    memb_im = crop_image(memb_im, crop_bbox)
+if not tiled:
+    print "Done."
+# -- Membrane-targetted signal images:
+sig_im_fnames = args.signal_im
+if multi_ch_im is not None:
+    signal_ch_names = sig_im_fnames
+else:
+    signal_ch_names = args.signal_ch_name
+    try:
+        assert len(signal_ch_names) == len(sig_im_fnames)
+    except AssertionError:
+        raise ValueError("Got {} signal images but {} signal channel names!".format(len(sig_im_fnames), len(signal_ch_names)))
+sig_ims = {}
+for sig_im_fname, ch_name in zip(sig_im_fnames, signal_ch_names):
+    if tiled:
+        continue
+    elif multi_ch_im is not None:
+        print "\n\n# - Reading membrane-targetted signal channel '{}'...".format(ch_name)
+        sig_ims[ch_name] = multi_ch_im[ch_name] if crop_bbox is None else crop_image(multi_ch_im[ch_name], crop_bbox)
+    else:
+        print "\n\n# - Reading membrane-targetted signal image file {}...".format(sig_im_fname)
+        sig_ims[ch_name] = read_image(sig_im_fname, bbox=crop_bbox)
+    print "Done."
 # -- Segmented images:
-seg_im_fname = args.segmented_im
-print "\n\n# - Reading segmented image file {}...".format(seg_im_fname)
-seg_im = read_image(seg_im_fname)
-print "Done."
+if tiled:
+    # - Read by z-tiles, with the signal images:
+    seg_im = None
+else:
+    print "\n\n# - Reading segmented image file {}...".format(seg_im_fname)
+    seg_im = read_image(seg_im_fname, bbox=crop_bbox)
+    print "Done."
 
 # - Variables definition from optional arguments parsing:
 # -- Labels:
@@ -115,34 +233,40 @@ except AssertionError:
     raise ValueError("Unknown list of labels '{}', availables are: {}".format(walls_str, POSS_LABELS))
 # -- Background label:
 back_id = args.back_id
-if back_id is not None:
+# - A cropped segmented image may be inside the tissue, without background:
+if back_id is not None and seg_im is not None and crop_bbox is None:
     try:
         assert back_id in seg_im
     except AssertionError:
         raise ValueError("Background id not found in the segmented image!")
-else:
+elif back_id is None:
     try:
         assert walls_str != 'L1_anticlinal' and walls_str != 'L1/L2'
     except AssertionError:
         raise ValueError("No background value defined, cannot detect L1!")
     print "No background id defined!"
 # -- Distance to the membrane:
-membrane_dist = args.membrane_dist
+membrane_dists = sorted(set(args.membrane_dist))
 try:
-    assert membrane_dist > 0.
+    assert min(membrane_dists) > 0.
 except:
     raise ValueError("Negative distance provided!")
 # -- Quantification method:
 quantif_method = args.quantif_method
 try:
-    assert quantif_method in POSS_QUANTIF_METHODS
+    assert quantif_method in QUANTIF_METHODS
 except AssertionError:
-    raise ValueError("Unknown quantification method '{}', availables are {}".format(quantif_method, POSS_QUANTIF_METHODS))
-# -- Channel names:
-membrane_ch_name = args.membrane_ch_name
-signal_ch_name = args.signal_ch_name
+    raise ValueError("Unknown quantification method '{}', availables are {}".format(quantif_method, QUANTIF_METHODS))
 # -- Real/voxel units:
 real_bary = args.real_bary
+# -- Output table format:
+out_ext = '.' + args.out_fmt
+# -- Number of processes:
+n_jobs = args.n_jobs
+try:
+    assert n_jobs > 0
+except AssertionError:
+    raise ValueError("The number of jobs should be strictly positive!")
 # -- Minimal wall area to cosider:
 walls_min_area = args.walls_min_area
 try:
@@ -150,62 +274,25 @@ try:
 except:
     raise ValueError("Negative minimal area!")
 
-# - CSV filename change with 'signal_ch_name', 'membrane_ch_name', 'quantif_method' & 'membrane_dist':
-out_fname = splitext_zip(memb_im_fname)[0] + '_wall_{}_{}_{}_signal-D{}'.format(signal_ch_name, membrane_ch_name, quantif_method, membrane_dist)
-
-# -- Image cropping:
-bounding_box =  args.bounding_box
-if bounding_box:
-    print "Got a cropping bounding box: {}".format(bounding_box)
-    shape = memb_im.shape
-    axis = ['x', 'y', 'z']
-    axis = axis[:memb_im.ndim]
-    # - Define lower and upper bounds:
-    lower_bounds = bounding_box[::2]
-    upper_bounds = bounding_box[1::2]
-    # -- Change '-1' into max shape value for given axis:
-    for n, upper_bound in enumerate(upper_bounds):
-        if upper_bound == -1:
-            upper_bounds[n] = shape[n] - 1
-    # - Check lower bound values are positive and strictly inferior to the max shape of the image:
-    for n, lower_bound in enumerate(lower_bounds):
-        try:
-            assert lower_bound >= 0
-        except AssertionError:
-            raise ValueError("Lower bound '{}' ({}) is negative, please check!".format(axis[n], lower_bound))
-        try:
-            assert lower_bound < shape[n] - 1
-        except AssertionError:
-            raise ValueError("Lower bound '{}' ({}) is not strictly inferior to the max shape ({}), please check!".format(axis[n], lower_bound, shape[n] - 1))
-    # - Check upper bound values are strictly positive and inferior to the max shape of the image:
-    for n, upper_bound in enumerate(upper_bounds):
-        try:
-            assert upper_bound > 0
-        except AssertionError:
-            raise ValueError("Upper bound '{}' ({}) is not superior to zero, please check!".format(axis[n], upper_bound))
-        try:
-            assert upper_bound <= shape[n] - 1
-        except AssertionError:
-            raise ValueError("Upper bound '{}' ({}) is greater than the max shape ({}), please check!".format(axis[n], upper_bound, shape[n] - 1))
-    # - Add the cropping values to the filename:
-    for n, (lower, upper) in enumerate(zip(lower_bounds, upper_bounds)):
-        if lower != 0  or upper != shape[n] - 1:
-            out_fname += '-{}{}_{}'.format(axis[n], lower, upper)
-else:
-    pass
+# - Table filename change with 'signal_ch_names', 'membrane_ch_name', 'quantif_method' & 'membrane_dist':
+out_fname = splitext_zip(memb_im_fname)[0] + '_wall_{}_{}_{}_signal-D{{}}'.format('-'.join(signal_ch_names), membrane_ch_name, quantif_method)
+out_fname += bbox_suffix
 
-out_fname += '.csv'
+out_fname += out_ext
+out_fnames = {membrane_dist: out_fname.format(membrane_dist) for membrane_dist in membrane_dists}
 # -- Force overwritting of existing files:
 force =  args.force
-if exists(out_fname):
-    print "\nFound existing CSV file: {}".format(out_fname)
-    if force:
-        print "WARNING: existing CSV file will be overwritten!"
-        print out_fname
-    else:
-        print "Aborted!"
-        print "(to enable overwriting add '--force')."
-        sys.exit(0)
+for membrane_dist in membrane_dists[:]:
+    if exists(out_fnames[membrane_dist]):
+        print "\nFound existing table file: {}".format(out_fnames[membrane_dist])
+        if force:
+            print "WARNING: existing table file will be overwritten!"
+        else:
+            membrane_dists.remove(membrane_dist)
+if membrane_dists == []:
+    print "Aborted!"
+    print "(to enable overwriting add '--force')."
+    sys.exit(0)
 
 
 ###############################################################################
@@ -229,176 +316,129 @@ def compute_vect_direction(bary_ori, bary_dest):
     return [dx/norm, dy/norm, dz/norm]
 
 
-def PI_significance(PI_left, PI_right):
-    """
-    Compute a signal "significance" as:
-     s = min(PI_left, PI_right) / max(PI_left, PI_right)
-    """
-    return min([PI_left, PI_right]) / max([PI_left, PI_right])
-
-
-def vector2dim(dico):
-    """
-    Transfrom a dictionary k: length-3 vector into 3 dictionary for each
-    dimension.
-    """
-    dico = {k: v for k, v in dico.items() if v is not None}
-    x = {k: v[0] for k, v in dico.items()}
-    y = {k: v[1] for k, v in dico.items()}
-    z = {k: v[2] for k, v in dico.items()}
-    return x, y, z
-
-
-def symetrize_labelpair_dict(dico, oppose=False, verbose=False):
-    """
-    Returns a fully symetric dictionary with labelpairs as keys, ie. contains
-    (label_1, label_2) & (label_2, label_1) as keys.
-    """
-    tmp = {}
-    for (label_1, label_2), v in dico.items():
-        tmp[(label_1, label_2)] = v
-        if dico.has_key((label_2, label_1)):
-            v2 = dico[(label_2, label_1)]
-            if verbose:
-                if oppose and v2 != -v:
-                    print "dict[({}, {})] != -dict[({}, {})]".format(label_1, label_2, label_2, label_1)
-                    print "dict[({}, {})] = {}".format(label_1, label_2, v)
-                    print "dict[({}, {})] = {}".format(label_2, label_1, v2)
-                elif not oppose and v2 != v:
-                    print "dict[({}, {})] != -dict[({}, {})]".format(label_1, label_2, label_2, label_1)
-                    print "dict[({}, {})] = {}".format(label_1, label_2, v)
-                    print "dict[({}, {})] = {}".format(label_2, label_1, v2)
-                else:
-                    pass
-        else:
-            if oppose:
-                tmp[(label_2, label_1)] = -v
-            else:
-                tmp[(label_2, label_1)] = v
-    return tmp
-
-
-def invert_labelpair_dict(dico):
-    """
-    Return a dict with inverted labelpairs.
-    """
-    return {(label_2, label_1): v for (label_1, label_2), v in dico.items()}
-
-
 ###############################################################################
 # -- PIN1/PI signal & PIN1 polarity quatification:
 ###############################################################################
-print "\n\n# - Initialise signal quantification class:"
-memb = MembraneQuantif(seg_im, [sig_im, memb_im], [signal_ch_name, membrane_ch_name], background=back_id, slice=bounding_box)
-
-# - Cell-based information (barycenters):
-# -- Get list of labels:
-labels = memb.labels_checker(labels_str)
-# -- Compute the barycenters of each selected cells:
-print "\n# - Compute the barycenters of each selected cells:"
-bary = memb.center_of_mass(labels, real=real_bary, verbose=True)
-print "Done."
-# bary_x = {k: v[0] for k, v in bary.items()}
-# bary_y = {k: v[1] for k, v in bary.items()}
-# bary_z = {k: v[2] for k, v in bary.items()}
-
-# -- Create a list of walls (ordered pairs of labels):
-print "\n# - Compute the labelpair list of {} walls:".format(walls_str)
-if walls_str == 'all':
-    wall_labelpairs = memb.list_all_walls(min_area=walls_min_area, real_area=True)
-    if back_id is not None:
-        epidermal_walls_labelpairs = memb.list_epidermal_walls(min_area=walls_min_area, real_area=True)
-        wall_labelpairs = [lp for lp in wall_labelpairs if lp not in epidermal_walls_labelpairs]
-elif walls_str == 'L1_anticlinal':
-    wall_labelpairs = memb.list_epidermis_anticlinal_walls(min_area=walls_min_area, real_area=True)
-elif walls_str == 'L1/L2':
-    wall_labelpairs = memb.list_l1_l2_walls(min_area=walls_min_area, real_area=True)
-else:
-    pass
-
-n_lp = len(wall_labelpairs)
-print "Found {} unique (ie. 'sorted') wall labelpairs!".format(n_lp)
-
-# -- Compute the area of each walls:
-print "\n# - Compute the area of each walls:"
-wall_area = memb.wall_area_from_labelpairs(wall_labelpairs, real=True)
-print "Done."
-n = len(set([stuple(k) for k, v in wall_area.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-# -- Compute the (epidermis) wall (edge) median of each selected walls:
-if back_id is not None and walls_str == 'L1_anticlinal':
-    print "\n# - Compute the epidermis wall edge median for selected walls:"
-    wall_median = memb.epidermal_wall_edges_median(wall_labelpairs, real=False, verbose=True)
+if tiled:
+    # - The walls, their geometry & signals are computed in a single pass over the z-tiles:
+    print "\n\n# - Compute the wall geometry and {} & {} {} signal intensities, ratios & totals by z-tiles:".format(', '.join(signal_ch_names), membrane_ch_name, quantif_method)
+    signal_fnames = dict(zip(signal_ch_names, sig_im_fnames))
+    signal_fnames[membrane_ch_name] = memb_im_fname
+    edge_median = back_id is not None and walls_str == 'L1_anticlinal'
+    tiled_signal, tiled_walls = tiled_quantify_walls(seg_im_fname, signal_fnames, membrane_dists, None, quantif_method,
+                                                     back_id, max_mem, tile_halo, crop_bbox, edge_median)
+    print "Done."
+
+    # - Cell layers, from the label adjacency merged across the z-tiles:
+    cell_layers = CellLayers(tiled_walls['adjacency'], back_id)
+    labels = cell_layers.labels_in(labels_str)
+    # -- Barycenters of each selected cells (in full image coordinates):
+    bary_scale = np.array(read_image_header(seg_im_fname)[1]) if real_bary else 1.
+    bary = {l: (tiled_walls['barycenter'][l] * bary_scale).tolist() for l in labels}
+
+    # -- Create a list of walls (ordered pairs of labels):
+    print "\n# - Compute the labelpair list of {} walls:".format(walls_str)
+    wall_labelpairs = cell_layers.walls(walls_str)
+    # -- Keep the walls with a (real) contact area greater than 'walls_min_area':
+    wall_area = cell_layers.adjacency.area_dict(real=True)
+    wall_labelpairs = [lp for lp in wall_labelpairs if wall_area[lp] >= walls_min_area]
+    n_lp = len(wall_labelpairs)
+    print "Found {} unique (ie. 'sorted') wall labelpairs!".format(n_lp)
+
+    # -- (Epidermis) wall (edge) medians, computed by the tile owning each wall:
+    wall_median = select_walls(tiled_walls['median'], tiled_walls['labelpairs'], wall_labelpairs)
+    n = np.count_nonzero(~np.isnan(wall_median).any(axis=1))
+    print "Median success rate: {}%".format(round(n/float(n_lp), 3)*100)
+    wall_normal_dir = {(lab1, lab2): compute_vect_direction(bary[lab1], bary[lab2]) for (lab1, lab2) in wall_labelpairs}
+    walls = wall_geometry(wall_labelpairs, wall_area, wall_median, wall_normal_dir)
+    dist_signal = select_walls(tiled_signal, tiled_walls['labelpairs'], wall_labelpairs)
 else:
-    print "\n# - Compute the wall median for selected walls:"
-    wall_median = memb.wall_medians(wall_labelpairs, real=False, min_area=None, verbose=True)
-n = len(set([stuple(k) for k, v in wall_median.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-# -- Compute PIN1 and PI signal for each side of the walls:
-print "\n# - Compute {} {} signal intensities:".format(signal_ch_name, quantif_method)
-PIN_left_signal = memb.get_membrane_signal(signal_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-n = len(set([stuple(k) for k, v in PIN_left_signal.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-print "\n# - Compute {} {} signal intensities:".format(membrane_ch_name, quantif_method)
-PI_left_signal = memb.get_membrane_signal(membrane_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-n = len(set([stuple(k) for k, v in PI_left_signal.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-# PI_left_signal = symetrize_labelpair_dict(PI_left_signal, oppose=False)
-# PIN_left_signal = symetrize_labelpair_dict(PIN_left_signal, oppose=False)
-PI_right_signal = invert_labelpair_dict(PI_left_signal)
-PIN_right_signal = invert_labelpair_dict(PIN_left_signal)
-
-# -- Compute PIN1 signal ratios:
-print "\n# - Compute {} {} signal ratios:".format(signal_ch_name, quantif_method)
-PIN_ratio = memb.get_membrane_signal_ratio(signal_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-n = len(set([stuple(k) for k, v in PIN_ratio.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-# -- Compute PI signal ratios:
-print "\n# - Compute {} {} signal ratios:".format(membrane_ch_name, quantif_method)
-PI_ratio = memb.get_membrane_signal_ratio(membrane_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-n = len(set([stuple(k) for k, v in PI_ratio.items() if v is not None]))
-print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
-
-PIN_ratio = symetrize_labelpair_dict(PIN_ratio, oppose=True, verbose=True)
-PI_ratio = symetrize_labelpair_dict(PI_ratio, oppose=True, verbose=True)
-
-
-# -- Compute PIN1 and PI total signal (sum each side of the wall):
-print "\n# - Compute {} and {} total {} signal:".format(signal_ch_name, membrane_ch_name, quantif_method)
-PIN_signal = memb.get_membrane_signal_total(signal_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-PIN_signal = symetrize_labelpair_dict(PIN_signal, oppose=False, verbose=True)
-PI_signal = memb.get_membrane_signal_total(membrane_ch_name, wall_labelpairs, membrane_dist, method=quantif_method, min_area=None)
-PI_signal = symetrize_labelpair_dict(PI_signal, oppose=False, verbose=True)
-print "Done."
-
-wall_normal_dir = {(lab1, lab2): compute_vect_direction(bary[lab1], bary[lab2]) for (lab1, lab2) in wall_labelpairs}
-dir_x, dir_y, dir_z = vector2dim(wall_normal_dir)
-ori_x, ori_y, ori_z = vector2dim(wall_median)
-
-PIN1_orientation = {lp: 1 if v>0 else -1 for lp, v in PIN_ratio.items()}
-
-significance = {lp: PI_significance(PI_left_signal[lp], PI_right_signal[lp]) for lp in PI_left_signal.keys()}
-
-wall_area = symetrize_labelpair_dict(wall_area, oppose=False, verbose=True)
-
-# -- Create a Pandas DataFrame:
-wall_df = pd.DataFrame().from_dict({membrane_ch_name+'_signal': PI_signal,
-                                    signal_ch_name+'_signal': PIN_signal,
-                                    membrane_ch_name+'_signal_left': PI_left_signal,
-                                    membrane_ch_name+'_signal_right': PI_right_signal,
-                                    signal_ch_name+'_signal_left': PIN_left_signal,
-                                    signal_ch_name+'_signal_right': PIN_right_signal,
-                                    signal_ch_name+'_orientation': PIN1_orientation,
-                                    'significance': significance,
-                                    'wall_center_x': ori_x, 'wall_center_y': ori_y, 'wall_center_z': ori_z,
-                                    'wall_normal_x': dir_x, 'wall_normal_y': dir_y, 'wall_normal_z': dir_z,
-                                    'wall_area': wall_area})
-
-# - Export to CSV:
-print "\nSaving CVS file: '{}'".format(out_fname)
-wall_df.to_csv(out_fname, index_label=['left_label', 'right_label'])
+    # -- Load (or compute & save) the wall index of the segmented image:
+    print "\n\n# - Wall index of the segmented image:"
+    walls_name = '{}-A{}-{}'.format(walls_str.replace('/', '_'), walls_min_area, 'real' if real_bary else 'voxel')
+    wall_index = cached_wall_index(seg_im_fname, seg_im, max(membrane_dists + [DEF_INDEX_DIST]), background=back_id, bbox=crop_bbox)
+    walls = wall_index.get_walls(walls_name)
+    if walls is None:
+        print "\n\n# - Initialise signal quantification class:"
+        quantif_ims = [sig_ims[ch_name] for ch_name in signal_ch_names] + [memb_im]
+        quantif_names = signal_ch_names + [membrane_ch_name]
+        memb = MembraneQuantif(seg_im, quantif_ims, quantif_names, background=back_id)
+
+        # - Label adjacency & cell layers, from a single pass over the segmented image:
+        if crop_bbox is None:
+            cell_layers = cached_cell_layers(seg_im_fname, seg_im, back_id)
+        else:
+            cell_layers = CellLayers.from_image(crop_array(seg_im, crop_bbox), back_id)
+
+        # - Cell-based information (barycenters):
+        # -- Get list of labels:
+        labels = cell_layers.labels_in(labels_str)
+        # -- Compute the barycenters of each selected cells, on the cropped image only (in full image coordinates):
+        print "\n# - Compute the barycenters of each selected cells:"
+        crop_offset = [start for start, _ in crop_bbox] if crop_bbox is not None else None
+        label_stats = label_statistics(crop_array(seg_im, crop_bbox), real=real_bary, voxelsize=seg_im.voxelsize, offset=crop_offset)
+        bary = stats2dict(label_stats, 'barycenter', labels)
+        print "Done."
+        # bary_x = {k: v[0] for k, v in bary.items()}
+        # bary_y = {k: v[1] for k, v in bary.items()}
+        # bary_z = {k: v[2] for k, v in bary.items()}
+
+        # -- Create a list of walls (ordered pairs of labels):
+        print "\n# - Compute the labelpair list of {} walls:".format(walls_str)
+        wall_labelpairs = cell_layers.walls(walls_str)
+
+        # -- Compute the area of each walls:
+        print "\n# - Compute the area of each walls:"
+        wall_area = memb.wall_area_from_labelpairs(wall_labelpairs, real=True)
+        print "Done."
+        # -- Keep the walls with a (real) area greater than 'walls_min_area':
+        wall_labelpairs = [lp for lp in wall_labelpairs if wall_area.get(lp) is not None and wall_area[lp] >= walls_min_area]
+        n_lp = len(wall_labelpairs)
+        print "Found {} unique (ie. 'sorted') wall labelpairs!".format(n_lp)
+
+        # -- Compute the (epidermis) wall (edge) median of each selected walls:
+        if back_id is not None and walls_str == 'L1_anticlinal':
+            print "\n# - Compute the epidermis wall edge median for selected walls:"
+            wall_median = memb.epidermal_wall_edges_median(wall_labelpairs, real=False, verbose=True)
+        else:
+            print "\n# - Compute the wall median for selected walls:"
+            wall_median = memb.wall_medians(wall_labelpairs, real=False, min_area=None, verbose=True)
+        n = len(set([stuple(k) for k, v in wall_median.items() if v is not None]))
+        print "Success rate: {}%".format(round(n/float(n_lp), 3)*100)
+        # -- Medians of the cropped segmented image, in full image (voxel) coordinates:
+        if crop_offset is not None:
+            wall_median = {lp: None if v is None else np.ravel(v) + crop_offset for lp, v in wall_median.items()}
+
+        wall_normal_dir = {(lab1, lab2): compute_vect_direction(bary[lab1], bary[lab2]) for (lab1, lab2) in wall_labelpairs}
+        # - Save the wall geometry to the index, for the next channels or methods:
+        wall_index.set_walls(walls_name, wall_labelpairs, wall_area, wall_median, wall_normal_dir)
+        wall_index.save(wall_index_dirname(seg_im_fname), arrays=wall_index.dirname is None)
+    else:
+        print "\n# - Loaded the labelpair list, area, median & normal of {} walls from the wall index.".format(walls_str)
+        wall_labelpairs = [tuple(lp) for lp in walls['labelpairs'].tolist()]
+        n_lp = len(wall_labelpairs)
+
+    # -- Wall geometry, ordered as the labelpair list:
+    walls = wall_index.get_walls(walls_name)
+
+    # -- Compute the signals of all channels for each side of the walls, their ratios & totals, in a single pass:
+    print "\n# - Compute {} & {} {} signal intensities, ratios & totals:".format(', '.join(signal_ch_names), membrane_ch_name, quantif_method)
+    if n_jobs > 1:
+        print "Using {} processes...".format(n_jobs)
+    signal_imgs = dict(sig_ims)
+    signal_imgs[membrane_ch_name] = memb_im
+    dist_signal = quantify_walls(wall_index, membrane_dists, wall_labelpairs, signal_imgs, quantif_method, n_jobs)
+
+for membrane_dist in membrane_dists:
+    print "\n# - Membrane distance: {}".format(membrane_dist)
+    wall_signal = dist_signal[membrane_dist]
+    for ch_name in signal_ch_names + [membrane_ch_name]:
+        n = np.count_nonzero(~np.isnan(wall_signal[ch_name]['ratio']))
+        print "{} success rate: {}%".format(ch_name, round(n/float(n_lp), 3)*100)
+
+    # -- Gather the wall quantities of all channels in a symmetric label-pair table:
+    wall_table = wall_signal_table(wall_labelpairs, walls, wall_signal, membrane_ch_name, signal_ch_names)
+
+    # - Export to table file:
+    print "Saving table file: '{}'".format(out_fnames[membrane_dist])
+    wall_table.sort().save(out_fnames[membrane_dist])
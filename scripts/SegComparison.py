@@ -6,10 +6,8 @@ from os.path import exists
 
 from timagetk.io import imread
 from timagetk.io import imsave
-from timagetk.plugins import registration
 from timagetk.wrapping import bal_trsf
 from timagetk.algorithms import apply_trsf
-from timagetk.algorithms import isometric_resampling
 
 # from timagetk.wrapping.bal_trsf import BalTransformation
 import sys, platform
@@ -24,12 +22,13 @@ else:
 sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from nomenclature import splitext_zip
-from nomenclature import get_nomenclature_name
-from nomenclature import get_nomenclature_channel_fname
-from nomenclature import get_nomenclature_segmentation_name
 from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
 from equalization import z_slice_contrast_stretch
+from stage_cache import StageCache
+from registration_pipeline import RegistrationSession
+from catalogue import DEF_DB
+from catalogue import ImageCatalogue
 
 # XP = 'E37'
 XP = sys.argv[1]
@@ -48,6 +47,9 @@ $ python SamMaps/scripts/TissueLab/rigid_registration_on_last_timepoint.py 'E37'
 """
 
 nom_file = SamMaps_dir + "nomenclature.csv"
+# - Path resolution & up-to-date checks use the catalogue, the CSV is only parsed when modified:
+cat = ImageCatalogue(SamMaps_dir + DEF_DB)
+cat.import_nomenclature(nom_file)
 
 
 # -1- CZI input infos:
@@ -68,6 +70,9 @@ czi_base_fname = base_fname + "-T{}.czi"
 extra_channels = list(set(channel_names) - set([ref_ch_name]))
 # By default do not recompute deformation when an associated file exist:
 force = False
+# Directory where the isometric images & chained transformations are cached:
+cache_dir = image_dirname + "registration_cache/"
+cache = StageCache(cache_dir)
 
 
 time_reg_list = [(t, time_steps[n+1]) for n, t in enumerate(time_steps[:-1])]
@@ -77,8 +82,9 @@ index2time = {t: n for n, t in time2index.items()}
 
 for t_float, t_ref in time_reg_list:
     # - Load intensity images filenames:
-    float_path_suffix, float_img_fname = get_nomenclature_channel_fname(czi_base_fname.format(t_float), nom_file, ref_ch_name)
-    ref_path_suffix, ref_img_fname = get_nomenclature_channel_fname(czi_base_fname.format(t_ref), nom_file, ref_ch_name)
+    float_path_suffix, float_img_fname = cat.channel_fname(czi_base_fname.format(t_float), ref_ch_name)
+    ref_path_suffix, ref_img_fname = cat.channel_fname(czi_base_fname.format(t_ref), ref_ch_name)
+    float_n_name = cat.nomenclature_name(czi_base_fname.format(t_float))
 
     # - Get RIGID registered images filenames:
     rig_float_path_suffix = float_path_suffix + 'rigid_registrations/'
@@ -87,45 +93,43 @@ for t_float, t_ref in time_reg_list:
         ref_path_suffix += 'rigid_registrations/'
         ref_img_fname = get_res_img_fname(ref_img_fname, index2time[time2index[t_ref]+1], t_ref, 'iso-rigid')
 
-    seg_path_suffix, seg_img_fname = get_nomenclature_segmentation_name(czi_base_fname.format(t_float), nom_file, ref_ch_name)
+    # - Rigid, affine & deformable registrations of this pair are chained, images being read once:
+    session = RegistrationSession(image_dirname + float_path_suffix + float_img_fname,
+                                  image_dirname + ref_path_suffix + ref_img_fname, cache=cache)
+
+    seg_path_suffix, seg_img_fname = cat.segmentation_fname(czi_base_fname.format(t_float), ref_ch_name)
     rig_seg_img_fname = get_res_img_fname(seg_img_fname, t_ref, t_float, 'iso-rigid')
     res_path = image_dirname + rig_float_path_suffix
 
     try:
-        assert exists(res_path + rig_seg_img_fname)
+        assert cat.is_current(res_path + rig_seg_img_fname, [image_dirname + seg_path_suffix + seg_img_fname])
     except:
         # - Get the result image file name & path (output path), and create it if necessary:
         if not exists(res_path):
             mkdir(res_path)
         print "\n# - RIGID registration for t{}/t{}:".format(time2index[t_float], time2index[t_ref])
-        py_hl = 3  # defines highest level of the blockmatching-pyramid
-        py_ll = 1  # defines lowest level of the blockmatching-pyramid
         print '  - t_{}h floating fname: {}'.format(t_float, float_img_fname)
-        im_float = imread(image_dirname + float_path_suffix + float_img_fname)
-        if float_img_fname.find('iso') == -1:  # if not isometric, resample!
-            im_float = isometric_resampling(im_float)
         print '  - t_{}h reference fname: {}'.format(t_ref, ref_img_fname)
-        im_ref = imread(image_dirname + ref_path_suffix + ref_img_fname)
-        if ref_img_fname.find('iso') == -1:  # if not isometric, resample!
-            im_ref = isometric_resampling(im_ref)
-        print ""
-        res_trsf, res_im = registration(im_float, im_ref, method='rigid_registration', pyramid_highest_level=py_hl, pyramid_lowest_level=py_ll)
+        res_trsf = session.run('rigid')
+        res_im = session.result('rigid')
         print ""
         # - Save result image and tranformation:
         print "Writing image file: {}".format(rig_float_img_fname)
         imsave(res_path + rig_float_img_fname, res_im)
+        cat.register(res_path + rig_float_img_fname, 'registration', float_n_name, ref_ch_name)
         # - Get result trsf filename:
         res_trsf_fname = get_res_trsf_fname(float_img_fname, t_ref, t_float, 'iso-rigid')
         print "Writing trsf file: {}".format(res_trsf_fname)
         res_trsf.write(res_path + res_trsf_fname)
         print "\nApplying estimated {} transformation on '{}' to segmented image:".format('rigid', ref_ch_name)
-        if not exists(res_path + rig_seg_img_fname):
+        if not cat.is_current(res_path + rig_seg_img_fname, [image_dirname + seg_path_suffix + seg_img_fname]):
             print "  - {}\n  --> {}".format(seg_img_fname, rig_seg_img_fname)
             # --- Read the segmented image file:
             seg_im = imread(image_dirname + seg_path_suffix + seg_img_fname)
             res_seg_im = apply_trsf(seg_im, res_trsf, param_str_2=' -nearest -param')
             # --- Apply and save registered segmented image:
             imsave(res_path + rig_seg_img_fname, res_seg_im)
+            cat.register(res_path + rig_seg_img_fname, 'registration', float_n_name, ref_ch_name + '_segmented')
         else:
             print "  - existing file: {}".format(rig_seg_img_fname)
 
@@ -140,22 +144,16 @@ for t_float, t_ref in time_reg_list:
 
     if not exists(res_path + res_trsf_fname) or force:
         print "\n# - DEFORMABLE registration for t{}/t{}:".format(time2index[t_float], time2index[t_ref])
-        py_hl = 3  # defines highest level of the blockmatching-pyramid
-        py_ll = 0  # defines lowest level of the blockmatching-pyramid
         print '  - t_{}h floating fname: {}'.format(t_float, float_img_fname)
-        im_float = imread(image_dirname + float_path_suffix + float_img_fname)
-        if float_img_fname.find('iso') == -1:  # if not isometric, resample!
-            im_float = isometric_resampling(im_float)
         print '  - t_{}h reference fname: {}'.format(t_ref, ref_img_fname)
-        im_ref = imread(image_dirname + ref_path_suffix + ref_img_fname)
-        if ref_img_fname.find('iso') == -1:  # if not isometric, resample!
-            im_ref = isometric_resampling(im_ref)
-        print ""
-        res_trsf, res_im = registration(im_float, im_ref, method='deformable_registration', pyramid_highest_level=py_hl, pyramid_lowest_level=py_ll)
+        # - Initialized by the affine registration, itself initialized by the rigid one:
+        res_trsf = session.run('deformable')
+        res_im = session.result('deformable')
         print ""
         # - Save result image and tranformation:
         print "Writing image file: {}".format(res_img_fname)
         imsave(res_path + res_img_fname, res_im)
+        cat.register(res_path + res_img_fname, 'registration', float_n_name, ref_ch_name)
         print "Writing trsf file: {}".format(res_trsf_fname)
         res_trsf.write(res_path + res_trsf_fname)
     # else:
@@ -168,7 +166,7 @@ for t_float, t_ref in time_reg_list:
     if exists(fname):
         print "\nApplying estimated {} transformation on '{}' to segmented image:".format('deformable', ref_ch_name)
         res_seg_img_fname = get_res_img_fname(seg_img_fname, t_ref, t_float, 'iso-deformable')
-        if not exists(res_path + res_seg_img_fname):
+        if not cat.is_current(res_path + res_seg_img_fname, [fname]):
             try:
                 res_trsf
             except NameError:
@@ -181,6 +179,7 @@ for t_float, t_ref in time_reg_list:
             res_seg_im = apply_trsf(seg_im, res_trsf, param_str_2=' -nearest -param')
             # --- Apply and save registered segmented image:
             imsave(res_path + res_seg_img_fname, res_seg_im)
+            cat.register(res_path + res_seg_img_fname, 'registration', float_n_name, ref_ch_name + '_segmented')
         else:
             print "  - existing file: {}".format(res_seg_img_fname)
     else:
@@ -189,7 +188,7 @@ for t_float, t_ref in time_reg_list:
     if t_ref != time_steps[-1]:
         ref_seg_fname = get_res_img_fname(seg_img_fname, t_ref, t_float, 'iso-deformable')
     else:
-        ref_path_suffix, ref_seg_fname = get_nomenclature_segmentation_name(czi_base_fname.format(t_ref), nom_file, ref_ch_name)
+        ref_path_suffix, ref_seg_fname = cat.segmentation_fname(czi_base_fname.format(t_ref), ref_ch_name)
 
     seg_imgA = image_dirname + ref_path_suffix + ref_seg_fname
     seg_imgB = res_path + res_seg_img_fname
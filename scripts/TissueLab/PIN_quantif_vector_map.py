@@ -4,7 +4,6 @@ from mayavi import mlab
 
 from os.path import split
 import numpy as np
-import pandas as pd
 import scipy.ndimage as nd
 
 from timagetk.io import imread
@@ -34,6 +33,10 @@ from nomenclature import get_nomenclature_channel_fname
 from nomenclature import get_nomenclature_segmentation_name
 from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
+from table_io import read_table
+from table_io import find_table
+from table_io import labelpair_dict
+from table_io import label_columns
 
 
 # XP = 'E35'
@@ -147,33 +150,6 @@ def compute_vect_direction(bary_ori, bary_dest):
     return [dx/norm, dy/norm, dz/norm]
 
 
-# - Functions to create label-pair dictionary from pandas DataFrame:
-def df2labelpair_dict(df, values_cname, lab1_cname="Unnamed: 0", lab2_cname="Unnamed: 1"):
-    """
-    Return a label-pair dictionary with df['values_cname'] as values, if this
-    values is different from NaN.
-
-    Parameters
-    ----------
-    df : pd.DataFrame
-        pandas dataframe containing the values
-    values_cname : str
-        dataframe column name containing the values to add to the dictionary
-    lab1_cname : str, optional
-        dataframe column name containing the first labels of the label-pairs
-    lab2_cname : str, optional
-        dataframe column name containing the second labels of the label-pairs
-
-    Returns
-    -------
-    dictionary {(label_1, label_2): values}
-    """
-    lab1 = df[lab1_cname].to_dict()
-    lab2 = df[lab2_cname].to_dict()
-    values = df[values_cname].to_dict()
-    return {(lab1[k], lab2[k]): v for k, v in values.items() if not np.isnan(v)}
-
-
 ###############################################################################
 # -- PIN1/PI signal & PIN1 polarity quatification:
 ###############################################################################
@@ -184,7 +160,7 @@ memb = MembraneQuantif(seg_im, [PIN_signal_im, PI_signal_im], ["PIN1", "PI"])
 cell_df_fname = image_dirname + path_suffix + splitext_zip(PI_signal_fname)[0] + '_cell_barycenters.csv'
 try:
     assert not force
-    cell_df = pd.read_csv(cell_df_fname)
+    cell_df = read_table(find_table(cell_df_fname))
 except:
     # - Get list of 'L1' labels:
     labels = memb.labels_checker('L1')
@@ -193,17 +169,15 @@ except:
     bary = memb.center_of_mass(labels, real_bary, verbose=True)
     print "Done."
 else:
-    labels = cell_df['Unnamed: 0'].to_dict()
-    bary_x = cell_df['bary_x'].to_dict()
-    bary_y = cell_df['bary_y'].to_dict()
-    bary_z = cell_df['bary_z'].to_dict()
-    bary = {v: np.array([bary_x[k], bary_y[k], bary_z[k]]) for k, v in labels.items()}
+    lab_cname, = label_columns(cell_df, ['label'])
+    labels = cell_df[lab_cname].values.tolist()
+    bary = dict(zip(labels, cell_df[['bary_x', 'bary_y', 'bary_z']].values))
 
 #  - Wall-based information (barycenters):
 wall_pd_fname = image_dirname + path_suffix + splitext_zip(PI_signal_fname)[0] + '_wall_PIN_PI_signal-D{}.csv'.format(membrane_dist)
 try:
     assert not force
-    wall_df = pd.read_csv(wall_pd_fname)
+    wall_df = read_table(find_table(wall_pd_fname))
 except:
     # - Create a list of anticlinal walls (ordered pairs of labels):
     L1_anticlinal_walls = memb.list_epidermis_anticlinal_walls(neighbors_min_area=walls_min_area, real_area=True)
@@ -225,15 +199,15 @@ except:
     print "Done."
 else:
     # - Retreive label-pair dictionaries:
-    wm_x = df2labelpair_dict(wall_df, 'wall_median_x')
-    wm_y = df2labelpair_dict(wall_df, 'wall_median_y')
-    wm_z = df2labelpair_dict(wall_df, 'wall_median_z')
+    wm_x = labelpair_dict(wall_df, 'wall_median_x')
+    wm_y = labelpair_dict(wall_df, 'wall_median_y')
+    wm_z = labelpair_dict(wall_df, 'wall_median_z')
     wall_median = {k: np.array([wm_x[k], wm_y[k], wm_z[k]]) for k in wm_x.keys()}
     # 'wall_median' keys are created by 'L1_anticlinal_walls' label pairs:
     L1_anticlinal_walls = [k for k in wall_median.keys()]
-    wall_area = df2labelpair_dict(wall_df, 'wall_area')
-    PI_ratio = df2labelpair_dict(wall_df, 'PI_{}_ratio'.format(ratio_method))
-    PIN_ratio = df2labelpair_dict(wall_df, 'PIN_{}_ratio'.format(ratio_method))
+    wall_area = labelpair_dict(wall_df, 'wall_area')
+    PI_ratio = labelpair_dict(wall_df, 'PI_{}_ratio'.format(ratio_method))
+    PIN_ratio = labelpair_dict(wall_df, 'PIN_{}_ratio'.format(ratio_method))
 
 
 # - Filter displayed PIN1 ratios by:
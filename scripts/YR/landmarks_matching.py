@@ -557,7 +557,17 @@ from timagetk.io import imsave
 from timagetk.components import TissueImage
 
 from vplants.tissue_analysis.lineage import Lineage
-from vplants.tissue_analysis.tissue_analysis import LabelProperty3D
+
+import sys, platform
+if platform.uname()[1] == "RDP-M7520-JL":
+    SamMaps_dir = '/data/Meristems/Carlos/SamMaps/'
+elif platform.uname()[1] == "calculus":
+    SamMaps_dir = '/projects/SamMaps/scripts/SamMaps_git/'
+else:
+    raise ValueError("Unknown custom path to 'SamMaps' for this system...")
+sys.path.append(SamMaps_dir+'/scripts/lib/')
+from label_statistics import label_statistics
+from label_adjacency import LabelAdjacency
 
 dir_path = '/data/Yassin/YR_01/'
 atlas_path = '/data/Yassin/YR_01_ATLAS_iso/'
@@ -618,19 +628,15 @@ for tp, ts in enumerate(atlas_time_steps[:-1]):
     mapping.update({1: 1})  # add background to mapping to avoid loosing it with `clear_unmapped=True`
     sim1 = relabel_from_mapping(sim1, mapping, clear_unmapped=True, verbose=True)
 
-    print("\n# - INITIALIZING LabelProperty3D OBJECTS:")
-    from vplants.tissue_analysis.tissue_analysis import TissueAnalysis
-    tissue0 = LabelProperty3D(sim0, background=1)
-    tissue1 = LabelProperty3D(sim1, background=1)
+    print("\n# - COMPUTING LABEL ADJACENCY GRAPH & BARYCENTERS:")
+    adjacency0 = LabelAdjacency.from_image(sim0)
+    bary0 = label_statistics(sim0, real=False)['barycenter']
 
     print("\n# - EXTRACTING AVERAGE DISTANCE TO NEIGHBORS:")
-    # - Compute average distance to neighbors (in VOXELS):
-    d2n0 = tissue0.distance_to_neighbors(real=False)
-    d2n1 = tissue1.distance_to_neighbors(real=False)
-
-    dist = []
-    for k, v in d2n0.items():
-        dist.extend(v)
+    # - Compute average distance to neighbors (in VOXELS), without background & `no_label_id`:
+    pairs, _, _ = adjacency0.pairs()
+    pairs = pairs[~np.in1d(pairs, [0, 1]).reshape(-1, 2).any(axis=1)]
+    dist = np.linalg.norm(bary0[pairs[:, 0]] - bary0[pairs[:, 1]], axis=1)
     av_dist.append(np.mean(dist))
 
 print("\n# - AVERAGE DISTANCE TO NEIGHBORS:", av_dist)
@@ -0,0 +1,263 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Convert a batch of images (CZI, LSM, INR, TIF...) to a given format using a
+pool of processes.
+
+Files are given as a list of filenames or glob patterns, or by a nomenclature
+CSV file. Multi-channel images are exported to one file per channel.
+Outputs newer than their source are skipped, and a CSV manifest of the
+produced files is written. A file failing to convert does not stop the batch,
+the error is recorded in the manifest.
+
+Examples
+--------
+$ python batch_convert.py "/data/PIN_maps/*.czi" --channel_names DIIV PIN1 PI TagBFP CLV3 --out_fmt cimg --n_jobs 8
+$ python batch_convert.py --nomenclature nomenclature.csv --input_dir /data/lsm/ --out_dir /data/inr/ --n_jobs 8
+"""
+
+import time
+import argparse
+import pandas as pd
+from glob import glob
+from os import makedirs
+from os.path import join
+from os.path import exists
+from os.path import dirname
+from os.path import getsize
+from os.path import getmtime
+from os.path import basename
+from multiprocessing import Pool
+
+import sys, platform
+if platform.uname()[1] == "RDP-M7520-JL":
+    SamMaps_dir = '/data/Meristems/Carlos/SamMaps/'
+elif platform.uname()[1] == "calculus":
+    SamMaps_dir = '/projects/SamMaps/scripts/SamMaps_git/'
+else:
+    raise ValueError("Unknown custom path to 'SamMaps' for this system...")
+sys.path.append(SamMaps_dir+'/scripts/lib/')
+
+from nomenclature import splitext_zip
+from nomenclature import get_nomenclature_name
+from lazy_reader import czi_n_channels
+from lazy_reader import lsm_n_channels
+from segmentation_pipeline import read_image
+from segmentation_pipeline import save_image
+
+SUPPORTED_FMT = ['inr', 'inr.gz', 'tif', 'cimg']
+DEF_MANIFEST = 'conversion_manifest.csv'
+
+
+# PARAMETERS:
+# -----------
+parser = argparse.ArgumentParser(description='Convert a batch of images to a given format in parallel.')
+# positional arguments:
+parser.add_argument('inputs', type=str, nargs='*',
+                    help="list of files or glob patterns (quoted) of the images to convert")
+# optional arguments:
+parser.add_argument('--nomenclature', type=str, default="",
+                    help="if specified, convert the files listed in this nomenclature CSV and name the outputs after their nomenclature name, None by default")
+parser.add_argument('--input_dir', type=str, default="",
+                    help="directory containing the files listed in the nomenclature CSV, the directory of the CSV by default")
+parser.add_argument('--channel_names', type=str, nargs='+', default=None,
+                    help="list of channel names of the multi-channel images, their index by default")
+parser.add_argument('--out_channels', type=str, nargs='+', default=None,
+                    help="list of channel names to export from multi-channel images, 'all' by default")
+parser.add_argument('--out_fmt', type=str, default='inr',
+                    help="format of the files to write, accepted formats are: {}, 'inr' by default".format(SUPPORTED_FMT))
+parser.add_argument('--out_dir', type=str, default="",
+                    help="directory where to write the converted files, next to their source by default")
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of processes used to convert the files, '1' by default")
+parser.add_argument('--manifest', type=str, default="",
+                    help="filename of the CSV manifest of produced files, '{}' in the output directory by default".format(DEF_MANIFEST))
+parser.add_argument('--force', action='store_true',
+                    help="if given, convert the files even if their outputs are up to date, 'False' by default")
+
+
+###############################################################################
+# -- EXTRA functions:
+###############################################################################
+def n_channels(im_fname):
+    """
+    Return the number of channels of an image, from its header for CZI & LSM.
+    """
+    if im_fname.endswith('.czi'):
+        return czi_n_channels(im_fname)
+    elif im_fname.endswith('.lsm'):
+        return lsm_n_channels(im_fname)
+    else:
+        return 1
+
+
+def up_to_date(src_fname, out_fname):
+    """
+    Return True if 'out_fname' exists and is newer than 'src_fname'.
+    """
+    return exists(out_fname) and getmtime(out_fname) >= getmtime(src_fname)
+
+
+def conversion_job(src_fname, out_base, channel_names, out_channels, ext):
+    """
+    Return the conversion job of a source file as (src_fname, channel_names,
+    outputs) where 'outputs' is a list of (channel, out_fname), the channel
+    being None for single channel images.
+    """
+    nb_ch = n_channels(src_fname)
+    if nb_ch == 1:
+        return src_fname, None, [(None, out_base + ext)]
+    if channel_names is None:
+        channel_names = [str(n) for n in range(nb_ch)]
+    try:
+        assert len(channel_names) == nb_ch
+    except AssertionError:
+        raise ValueError("Not enought channel names ({}) for image channels ({}) of '{}'!".format(len(channel_names), nb_ch, src_fname))
+    chs = channel_names if out_channels is None else [ch for ch in channel_names if ch in out_channels]
+    return src_fname, channel_names, [(ch, out_base + '_{}'.format(ch) + ext) for ch in chs]
+
+
+def convert(job):
+    """
+    Convert a source file to its outputs, only decoding the required channels.
+    Errors are caught, so a failing file does not abort the whole batch, and
+    recorded in the 'error' column of the outputs not converted.
+
+    Returns
+    -------
+    list
+        list of manifest rows (dict)
+    """
+    src_fname, channel_names, outputs = job
+    t_start = time.time()
+    rows = []
+    try:
+        img = read_image(src_fname, channel_names, lazy=True)
+        if channel_names is None and hasattr(img, 'keys'):
+            img = img.values()[0]  # single channel CZI
+        for ch, out_fname in outputs:
+            if not exists(dirname(out_fname) or '.'):
+                try:
+                    makedirs(dirname(out_fname))
+                except OSError:
+                    pass  # created by another process
+            save_image(out_fname, img if ch is None else img[ch])
+            if ch is not None:
+                img.release(ch)
+            rows.append({'source': src_fname, 'channel': ch, 'output': out_fname, 'status': 'converted'})
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+        done = [row['output'] for row in rows]
+        rows.extend([{'source': src_fname, 'channel': ch, 'output': out_fname, 'status': 'failed', 'error': error}
+                     for ch, out_fname in outputs if out_fname not in done])
+    elapsed = time.time() - t_start
+    for row in rows:
+        row['source_size_Mb'] = getsize(src_fname) / 2. ** 20
+        row['elapsed_time'] = elapsed / len(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    # - Variables definition from optional arguments parsing:
+    ext = '.' + args.out_fmt
+    try:
+        assert args.out_fmt in SUPPORTED_FMT
+    except AssertionError:
+        raise TypeError("Unkown output file format '{}', supported formats are: '{}'.".format(args.out_fmt, SUPPORTED_FMT))
+    n_jobs = args.n_jobs
+    try:
+        assert n_jobs > 0
+    except AssertionError:
+        raise ValueError("The number of jobs should be strictly positive!")
+    out_dir = args.out_dir
+    force = args.force
+    if force:
+        print "WARNING: any existing image will be overwritten!"
+
+    # - List the files to convert and their output base filenames:
+    sources = []
+    if args.nomenclature != "":
+        input_dir = args.input_dir if args.input_dir != "" else dirname(args.nomenclature)
+        for fname, n_name in get_nomenclature_name(args.nomenclature).items():
+            src_fname = join(input_dir, fname)
+            # - Follow the nomenclature folder organisation, see `get_nomenclature_channel_fname`:
+            n_dir = out_dir if out_dir != "" else dirname(src_fname)
+            sources.append((src_fname, join(n_dir, n_name, n_name)))
+    for pattern in args.inputs:
+        fnames = sorted(glob(pattern))
+        if fnames == []:
+            print "WARNING: no file found matching '{}'!".format(pattern)
+        for fname in fnames:
+            out_base = splitext_zip(fname)[0]
+            if out_dir != "":
+                out_base = join(out_dir, basename(out_base))
+            sources.append((fname, out_base))
+    try:
+        assert sources != []
+    except AssertionError:
+        raise ValueError("No file to convert, please give a list of files or a nomenclature CSV!")
+
+    # - Skip the up-to-date outputs, by modification time:
+    jobs, manifest = [], []
+    for src_fname, out_base in sources:
+        if not exists(src_fname):
+            print "WARNING: missing source file '{}'!".format(src_fname)
+            continue
+        try:
+            src_fname, channel_names, outputs = conversion_job(src_fname, out_base, args.channel_names, args.out_channels, ext)
+        except Exception as e:
+            print "WARNING: could not read the header of '{}'!".format(src_fname)
+            manifest.append({'source': src_fname, 'channel': None, 'output': None, 'status': 'failed',
+                             'error': "{}: {}".format(type(e).__name__, e)})
+            continue
+        todo = []
+        for ch, out_fname in outputs:
+            if up_to_date(src_fname, out_fname) and not force:
+                manifest.append({'source': src_fname, 'channel': ch, 'output': out_fname, 'status': 'up_to_date'})
+            else:
+                todo.append((ch, out_fname))
+        if todo != []:
+            jobs.append((src_fname, channel_names, todo))
+    print "Found {} files to convert, {} outputs are up to date.".format(len(jobs), len(manifest))
+
+    # - Performs conversions in a pool of processes:
+    t_start = time.time()
+    n_files, n_failed, size = 0, 0, 0.
+    if n_jobs == 1:
+        results = (convert(job) for job in jobs)
+    else:
+        pool = Pool(n_jobs)
+        results = pool.imap_unordered(convert, jobs)
+    for rows in results:
+        n_files += 1
+        size += rows[0]['source_size_Mb']
+        manifest.extend(rows)
+        elapsed = time.time() - t_start
+        failed = [row for row in rows if row['status'] == 'failed']
+        if failed != []:
+            n_failed += 1
+            print "[{}/{}] FAILED to convert '{}': {}".format(n_files, len(jobs), rows[0]['source'], failed[0]['error'])
+        else:
+            print "[{}/{}] Converted '{}' ({:.1f} Mb/s, {:.2f} files/s)".format(n_files, len(jobs), rows[0]['source'], size / elapsed, n_files / elapsed)
+    if n_jobs > 1:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - t_start
+    if n_files > 0:
+        print "Processed {} files ({:.1f} Mb) in {}s: {:.1f} Mb/s, {:.2f} files/s".format(n_files, size, round(elapsed, 1), size / elapsed, n_files / elapsed)
+    if n_failed > 0:
+        print "WARNING: {} files failed to convert, see the 'error' column of the manifest!".format(n_failed)
+
+    # - Write the manifest of produced files:
+    manifest_fname = args.manifest
+    if manifest_fname == "":
+        manifest_fname = join(out_dir, DEF_MANIFEST)
+    pd.DataFrame(manifest, columns=['source', 'channel', 'output', 'status', 'error', 'source_size_Mb', 'elapsed_time']).to_csv(manifest_fname, index=False)
+    print "Saved manifest of produced files under '{}'".format(manifest_fname)
@@ -9,7 +9,8 @@
 Allows to crop (single channel) image(s) around a given bounding box (ie. start
 & stop values along defined matrix dimensions).
 
-Selection of output format is possible between 'inr' & 'tif'.
+Selection of output format is possible between 'inr', 'tif' & 'cimg' (chunked
+container).
 """
 
 import sys, platform
@@ -23,20 +24,21 @@ sys.path.append(SamMaps_dir+'/scripts/lib')
 
 from nomenclature import splitext_zip
 from segmentation_pipeline import read_image
-from timagetk.io import imsave
-from timagetk.components import SpatialImage
+from segmentation_pipeline import read_image_header
+from segmentation_pipeline import save_image
+from segmentation_pipeline import crop_bbox
 from timagetk.algorithms.resample import isometric_resampling
 
-from vplants.tissue_analysis.signal_quantification import get_infos
-from vplants.tissue_analysis.signal_quantification import crop_image
-
 import argparse
+import numpy as np
 parser = argparse.ArgumentParser(description='Crop an image given boundaries.')
 # positional arguments:
 parser.add_argument('im2crop', type=str, nargs='+',
                     help="file or list of files containing image(s) to crop.")
 
-POSS_FMT = ["inr", "tif"]
+POSS_FMT = ["inr", "tif", "cimg"]
+# Margin (in voxels) read around the bounding box for interpolation with '--iso':
+ISO_MARGIN = 2
 # optional arguments:
 parser.add_argument('--x_bound', type=int, nargs=2, default=[0, -1],
                     help="lower and upper limit for the x-axis, starts at '0', ends at '-1'")
@@ -47,7 +49,7 @@ parser.add_argument('--z_bound', type=int, nargs=2, default=[0, -1],
 parser.add_argument('--out_fmt', type=str, default='inr',
                     help="format of the file to write, accepted formats are: {}.".format(POSS_FMT))
 parser.add_argument('--iso', action='store_true',
-                    help="if given, performs resampling to isometric voxelsize before cropping, 'False' by default")
+                    help="if given, performs resampling to isometric voxelsize before cropping (bounds are then given in the isometric image), 'False' by default")
 
 args = parser.parse_args()
 
@@ -76,11 +78,10 @@ shape_list = []
 vxs_list = []
 ndim_list = []
 for im2crop_fname in im2crop_fnames:
-    # TODO: would be nice to access ONLY the file header to get those info:
-    im2crop = read_image(im2crop_fname)
-    shape_list.append(im2crop.shape)
-    vxs_list.append(im2crop.voxelsize)
-    ndim_list.append(im2crop.ndim)
+    shape, vxs = read_image_header(im2crop_fname)
+    shape_list.append(shape)
+    vxs_list.append(vxs)
+    ndim_list.append(len(shape))
 
 # - Check dimensionality:
 ndim = ndim_list[0]
@@ -117,25 +118,30 @@ for n, ax in enumerate(axis2check):
         except:
             raise ValueError("Voxelsize missmatch along axis {} ({}) among list of images!".format(axis[n], n))
 
-for im2crop_fname in im2crop_fnames:
-    print "\n\n# - Reading image file {}...".format(im2crop_fname)
-    im2crop = read_image(im2crop_fname)
-    print "Done."
+for n_im, im2crop_fname in enumerate(im2crop_fnames):
+    shape, vxs = shape_list[n_im], vxs_list[n_im]
+    print "\nGot original shape: {}".format(shape)
+    print "Got original voxelsize: {}".format(vxs)
     # - Create output filename:
     out_fname = splitext_zip(im2crop_fname)[0]
-    # - Performs isometric resampling if required:
+    print "\n\n# - Reading the bounding box of image file {}...".format(im2crop_fname)
     if iso:
         out_fname += '-iso'
-        im2crop = isometric_resampling(im2crop)
-    # - Get original image infos:
-    shape, ori, vxs, md = get_infos(im2crop)
-    print "\nGot original shape: {}".format(shape)
-    print "Got original voxelsize: {}".format(vxs)
-    # - Crop the image:
-    bounding_box = []
-    for n in range(ndim):
-        bounding_box.extend([lower_bounds[n], upper_bounds[n]])
-    im = crop_image(im2crop, bounding_box)
+        # - Bounds are given in the isometric image, convert them to the original one:
+        iso_vxs = min(vxs)
+        iso_shape = [int(round(sh * v / iso_vxs)) for sh, v in zip(shape, vxs)]
+        iso_bbox = [[lower_bounds[n], (upper_bounds[n] if upper_bounds[n] != -1 else iso_shape[n] - 1) + 1] for n in range(ndim)]
+        # - Only read the bounding box and the margin required by interpolation:
+        bbox = [[max(0, int(np.floor(lo * iso_vxs / v)) - ISO_MARGIN), min(sh, int(np.ceil(up * iso_vxs / v)) + ISO_MARGIN)] for (lo, up), v, sh in zip(iso_bbox, vxs, shape)]
+        im = read_image(im2crop_fname, bbox=bbox)
+        # - Performs isometric resampling on the cropped region only:
+        im = isometric_resampling(im)
+        offset = [int(round(lo - start * v / iso_vxs)) for (lo, _), (start, _), v in zip(iso_bbox, bbox, vxs)]
+        im = crop_bbox(im, [[o, o + up - lo] for o, (lo, up) in zip(offset, iso_bbox)])
+    else:
+        bbox = [[lower_bounds[n], (upper_bounds[n] if upper_bounds[n] != -1 else shape[n] - 1) + 1] for n in range(ndim)]
+        im = read_image(im2crop_fname, bbox=bbox)
+    print "Done."
     # - Add cropping region to filename:
     for n, ax in enumerate(axis):
         if lower_bounds[n] != 0  or upper_bounds[n] != -1:
@@ -144,4 +150,4 @@ for im2crop_fname in im2crop_fnames:
     out_fname += '.' + ext
     print "\nSaving file: '{}'".format(out_fname)
     # - Save the cropped-image:
-    imsave(out_fname, im)
+    save_image(out_fname, im)
@@ -9,7 +9,8 @@
 Allows to extract (single channel) image(s) from a given CZI with its list of
 channel names.
 
-Selection of output format is possible between 'inr' & 'tif'.
+Selection of output format is possible between 'inr', 'tif' & 'cimg' (chunked
+container).
 Limitation of outputed channel is possible.
 
 Examples
@@ -20,7 +21,6 @@ $ ipython czi_convert "PIN1-CFP-Ler-E99-LD-SAM3.czi" "PIN1" "PI" --out_fmt tif
 import argparse
 from os.path import exists
 from os.path import splitext
-from timagetk.io import imsave
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -35,8 +35,9 @@ sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from nomenclature import exists_file
 from segmentation_pipeline import read_image
+from segmentation_pipeline import save_image
 
-SUPPORTED_FMT = ['inr', 'tif', 'tiff']
+SUPPORTED_FMT = ['inr', 'tif', 'tiff', 'cimg']
 
 # PARAMETERS:
 # -----------
@@ -47,8 +48,8 @@ parser.add_argument('czi', type=str,
 parser.add_argument('channel_names', type=str, nargs='+',
                     help="list of channel names found in the given CZI, numbers by default")
 # optional arguments:
-parser.add_argument('--pattern', type=str, default='..CZXY.',
-                    help="defines the CZI ordering of the data, often '..CZXY.' or '.C.ZXY.'")
+parser.add_argument('--pattern', type=str, default=None,
+                    help="if given, defines the CZI ordering of the data, often '..CZXY.' or '.C.ZXY.', and the whole CZI is loaded at once, else the ordering is read from the CZI header and each channel is decoded only when exported")
 parser.add_argument('--out_fmt', type=str, default='inr',
                     help="format of the file(s) to write.")
 parser.add_argument('--out_channels', type=str, nargs='+', default="",
@@ -87,7 +88,10 @@ else:
     print "Existing images will be kept!"
 
 # - Loading the CZI to convert:
-czi_im = read_image(czi_fname, channel_names, pattern)
+if pattern is None:
+    czi_im = read_image(czi_fname, channel_names, lazy=True)
+else:
+    czi_im = read_image(czi_fname, channel_names, pattern)
 nb_ch = len(czi_im)
 
 # -- Restricted list of channel to convert:
@@ -112,4 +116,6 @@ for ch in out_channels:
     else:
         im = czi_im[ch]
         print "\n - Saving channel '{}' under: '{}'".format(ch ,img_fname)
-        imsave(img_fname, im)
+        save_image(img_fname, im)
+        if pattern is None:
+            czi_im.release(ch)
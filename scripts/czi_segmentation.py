@@ -9,7 +9,6 @@
 import argparse
 from os.path import exists
 
-from timagetk.io import imsave
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -24,8 +23,11 @@ sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from nomenclature import exists_file
 from segmentation_pipeline import seg_pipe
+from segmentation_pipeline import seg_pipe_sweep
 from segmentation_pipeline import read_image
 from segmentation_pipeline import segmentation_fname
+from segmentation_pipeline import save_image
+from stage_cache import StageCache
 
 # - DEFAULT variables:
 # Reference channel name used to compute tranformation matrix:
@@ -47,8 +49,8 @@ parser = argparse.ArgumentParser(description='Consecutive backward registration.
 # positional arguments:
 parser.add_argument('czi', type=str,
                     help="filename of the (multi-channel) CZI to segment.")
-parser.add_argument('h_min', type=int,
-                    help="value to use for minimal h-transform extraction.")
+parser.add_argument('h_min', type=int, nargs='+',
+                    help="value, or list of values, to use for minimal h-transform extraction.")
 # optional arguments:
 parser.add_argument('--seg_ch_name', type=str, default=DEF_MEMB_CH,
                     help="channel name containing intensity image to segment, '{}' by default".format(DEF_MEMB_CH))
@@ -67,12 +69,28 @@ parser.add_argument('--substract_ch_name', type=str, default="",
 parser.add_argument('--output_fname', type=str, default="",
                     help="if specified, the filename of the labbeled image, by default automatic naming contains some infos about the procedure")
 
+parser.add_argument('--out_fmt', type=str, default='inr',
+                    help="format of the segmented image file to write (eg. 'inr', 'tif' or 'cimg' for the chunked container), 'inr' by default")
+
+parser.add_argument('--seed_max_mem', type=float, default=None,
+                    help="if specified, memory ceiling (in Mb) of the seed detection only, performed by overlapping z-slabs (the watershed still uses the whole image), requires '--tmp_dir', None by default")
+parser.add_argument('--tmp_dir', type=str, default=None,
+                    help="directory used to memory-map the smoothed and seed stacks, required with '--seed_max_mem', None by default")
+parser.add_argument('--cache_dir', type=str, default=None,
+                    help="if specified, directory used to cache intermediate images (rescaled, smoothed, seeds...), None by default")
+parser.add_argument('--cache_size', type=float, default=None,
+                    help="maximum size (in Mb) of the cache directory, least recently used images are removed first, unlimited by default")
+
 parser.add_argument('--iso', action='store_true',
                     help="if given, performs resampling to isometric voxelsize before segmentation, 'False' by default")
 parser.add_argument('--equalize', action='store_true',
                     help="if given, performs adaptative equalization of the intensity image to segment, 'False' by default")
 parser.add_argument('--stretch', action='store_true',
                     help="if given, performs contrast strectching of the intensity image to segment, 'False' by default")
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of processes used to segment the image when several 'h_min' are given, '1' by default")
+parser.add_argument('--local_reflood', action='store_true',
+                    help="if given, cells smaller than 'min_cell_volume' are removed by re-flooding only their region, 'False' by default")
 parser.add_argument('--to_8bits', action='store_true',
                     help="if given, performs 16 to 8bits conversion before h-minima detection")
 parser.add_argument('--force', action='store_true',
@@ -83,7 +101,7 @@ args = parser.parse_args()
 # - Variables definition from argument parsing:
 czi_fname = args.czi
 exists_file(czi_fname)
-h_min = args.h_min
+h_min_list = args.h_min
 # - Variables definition from optional arguments:
 seg_ch_name = args.seg_ch_name
 print "Got '{}' as the reference channel name.".format(seg_ch_name)
@@ -101,6 +119,24 @@ except AssertionError:
 
 output_fname =  args.output_fname
 
+seed_max_mem = args.seed_max_mem
+tmp_dir = args.tmp_dir
+if seed_max_mem is not None:
+    try:
+        assert seed_max_mem > 0.
+    except AssertionError:
+        raise ValueError("Negative memory ceiling!")
+    try:
+        assert tmp_dir is not None
+    except AssertionError:
+        raise ValueError("Option '--seed_max_mem' requires a '--tmp_dir'!")
+    print "Seed detection will be performed by z-slabs using at most {}Mb.".format(seed_max_mem)
+
+cache = None
+if args.cache_dir is not None:
+    cache = StageCache(args.cache_dir, args.cache_size)
+    print "Intermediate images will be cached under '{}'.".format(args.cache_dir)
+
 force =  args.force
 if force:
     print "WARNING: any existing segmentation image will be overwritten!"
@@ -108,21 +144,39 @@ else:
     print "Existing segmentation will be kept!"
 
 if output_fname != "":
-    seg_img_fname = output_fname
+    try:
+        assert len(h_min_list) == 1
+    except AssertionError:
+        raise ValueError("Can not use '--output_fname' with several 'h_min' values!")
+    seg_img_fnames = {h_min_list[0]: output_fname}
 else:
-    seg_img_fname = segmentation_fname(czi_fname, h_min, args.iso, args.equalize, args.stretch)
-print seg_img_fname
+    seg_img_fnames = {h_min: segmentation_fname(czi_fname, h_min, args.iso, args.equalize, args.stretch, args.out_fmt) for h_min in h_min_list}
+
+# - Skip the h-minima values with an existing segmentation:
+for h_min in h_min_list:
+    print seg_img_fnames[h_min]
+    if exists(seg_img_fnames[h_min]) and not force:
+        print "Found existing segmentation file: {}".format(seg_img_fnames[h_min])
+        seg_img_fnames.pop(h_min)
 
-if exists(seg_img_fname) and not force:
-    print "Found existing segmentation file: {}".format(seg_img_fname)
+if seg_img_fnames == {}:
     print "ABORT!"
 else:
-    czi_im = read_image(czi_fname, channel_names)
+    czi_im = read_image(czi_fname, channel_names, lazy=True)
     im2seg = czi_im[seg_ch_name]
     if substract_ch_name != "":
         im2sub = czi_im[substract_ch_name]
     else:
         im2sub = None
-    seg_im = seg_pipe(im2seg, h_min, im2sub, args.iso, args.equalize, args.stretch, args.std_dev, min_cell_volume, args.back_id, args.to_8bits)
-    print "\n - Saving segmentation under '{}'".format(seg_img_fname)
-    imsave(seg_img_fname, seg_im)
+    if len(seg_img_fnames) == 1:
+        h_min, seg_img_fname = seg_img_fnames.items()[0]
+        seg_im = seg_pipe(im2seg, h_min, im2sub, args.iso, args.equalize, args.stretch, args.std_dev, min_cell_volume, args.back_id, args.to_8bits, seed_max_mem, tmp_dir, cache, args.local_reflood)
+        print "\n - Saving segmentation under '{}'".format(seg_img_fname)
+        save_image(seg_img_fname, seg_im)
+    else:
+        try:
+            assert seed_max_mem is None
+        except AssertionError:
+            raise ValueError("Can not use '--seed_max_mem' with several 'h_min' values!")
+        del czi_im
+        seg_pipe_sweep(im2seg, sorted(seg_img_fnames.keys()), im2sub, args.iso, args.equalize, args.stretch, args.std_dev, min_cell_volume, args.to_8bits, args.n_jobs, seg_img_fnames, cache, args.local_reflood)
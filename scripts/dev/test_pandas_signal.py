@@ -2,7 +2,6 @@
 from os.path import split
 from os.path import exists
 import numpy as np
-import pandas as pd
 
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
@@ -25,6 +24,9 @@ from nomenclature import get_nomenclature_channel_fname
 from nomenclature import get_nomenclature_segmentation_name
 from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
+from table_io import read_table
+from table_io import find_table
+from table_io import labelpair_dict
 
 # XP = sys.argv[1]
 # SAM = sys.argv[2]
@@ -65,32 +67,6 @@ def PIN_polarity_area(PIN_ratio, area):
     return area * PIN_polarity(PIN_ratio)
 
 
-def df2labelpair_dict(df, values_cname, lab1_cname="Unnamed: 0", lab2_cname="Unnamed: 1"):
-    """
-    Return a label-pair dictionary with df['values_cname'] as values, if this
-    values is different from NaN.
-
-    Parameters
-    ----------
-    df : pd.DataFrame
-        pandas dataframe containing the values
-    values_cname : str
-        dataframe column name containing the values to add to the dictionary
-    lab1_cname : str, optional
-        dataframe column name containing the first labels of the label-pairs
-    lab2_cname : str, optional
-        dataframe column name containing the second labels of the label-pairs
-
-    Returns
-    -------
-    dictionary {(label_1, label_2): values}
-    """
-    lab1 = df[lab1_cname].to_dict()
-    lab2 = df[lab2_cname].to_dict()
-    values = df[values_cname].to_dict()
-    return {(lab1[k], lab2[k]): v for k, v in values.items() if not np.isnan(v)}
-
-
 # - Filter displayed PIN1 ratios by:
 #    - a minimal wall area (already done when computing list of L1 anticlinal walls)
 #    - a minimum PI ratio to prevent badbly placed wall to bias the PIN ratio
@@ -137,8 +113,8 @@ for tp in time_steps:
 
     # - Wall-based information:
     wall_pd_fname = image_dirname + splitext_zip(PI_signal_fname)[0] + '_wall_PIN_PI_signal-D{}.csv'.format(membrane_dist)
-    wall_df = pd.read_csv(wall_pd_fname)
-    PI_ratio = df2labelpair_dict(wall_df, 'PI_{}_ratio'.format(ratio_method))
+    wall_df = read_table(find_table(wall_pd_fname))
+    PI_ratio = labelpair_dict(wall_df, 'PI_{}_ratio'.format(ratio_method))
     PI_ratio_list.append(PI_ratio.values())
     label_list.append('t{}h (n={})'.format(tp, len(PI_ratio)))
 
@@ -190,9 +166,9 @@ for tp in time_steps:
 
     #  - Wall-based information:
     wall_pd_fname = image_dirname + splitext_zip(PI_signal_fname)[0] + '_wall_PIN_PI_signal-D{}.csv'.format(membrane_dist)
-    wall_df = pd.read_csv(wall_pd_fname)
-    PIN_total_mean = df2labelpair_dict(wall_df, 'PIN_total_mean')
-    PI_total_mean = df2labelpair_dict(wall_df, 'PI_total_mean')
+    wall_df = read_table(find_table(wall_pd_fname))
+    PIN_total_mean = labelpair_dict(wall_df, 'PIN_total_mean')
+    PI_total_mean = labelpair_dict(wall_df, 'PI_total_mean')
     PIN_total_mean_list.append(PIN_total_mean.values())
     PI_total_mean_list.append(PI_total_mean.values())
     label_list.append("{}".format(tp))
@@ -231,9 +207,9 @@ for tp in time_steps:
         # Get RIDIG registered on last time-point filename:
         PI_signal_fname = get_res_img_fname(PI_signal_fname, time_steps[-1], tp, 'rigid')
 
-    wall_df = pd.read_csv(wall_pd_fname)
-    PIN_total_mean = df2labelpair_dict(wall_df, 'PIN_total_mean')
-    PI_total_mean = df2labelpair_dict(wall_df, 'PI_total_mean')
+    wall_df = read_table(find_table(wall_pd_fname))
+    PIN_total_mean = labelpair_dict(wall_df, 'PIN_total_mean')
+    PI_total_mean = labelpair_dict(wall_df, 'PI_total_mean')
     maxi = np.max([maxi, np.max(PIN_total_mean.values() + PI_total_mean.values())]) * 1.01
     subaxes.plot(PIN_total_mean.values(), PI_total_mean.values(), '.', label=czi_fname[:-4])
 
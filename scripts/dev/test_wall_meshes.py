@@ -45,6 +45,20 @@ from copy import deepcopy
 
 import os
 import logging
+
+import sys, platform
+if platform.uname()[1] == "RDP-M7520-JL":
+    SamMaps_dir = '/data/Meristems/Carlos/SamMaps/'
+elif platform.uname()[1] == "calculus":
+    SamMaps_dir = '/projects/SamMaps/scripts/SamMaps_git/'
+else:
+    raise ValueError("Unknown custom path to 'SamMaps' for this system...")
+sys.path.append(SamMaps_dir+'/scripts/lib/')
+
+from label_statistics import label_statistics
+from label_statistics import stats2dict
+from label_adjacency import CellLayers
+from label_adjacency import cached_cell_layers
 logging.getLogger().setLevel(logging.INFO)
 
 if "world" in dir():
@@ -108,7 +122,13 @@ for filename in filenames:
 
     start_time = current_time()
     p_img = PropertySpatialImage(seg_img,ignore_cells_at_stack_margins=False)
-    p_img.compute_default_image_properties()
+    # -- Only barycenters & layers are used, from the label adjacency graph:
+    if resampling_voxelsize is None:
+        cell_layers = cached_cell_layers(img_filename,seg_img,background=1)
+    else:
+        cell_layers = CellLayers.from_image(seg_img,background=1)
+    p_img.update_image_property('barycenter',stats2dict(label_statistics(seg_img,real=True),'barycenter',cell_layers.labels_in('all')))
+    p_img.update_image_property('layer',cell_layers.layer_dict())
     if all_walls:
         p_img.update_image_property('layer',dict(zip(p_img.labels,[1 for l in p_img.labels])))
     # p_img.compute_cell_meshes(sub_factor=1)
@@ -116,8 +136,7 @@ for filename in filenames:
 
 
     start_time = current_time()
-    anticlinal_walls = np.concatenate([[(l,n) for n in p_img.image_graph.neighbors(l) if p_img.image_property('layer')[n]==1] for l in p_img.labels if p_img.image_property('layer')[l]==1])
-    anticlinal_walls = array_unique(np.sort(anticlinal_walls))
+    anticlinal_walls = np.array(cell_layers.walls('all' if all_walls else 'L1_anticlinal'))
     logging.info("--> Extracting L1 anticlinal walls ["+str(current_time() - start_time)+" s]")
 
 
@@ -0,0 +1,302 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the persistent catalogue of the nomenclature image tree.
+
+The catalogue is a SQLite database built from the nomenclature CSV and the
+image headers. It records the shape, voxelsize, dtype, channels, size and
+mtime of each image, and its relation to the nomenclature name (source,
+channel, segmentation or registration output).
+Tables are loaded in memory when opened, so path resolution is a dictionary
+lookup without parsing the CSV, and up-to-date checks only 'stat' the files
+to compare them with their records, without reading any image header.
+"""
+
+import json
+import sqlite3
+from glob import glob
+from os.path import join
+from os.path import exists
+from os.path import getsize
+from os.path import getmtime
+
+from nomenclature import get_nomenclature_name
+from chunked_image import CHUNKED_EXT
+from chunked_image import read_chunked_header
+from inr_io import read_inr_header
+from lazy_reader import czi_n_channels
+from lazy_reader import lsm_n_channels
+
+IMAGE_KINDS = ['source', 'channel', 'segmentation', 'registration']
+IMAGE_FIELDS = ['path', 'nomenclature_name', 'kind', 'channel', 'shape', 'voxelsize', 'dtype', 'channels', 'size', 'mtime']
+JSON_FIELDS = ['shape', 'voxelsize', 'channels']
+# Default filename of the catalogue, next to the nomenclature file:
+DEF_DB = 'nomenclature_catalogue.sqlite'
+
+
+def image_header(fname, channel_names=None):
+    """
+    Return the shape, voxelsize, dtype and channels of an image, reading only
+    its header. Unknown values are None.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the image
+    channel_names : list(str), optional
+        names of the channels of multi-channel images, their index by default
+
+    Returns
+    -------
+    dict
+        dictionary with 'shape', 'voxelsize', 'dtype' & 'channels' keys
+    """
+    header = {'shape': None, 'voxelsize': None, 'dtype': None, 'channels': None}
+    if fname.endswith(".inr") or fname.endswith(".inr.gz"):
+        inr = read_inr_header(fname)
+        header.update({'shape': inr['shape'], 'voxelsize': inr['voxelsize'], 'dtype': inr['dtype'].name})
+    elif fname.endswith(CHUNKED_EXT):
+        cimg = read_chunked_header(fname)
+        header.update({'shape': cimg['shape'], 'voxelsize': cimg['voxelsize'], 'dtype': str(cimg['dtype'])})
+    elif fname.endswith(".czi") or fname.endswith(".lsm"):
+        n_ch = czi_n_channels(fname) if fname.endswith(".czi") else lsm_n_channels(fname)
+        if channel_names is not None and len(channel_names) == n_ch:
+            header['channels'] = list(channel_names)
+        else:
+            header['channels'] = range(n_ch)
+    return header
+
+
+class ImageCatalogue(object):
+    """
+    SQLite catalogue of the nomenclature image tree, with in-memory lookups.
+    """
+
+    def __init__(self, db_fname):
+        """
+        Parameters
+        ----------
+        db_fname : str
+            filename of the SQLite database, created if missing
+        """
+        self.db_fname = db_fname
+        self.db = sqlite3.connect(db_fname)
+        self.db.execute("CREATE TABLE IF NOT EXISTS nomenclature (name TEXT PRIMARY KEY, nomenclature_name TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, nomenclature_name TEXT, kind TEXT, channel TEXT, shape TEXT, voxelsize TEXT, dtype TEXT, channels TEXT, size INTEGER, mtime REAL)")
+        self.db.commit()
+        self._names = dict(self.db.execute("SELECT name, nomenclature_name FROM nomenclature"))
+        self._images = {}
+        for values in self.db.execute("SELECT {} FROM images".format(', '.join(IMAGE_FIELDS))):
+            record = dict(zip(IMAGE_FIELDS, values))
+            for field in JSON_FIELDS:
+                record[field] = json.loads(record[field]) if record[field] is not None else None
+            self._images[record['path']] = record
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def import_nomenclature(self, nomenclature_file, sep=',', force=False):
+        """
+        Replace the nomenclature table by the content of a nomenclature CSV,
+        if it was modified since the last import.
+
+        Parameters
+        ----------
+        nomenclature_file : str
+            the path to the nomenclature file to use
+        sep : str, optional
+            separator used in nomencalture file to separate data
+        force : bool, optional
+            if True (default, False), import the file even if not modified
+
+        Returns
+        -------
+        bool
+            True if the nomenclature table was replaced
+        """
+        source = json.dumps([nomenclature_file, getmtime(nomenclature_file), getsize(nomenclature_file)])
+        last = self.db.execute("SELECT value FROM meta WHERE key = 'nomenclature'").fetchone()
+        if not force and last is not None and last[0] == source:
+            return False
+        self._names = get_nomenclature_name(nomenclature_file, sep)
+        self.db.execute("DELETE FROM nomenclature")
+        self.db.executemany("INSERT INTO nomenclature VALUES (?, ?)", self._names.items())
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('nomenclature', ?)", (source,))
+        self.db.commit()
+        return True
+
+    def nomenclature_name(self, czi_fname):
+        """
+        Return the nomenclature name of a file.
+        """
+        return self._names[czi_fname]
+
+    def channel_fname(self, czi_fname, channel_name, ext='.inr.gz'):
+        """
+        Return the path suffix and filename of a channel, as
+        `get_nomenclature_channel_fname`.
+        """
+        n_name = self._names[czi_fname]
+        return n_name + "/", n_name + "_" + channel_name + ext
+
+    def segmentation_fname(self, czi_fname, channel_name='PI', ext='.inr.gz'):
+        """
+        Return the path suffix and filename of a segmentation, as
+        `get_nomenclature_segmentation_name`.
+        """
+        return self.channel_fname(czi_fname, channel_name + '_segmented', ext)
+
+    def register(self, path, kind, nomenclature_name=None, channel=None, channel_names=None, commit=True):
+        """
+        Add or update an image of the catalogue, from its file header.
+
+        Parameters
+        ----------
+        path : str
+            path to the image file
+        kind : str
+            kind of image, in IMAGE_KINDS
+        nomenclature_name : str, optional
+            nomenclature name the image relates to
+        channel : str, optional
+            name of the channel the image contains
+        channel_names : list(str), optional
+            names of the channels, for multi-channel images
+        commit : bool, optional
+            if True (default), commit the change to the database
+        """
+        try:
+            assert kind in IMAGE_KINDS
+        except AssertionError:
+            raise ValueError("Unknown kind of image '{}', availables are: {}".format(kind, IMAGE_KINDS))
+        record = {'path': path, 'nomenclature_name': nomenclature_name, 'kind': kind, 'channel': channel,
+                  'size': getsize(path), 'mtime': getmtime(path)}
+        record.update(image_header(path, channel_names))
+        values = [json.dumps(record[f]) if f in JSON_FIELDS and record[f] is not None else record[f] for f in IMAGE_FIELDS]
+        self.db.execute("INSERT OR REPLACE INTO images VALUES ({})".format(', '.join(['?'] * len(IMAGE_FIELDS))), values)
+        if commit:
+            self.db.commit()
+        self._images[path] = record
+        return record
+
+    def scan(self, image_dir, source_dir=None, channel_names=None, ext='.inr.gz'):
+        """
+        Register the sources, channels, segmentations and registration outputs
+        found for each entry of the nomenclature.
+
+        Parameters
+        ----------
+        image_dir : str
+            directory containing the nomenclature named folders
+        source_dir : str, optional
+            directory containing the source files (CZI, LSM), not registered
+            by default
+        channel_names : list(str), optional
+            names of the channels to look for
+        ext : str, optional
+            extension of the channel & segmentation files
+
+        Returns
+        -------
+        int
+            number of registered images
+        """
+        n_img = 0
+        for czi_fname, n_name in self._names.items():
+            if source_dir is not None and exists(join(source_dir, czi_fname)):
+                self.register(join(source_dir, czi_fname), 'source', n_name, channel_names=channel_names, commit=False)
+                n_img += 1
+            for ch in channel_names or []:
+                for kind, (path_suffix, fname) in [('channel', self.channel_fname(czi_fname, ch, ext)),
+                                                   ('segmentation', self.segmentation_fname(czi_fname, ch, ext))]:
+                    path = join(image_dir, path_suffix, fname)
+                    if exists(path):
+                        self.register(path, kind, n_name, ch, commit=False)
+                        n_img += 1
+            # - Registration outputs are saved under '<trsf_type>_registrations/' folders:
+            for path in glob(join(image_dir, n_name, '*_registrations', '*')):
+                if not path.endswith('.trsf'):
+                    self.register(path, 'registration', n_name, commit=False)
+                    n_img += 1
+        self.db.commit()
+        return n_img
+
+    def forget(self, path, commit=True):
+        """
+        Remove an image from the catalogue.
+        """
+        self.db.execute("DELETE FROM images WHERE path = ?", (path,))
+        if commit:
+            self.db.commit()
+        self._images.pop(path, None)
+
+    def refresh(self, path):
+        """
+        Return the up-to-date catalogue record of an image, or None if unknown.
+
+        The file is checked with a single 'stat': the record of a deleted file
+        is removed, the one of a rewritten file (other mtime or size) is
+        registered again.
+        """
+        record = self._images.get(path)
+        if record is None:
+            return None
+        if not exists(path):
+            self.forget(path)
+            return None
+        if record['mtime'] != getmtime(path) or record['size'] != getsize(path):
+            channel_names = record['channels'] if record['kind'] == 'source' else None
+            record = self.register(path, record['kind'], record['nomenclature_name'], record['channel'], channel_names)
+        return record
+
+    def header(self, path):
+        """
+        Return the up-to-date catalogue record of an image, or None if unknown.
+        """
+        return self.refresh(path)
+
+    def exists(self, path):
+        """
+        Return True if the image is in the catalogue and still exists.
+        """
+        return self.refresh(path) is not None
+
+    def mtime(self, path):
+        """
+        Return the modification time of a file, from its up-to-date record if
+        catalogued, None if it does not exist.
+        """
+        record = self.refresh(path)
+        if record is not None:
+            return record['mtime']
+        return getmtime(path) if exists(path) else None
+
+    def is_current(self, path, sources=()):
+        """
+        Return True if the image exists and is more recent than all its
+        existing sources.
+
+        The image and its sources are checked on the filesystem, see
+        `refresh`, so a deleted or rewritten image is never reported as
+        current. Files missing from the catalogue are compared by their
+        modification time.
+
+        Parameters
+        ----------
+        path : str
+            path to the image
+        sources : list(str), optional
+            paths to the files the image was computed from
+        """
+        mtime = self.mtime(path)
+        if mtime is None:
+            return False
+        src_mtimes = [self.mtime(source) for source in sources]
+        return all(src_mtime is None or src_mtime <= mtime for src_mtime in src_mtimes)
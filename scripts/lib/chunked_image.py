@@ -0,0 +1,195 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the chunked image container ('.cimg' files).
+
+The array is split in chunks compressed independently, so a sub-volume (eg.
+a z-slice or a crop) can be read by decompressing only the chunks it
+overlaps.
+
+File layout:
+  * magic string 'CIMG' and format version (uint8);
+  * the compressed chunks, one after the other;
+  * the json header: shape, dtype, chunk shape, voxelsize, origin, metadata,
+    compressor and the (offset, size) of each chunk in C order;
+  * the offset of the json header (uint64, little-endian).
+
+Chunks are compressed with 'blosc' if installed, else with 'zlib'.
+"""
+
+import json
+import zlib
+import struct
+import numpy as np
+from itertools import product
+
+from timagetk.components import SpatialImage
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+CHUNKED_EXT = '.cimg'
+MAGIC = 'CIMG'
+VERSION = 1
+DEF_CHUNKS = (128, 128, 16)
+GEOMETRY_MD = ['shape', 'dim', 'voxelsize', 'origin', 'extent', 'type', 'min', 'max', 'mean']
+
+
+def _compress(buf, compressor, itemsize, level):
+    if compressor == 'blosc':
+        return blosc.compress(buf, typesize=itemsize, clevel=level, shuffle=blosc.SHUFFLE)
+    return zlib.compress(buf, level)
+
+
+def _decompress(buf, compressor):
+    if compressor == 'blosc':
+        if blosc is None:
+            raise ImportError("Please install the 'blosc' library to read this file!")
+        return blosc.decompress(buf)
+    return zlib.decompress(buf)
+
+
+def _chunk_grid(shape, chunks):
+    """
+    Return the number of chunks along each axis.
+    """
+    return [int(np.ceil(s / float(c))) for s, c in zip(shape, chunks)]
+
+
+def save_chunked(fname, img, chunks=None, compressor=None, level=5):
+    """
+    Save an image as a chunked container.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the '.cimg' file to write
+    img : SpatialImage
+        image to save
+    chunks : tuple(int), optional
+        shape of the chunks, (128, 128, 16) by default
+    compressor : str, optional
+        'blosc' or 'zlib', by default 'blosc' if installed
+    level : int, optional
+        compression level, from 0 to 9
+    """
+    arr = np.asarray(img)
+    if chunks is None:
+        chunks = DEF_CHUNKS[:arr.ndim]
+    chunks = [min(c, s) for c, s in zip(chunks, arr.shape)]
+    if compressor is None:
+        compressor = 'blosc' if blosc is not None else 'zlib'
+    try:
+        assert compressor in ['blosc', 'zlib']
+    except AssertionError:
+        raise ValueError("Unknown compressor '{}', availables are: {}".format(compressor, ['blosc', 'zlib']))
+    if compressor == 'blosc' and blosc is None:
+        raise ImportError("Please install the 'blosc' library or use 'zlib' compressor!")
+
+    try:
+        metadata = json.loads(json.dumps(getattr(img, 'metadata', {})))
+    except (TypeError, ValueError):
+        metadata = {}
+    header = {'shape': list(arr.shape), 'dtype': arr.dtype.str, 'chunks': chunks,
+              'voxelsize': list(getattr(img, 'voxelsize', [1.] * arr.ndim)),
+              'origin': list(img.origin()) if hasattr(img, 'origin') else [0] * arr.ndim,
+              'metadata': metadata, 'compressor': compressor, 'index': []}
+    with open(fname, 'wb') as f:
+        f.write(MAGIC + struct.pack('<B', VERSION))
+        for idx in product(*[range(n) for n in _chunk_grid(arr.shape, chunks)]):
+            sl = tuple(slice(i * c, (i + 1) * c) for i, c in zip(idx, chunks))
+            buf = _compress(np.ascontiguousarray(arr[sl]).tostring(), compressor, arr.itemsize, level)
+            header['index'].append([f.tell(), len(buf)])
+            f.write(buf)
+        header_offset = f.tell()
+        f.write(json.dumps(header))
+        f.write(struct.pack('<Q', header_offset))
+    return
+
+
+def read_chunked_header(fname):
+    """
+    Return the header of a chunked container, without reading any chunk.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the '.cimg' file
+
+    Returns
+    -------
+    dict
+        header with 'shape', 'dtype', 'chunks', 'voxelsize', 'origin',
+        'metadata', 'compressor' & 'index' keys
+    """
+    with open(fname, 'rb') as f:
+        try:
+            assert f.read(len(MAGIC)) == MAGIC
+        except AssertionError:
+            raise IOError("This is not a chunked image file: {}".format(fname))
+        f.seek(-8, 2)
+        footer_offset = f.tell()
+        header_offset = struct.unpack('<Q', f.read(8))[0]
+        f.seek(header_offset)
+        header = json.loads(f.read(footer_offset - header_offset))
+    return header
+
+
+def read_chunked(fname, bbox=None):
+    """
+    Read a chunked container, or a sub-volume of it.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the '.cimg' file
+    bbox : list, optional
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded, the
+        whole image by default
+
+    Returns
+    -------
+    SpatialImage
+        the (sub-)image, with an origin moved to the first read voxel
+    """
+    header = read_chunked_header(fname)
+    shape, chunks = header['shape'], header['chunks']
+    dtype = np.dtype(header['dtype'])
+    grid = _chunk_grid(shape, chunks)
+    if bbox is None:
+        bbox = [[0, s] for s in shape]
+    bbox = [[max(0, start), min(s, stop)] for (start, stop), s in zip(bbox, shape)]
+    try:
+        assert all(start < stop for start, stop in bbox)
+    except AssertionError:
+        raise ValueError("Empty bounding box {} for an image of shape {}!".format(bbox, shape))
+
+    out = np.empty([stop - start for start, stop in bbox], dtype=dtype)
+    # - Only the chunks overlapping the bounding box are read and decompressed:
+    ranges = [range(start // c, (stop - 1) // c + 1) for (start, stop), c in zip(bbox, chunks)]
+    with open(fname, 'rb') as f:
+        for idx in product(*ranges):
+            offset, size = header['index'][int(np.ravel_multi_index(idx, grid))]
+            f.seek(offset)
+            chunk_start = [i * c for i, c in zip(idx, chunks)]
+            chunk_shape = [min(c, s - cs) for c, s, cs in zip(chunks, shape, chunk_start)]
+            chunk = np.frombuffer(_decompress(f.read(size), header['compressor']), dtype=dtype).reshape(chunk_shape)
+            src, dst = [], []
+            for (start, stop), cs, csh in zip(bbox, chunk_start, chunk_shape):
+                lo, hi = max(start, cs), min(stop, cs + csh)
+                src.append(slice(lo - cs, hi - cs))
+                dst.append(slice(lo - start, hi - start))
+            out[tuple(dst)] = chunk[tuple(src)]
+
+    vxs = header['voxelsize']
+    ori = [o + start * v for o, (start, _), v in zip(header['origin'], bbox, vxs)]
+    # - Geometry & intensity related metadata are recomputed from the read array:
+    md = {k: v for k, v in header['metadata'].items() if k not in GEOMETRY_MD}
+    return SpatialImage(out, voxelsize=vxs, origin=ori, metadata_dict=md or None)
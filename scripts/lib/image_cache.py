@@ -0,0 +1,106 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the in-memory cache of read images.
+
+Scripts processing the consecutive pairs of a time-series read most images
+twice in a row (as reference, then as floating image). An ImageCache keeps
+the last decoded images, up to a memory budget, and evicts the least recently
+used ones first, ie. following the time order for sequential processing.
+"""
+
+import numpy as np
+from collections import OrderedDict
+from os.path import abspath
+from os.path import getmtime
+from os.path import getsize
+
+from segmentation_pipeline import read_image
+
+
+def image_nbytes(img):
+    """
+    Return the size in bytes of an image, or a dictionary of images.
+    """
+    if isinstance(img, dict):
+        return sum(image_nbytes(im) for im in img.values())
+    return np.asarray(img).nbytes
+
+
+class ImageCache(object):
+    """
+    In-memory cache of read images with least-recently-used eviction.
+
+    Entries are keyed by the file path, modification time and size, so an
+    edited file is read again. Cached images are shared, they should not be
+    modified in place.
+    """
+
+    def __init__(self, max_size=None, reader=read_image):
+        """
+        Parameters
+        ----------
+        max_size : float, optional
+            maximum total size of the cached images in Mb, unlimited by
+            default, the last read image is always kept
+        reader : function, optional
+            function used to read the images, `read_image` by default
+        """
+        self.max_size = max_size
+        self.reader = reader
+        self.images = OrderedDict()
+        self.nbytes = {}
+        self.hits, self.misses = 0, 0
+
+    def _key(self, im_fname):
+        return (abspath(im_fname), getmtime(im_fname), getsize(im_fname))
+
+    def __contains__(self, im_fname):
+        return self._key(im_fname) in self.images
+
+    def read(self, im_fname):
+        """
+        Return the image from the cache, or read it and add it to the cache.
+        """
+        key = self._key(im_fname)
+        if key in self.images:
+            self.hits += 1
+            # - Move the entry to the most recently used position:
+            img = self.images.pop(key)
+            self.images[key] = img
+            return img
+        self.misses += 1
+        img = self.reader(im_fname)
+        self.images[key] = img
+        self.nbytes[key] = image_nbytes(img)
+        self.evict()
+        return img
+
+    def size(self):
+        """
+        Return the total size of the cached images in Mb.
+        """
+        return sum(self.nbytes.values()) / 2. ** 20
+
+    def evict(self):
+        """
+        Remove the least recently used images until the cache size is below
+        'max_size', the most recently used image is kept.
+        """
+        if self.max_size is None:
+            return
+        while len(self.images) > 1 and self.size() > self.max_size:
+            key, _ = self.images.popitem(last=False)
+            self.nbytes.pop(key)
+
+    def clear(self):
+        """
+        Remove all the cached images.
+        """
+        self.images.clear()
+        self.nbytes.clear()
@@ -0,0 +1,129 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the persistent store of converted CZI & LSM images.
+
+Each channel of a source file is converted once into an uncompressed '.npy'
+array with a '.json' sidecar (voxelsize, origin & metadata), then served by
+memory-mapping. Entries are keyed by the source path, modification time and
+size, so an edited source file is converted again.
+
+The default store is defined by the 'SAMMAPS_IMAGE_STORE' environment
+variable, its maximum size (in Mb) by 'SAMMAPS_IMAGE_STORE_SIZE'.
+"""
+
+import os
+import json
+import hashlib
+from os.path import join
+from os.path import exists
+from os.path import abspath
+from os.path import getmtime
+from os.path import getsize
+
+from stage_cache import StageCache
+from lazy_reader import LazyChannels
+from lazy_reader import lazy_read
+from lazy_reader import channel_name_list
+
+STORE_ENV = 'SAMMAPS_IMAGE_STORE'
+STORE_SIZE_ENV = 'SAMMAPS_IMAGE_STORE_SIZE'
+
+
+class ImageStore(StageCache):
+    """
+    On-disk store of converted image channels, memory-mapped when loaded.
+
+    A manifest, saved as '<key>.manifest.json', records the source file and
+    its number of channels, so the source is not opened again once converted.
+    """
+
+    def source_key(self, im_fname):
+        """
+        Return the key of a source file, from its path, mtime and size.
+        """
+        sha = hashlib.sha1()
+        sha.update(repr((abspath(im_fname), getmtime(im_fname), getsize(im_fname))))
+        return sha.hexdigest()
+
+    def channel_key(self, key, ch_idx):
+        """
+        Return the key of a channel given the key of its source file.
+        """
+        return '{}_c{}'.format(key, ch_idx)
+
+    def _manifest_fname(self, key):
+        return join(self.cache_dir, key + '.manifest.json')
+
+    def n_channels(self, key):
+        """
+        Return the number of channels of a stored source file, None if unknown.
+        """
+        fname = self._manifest_fname(key)
+        if not exists(fname):
+            return None
+        with open(fname, 'r') as f:
+            return json.load(f)['n_channels']
+
+    def save_manifest(self, key, im_fname, n_channels):
+        """
+        Save the manifest of a source file.
+        """
+        fname = self._manifest_fname(key)
+        with open(fname + '.tmp', 'w') as f:
+            json.dump({'source': abspath(im_fname), 'n_channels': n_channels}, f)
+        os.rename(fname + '.tmp', fname)
+
+
+def default_image_store():
+    """
+    Return the ImageStore defined by the 'SAMMAPS_IMAGE_STORE' environment
+    variable, or None if it is not defined.
+    """
+    store_dir = os.environ.get(STORE_ENV, '')
+    if store_dir == '':
+        return None
+    max_size = os.environ.get(STORE_SIZE_ENV, '')
+    return ImageStore(store_dir, float(max_size) if max_size != '' else None)
+
+
+def stored_read(store, im_fname, channel_names=None):
+    """
+    Return a lazy channel-indexed dictionary of a CZI or LSM image, served
+    from the store and converted on first access.
+
+    Parameters
+    ----------
+    store : ImageStore
+        store of converted images
+    im_fname : str
+        filename of the CZI or LSM to read
+    channel_names : list(str), optional
+        list of channel names, channel indexes by default
+
+    Returns
+    -------
+    LazyChannels
+        channel-indexed dictionary of memory-mapped SpatialImages
+    """
+    key = store.source_key(im_fname)
+    n_channels = store.n_channels(key)
+    if n_channels is None:
+        n_channels = len(lazy_read(im_fname))
+        store.save_manifest(key, im_fname, n_channels)
+
+    def read_channel(ch_idx):
+        ch_key = store.channel_key(key, ch_idx)
+        if ch_key not in store:
+            print "Converting channel {} of '{}' to the image store...".format(ch_idx, im_fname)
+            ch_img = lazy_read(im_fname)[ch_idx]
+            store.save(ch_key, ch_img)
+            del ch_img
+        return store.load(ch_key, mmap_mode='r')
+
+    return LazyChannels(channel_name_list(n_channels, channel_names), read_channel)
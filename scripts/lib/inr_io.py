@@ -0,0 +1,126 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the partial reading of INR images.
+
+The INR header is a text block (multiple of 256 bytes) followed by the raw
+data, ordered with 'x' varying first. This allows to read the header only, or
+a sub-volume by memory-mapping (or streaming z-slices for '.inr.gz').
+"""
+
+import gzip
+import numpy as np
+
+from timagetk.components import SpatialImage
+
+INR_TYPES = {'unsigned fixed': 'u', 'signed fixed': 'i', 'float': 'f'}
+BIG_ENDIAN_CPU = ['sun', 'sgi']
+
+
+def _open(fname):
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+
+def read_inr_header(fname):
+    """
+    Read the header of an INR image, without reading the data.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the INR image (may be gzipped)
+
+    Returns
+    -------
+    dict
+        header with 'shape' ([x, y, z]), 'voxelsize', 'dtype', 'vdim' and
+        'header_size' (in bytes) keys
+    """
+    with _open(fname) as f:
+        header = f.read(256)
+        try:
+            assert header.startswith('#INRIMAGE-4#{')
+        except AssertionError:
+            raise IOError("This is not an INR image file: {}".format(fname))
+        while '##}' not in header:
+            block = f.read(256)
+            if block == '':
+                raise IOError("Truncated INR header in file: {}".format(fname))
+            header += block
+
+    fields = {}
+    for line in header.split('\n'):
+        if '=' in line and not line.startswith('#'):
+            key, value = line.split('=', 1)
+            fields[key.strip()] = value.strip()
+    shape = [int(fields.get(k, 1)) for k in ['XDIM', 'YDIM', 'ZDIM']]
+    vxs = [float(fields.get(k, 1.)) for k in ['VX', 'VY', 'VZ']]
+    pixsize = int(fields.get('PIXSIZE', '8 bits').split()[0]) // 8
+    endian = '>' if fields.get('CPU', 'decm') in BIG_ENDIAN_CPU else '<'
+    dtype = np.dtype('{}{}{}'.format(endian, INR_TYPES[fields.get('TYPE', 'unsigned fixed')], pixsize))
+    return {'shape': shape, 'voxelsize': vxs, 'dtype': dtype, 'vdim': int(fields.get('VDIM', 1)),
+            'header_size': len(header)}
+
+
+def read_inr(fname, bbox=None):
+    """
+    Read an INR image, or a sub-volume of it, without loading the whole stack.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the INR image (may be gzipped)
+    bbox : list, optional
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded, the
+        whole image by default
+
+    Returns
+    -------
+    SpatialImage
+        the (sub-)image, with an origin moved to the first read voxel
+
+    Notes
+    -----
+    Uncompressed files are memory-mapped so only the sub-volume is read.
+    Gzipped files are decompressed up to the last z-slice of the sub-volume,
+    keeping only the slices of the sub-volume in memory.
+    """
+    header = read_inr_header(fname)
+    shape, dtype = header['shape'], header['dtype']
+    try:
+        assert header['vdim'] == 1
+    except AssertionError:
+        raise NotImplementedError("Vectorial INR images are not supported!")
+    if bbox is None:
+        bbox = [[0, s] for s in shape]
+    elif len(bbox) == 2:
+        bbox = list(bbox) + [[0, 1]]  # 2D image
+    bbox = [[max(0, start), min(s, stop)] for (start, stop), s in zip(bbox, shape)]
+    (x0, x1), (y0, y1), (z0, z1) = bbox
+
+    if not fname.endswith('.gz'):
+        data = np.memmap(fname, dtype=dtype, mode='r', offset=header['header_size'], shape=tuple(shape[::-1]))
+        arr = np.array(data[z0:z1, y0:y1, x0:x1]).transpose(2, 1, 0)
+        del data
+    else:
+        slice_size = shape[0] * shape[1] * dtype.itemsize
+        arr = np.empty((x1 - x0, y1 - y0, z1 - z0), dtype=dtype)
+        with gzip.open(fname, 'rb') as f:
+            f.seek(header['header_size'] + z0 * slice_size)
+            for z in range(z1 - z0):
+                plane = np.frombuffer(f.read(slice_size), dtype=dtype).reshape(shape[1], shape[0])
+                arr[:, :, z] = plane[y0:y1, x0:x1].T
+    arr = arr.astype(dtype.newbyteorder('='), copy=False)
+    if shape[2] == 1:
+        arr = arr[:, :, 0]
+
+    vxs = header['voxelsize'][:arr.ndim]
+    ori = [start * v for (start, _), v in zip(bbox, vxs)]
+    return SpatialImage(arr, voxelsize=vxs, origin=ori)
@@ -0,0 +1,406 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the adjacency of labels in segmented images.
+
+The label adjacency, with the number of contact voxel faces of each pair of
+labels, is obtained by comparing the label array with itself shifted by one
+voxel along each axis. It is stored as a sparse (CSR) graph over the labels,
+with the contact voxel faces counts and areas (in real units) of each pair,
+and can be saved next to the segmented image to be shared by the scripts.
+Cell layers (L1 being in contact with the background, L2 with L1, ...) and
+the usual lists of walls are then derived from it for all cells at once.
+"""
+
+import numpy as np
+from os.path import exists
+from os.path import getsize
+from os.path import getmtime
+
+from nomenclature import splitext_zip
+
+LAYER_NAMES = ['L1', 'L2', 'L3']
+
+
+def face_areas(voxelsize):
+    """
+    Return the area of a voxel face orthogonal to each axis.
+
+    Parameters
+    ----------
+    voxelsize : list(float)
+        size of the voxels along each axis
+    """
+    vxs = np.asarray(voxelsize, dtype=np.float64)
+    return np.array([np.prod(np.delete(vxs, axis)) for axis in range(len(vxs))])
+
+
+def label_contacts(label_img, z_range=None):
+    """
+    Return the pairs of labels in contact and their number of contact voxel
+    faces along each axis, in a single pass of shifted label arrays
+    comparisons.
+
+    Parameters
+    ----------
+    label_img : SpatialImage|np.array
+        labelled image
+    z_range : list(int), optional
+        first & last (excluded) z-slices whose contact faces are counted: the
+        faces within these slices and between their last one and the next
+        slice, so the faces of consecutive z-ranges are counted once
+
+    Returns
+    -------
+    pairs : np.array
+        (n, 2) array of labels in contact, 'pairs[:, 0] < pairs[:, 1]', sorted
+    axis_counts : np.array
+        (n, ndim) number of contact voxel faces of each pair, by axis
+    """
+    label_arr = np.asarray(label_img)
+    keys, axes = [], []
+    for axis in range(label_arr.ndim):
+        arr = label_arr
+        if z_range is not None:
+            z_stop = z_range[1] + 1 if axis == label_arr.ndim - 1 else z_range[1]
+            arr = label_arr[..., z_range[0]:z_stop]
+        sl_a = [slice(None)] * label_arr.ndim
+        sl_b = [slice(None)] * label_arr.ndim
+        sl_a[axis], sl_b[axis] = slice(None, -1), slice(1, None)
+        lab_a, lab_b = arr[tuple(sl_a)], arr[tuple(sl_b)]
+        diff = lab_a != lab_b
+        lab_a = lab_a[diff].astype(np.int64)
+        lab_b = lab_b[diff].astype(np.int64)
+        keys.append((np.minimum(lab_a, lab_b) << 32) | np.maximum(lab_a, lab_b))
+        axes.append(np.full(len(lab_a), axis, dtype=np.int64))
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    axis_counts = np.zeros((len(keys), label_arr.ndim), dtype=np.int64)
+    np.add.at(axis_counts, (inverse, np.concatenate(axes)), 1)
+    pairs = np.array([keys >> 32, keys & 0xFFFFFFFF]).T.reshape(-1, 2)
+    return pairs, axis_counts
+
+
+class LabelAdjacency(object):
+    """
+    Sparse (CSR) label adjacency graph, with the number of contact voxel faces
+    and the contact area of each pair of labels.
+    """
+
+    def __init__(self, labels, indptr, indices, counts, areas):
+        """
+        Parameters
+        ----------
+        labels : np.array
+            sorted array of labels (rows of the graph)
+        indptr : np.array
+            the neighbors of 'labels[i]' are 'indices[indptr[i]:indptr[i+1]]'
+        indices : np.array
+            neighbor labels, sorted for each label
+        counts : np.array
+            number of contact voxel faces, ordered as 'indices'
+        areas : np.array
+            contact area in real units, ordered as 'indices'
+        """
+        self.labels = labels
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.areas = areas
+
+    @classmethod
+    def from_pairs(cls, pairs, counts, areas):
+        """
+        Create the symmetric graph from the sorted pairs of labels in contact.
+        """
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        order = np.lexsort((cols, rows))
+        rows = rows[order]
+        labels = np.unique(rows)
+        indptr = np.append(np.searchsorted(rows, labels), len(rows))
+        return cls(labels, indptr, cols[order], np.tile(counts, 2)[order], np.tile(areas, 2)[order])
+
+    @classmethod
+    def from_image(cls, label_img, voxelsize=None):
+        """
+        Compute the label adjacency graph of a segmented image.
+
+        Parameters
+        ----------
+        label_img : SpatialImage|np.array
+            labelled image
+        voxelsize : list(float), optional
+            size of the voxels, by default the one of 'label_img' if any, else
+            areas are given in voxel faces
+        """
+        if voxelsize is None:
+            voxelsize = getattr(label_img, 'voxelsize', [1.] * np.ndim(label_img))
+        pairs, axis_counts = label_contacts(label_img)
+        return cls.from_pairs(pairs, axis_counts.sum(axis=1), axis_counts.dot(face_areas(voxelsize)))
+
+    def __contains__(self, label):
+        idx = np.searchsorted(self.labels, label)
+        return idx < len(self.labels) and self.labels[idx] == label
+
+    def _row(self, label):
+        """
+        Return the slice of the neighbors of a label, empty if missing.
+        """
+        if label not in self:
+            return slice(0, 0)
+        idx = np.searchsorted(self.labels, label)
+        return slice(self.indptr[idx], self.indptr[idx + 1])
+
+    def neighbors(self, label):
+        """
+        Return the array of neighbors of a label.
+        """
+        return self.indices[self._row(label)]
+
+    def degrees(self):
+        """
+        Return the number of neighbors of each label, ordered as 'labels'.
+        """
+        return np.diff(self.indptr)
+
+    def contact_area(self, label_1, label_2, real=True):
+        """
+        Return the contact area (or number of contact voxel faces if 'real' is
+        False) between two labels, '0' if not in contact.
+        """
+        row = self._row(label_1)
+        values = self.areas[row] if real else self.counts[row]
+        idx = np.searchsorted(self.indices[row], label_2)
+        if idx < len(values) and self.indices[row][idx] == label_2:
+            return values[idx]
+        return 0
+
+    def pairs(self):
+        """
+        Return the sorted pairs of labels in contact (with 'pairs[:, 0] <
+        pairs[:, 1]'), their number of contact voxel faces and contact areas.
+        """
+        rows = np.repeat(self.labels, self.degrees())
+        upper = rows < self.indices
+        return np.array([rows[upper], self.indices[upper]]).T.reshape(-1, 2), self.counts[upper], self.areas[upper]
+
+    def area_dict(self, real=True):
+        """
+        Return the labelpair indexed dictionary of contact areas (or number of
+        contact voxel faces if 'real' is False), for sorted label pairs.
+        """
+        pairs, counts, areas = self.pairs()
+        return dict(zip([tuple(lp) for lp in pairs.tolist()], (areas if real else counts).tolist()))
+
+    def save(self, fname, source=None):
+        """
+        Save the adjacency graph to a '.npz' file.
+
+        Parameters
+        ----------
+        fname : str
+            filename of the '.npz' file
+        source : str, optional
+            filename of the segmented image, its size and mtime are saved to
+            check the file is up to date when loading
+        """
+        src = [getsize(source), getmtime(source)] if source is not None else []
+        np.savez(fname, labels=self.labels, indptr=self.indptr, indices=self.indices, counts=self.counts,
+                 areas=self.areas, source=np.array(src, dtype=np.float64))
+
+    @classmethod
+    def load(cls, fname, source=None):
+        """
+        Load the adjacency graph from a '.npz' file, None if missing or
+        older than the 'source' segmented image.
+        """
+        if not exists(fname):
+            return None
+        data = np.load(fname)
+        if source is not None and data['source'].tolist() != [getsize(source), getmtime(source)]:
+            return None
+        return cls(data['labels'], data['indptr'], data['indices'], data['counts'], data['areas'])
+
+
+def label_adjacency_fname(seg_fname):
+    """
+    Return the filename of the adjacency graph of a segmented image file.
+    """
+    return splitext_zip(seg_fname)[0] + '_adjacency.npz'
+
+
+def cached_label_adjacency(seg_fname, seg_im=None):
+    """
+    Load the adjacency graph of a segmented image file, or compute & save it
+    if missing or outdated.
+
+    Parameters
+    ----------
+    seg_fname : str
+        filename of the segmented image
+    seg_im : SpatialImage, optional
+        segmented image, read from 'seg_fname', only required if not cached
+
+    Returns
+    -------
+    LabelAdjacency
+        the label adjacency graph
+    """
+    fname = label_adjacency_fname(seg_fname)
+    adjacency = LabelAdjacency.load(fname, seg_fname)
+    if adjacency is not None:
+        print "Loaded label adjacency from '{}'".format(fname)
+        return adjacency
+    if seg_im is None:
+        from segmentation_pipeline import read_image
+        seg_im = read_image(seg_fname)
+    adjacency = LabelAdjacency.from_image(seg_im)
+    adjacency.save(fname, seg_fname)
+    print "Saved label adjacency under '{}'".format(fname)
+    return adjacency
+
+
+def label_layers(adjacency, labels, background):
+    """
+    Return the layer of each label, '1' for the labels in contact with the
+    background, '2' for those in contact with layer 1, ... '0' if not
+    connected to the background (or without background).
+
+    Parameters
+    ----------
+    adjacency : LabelAdjacency
+        label adjacency graph
+    labels : np.array
+        sorted array of labels, without the background
+    background : int|None
+        background label
+    """
+    layers = np.zeros(len(labels), dtype=np.int64)
+    front = [background] if background is not None else []
+    layer = 0
+    while len(front):
+        layer += 1
+        # - Unassigned labels in contact with the previous layer:
+        nb = np.unique(np.concatenate([adjacency.neighbors(lab) for lab in front]))
+        idx = np.searchsorted(labels, nb)
+        found = idx < len(labels)
+        found[found] = labels[idx[found]] == nb[found]
+        idx = idx[found]
+        idx = idx[layers[idx] == 0]
+        layers[idx] = layer
+        front = labels[idx]
+    return layers
+
+
+class CellLayers(object):
+    """
+    Cell layers of a segmented image, from its label adjacency graph.
+    """
+
+    def __init__(self, adjacency, background):
+        """
+        Parameters
+        ----------
+        adjacency : LabelAdjacency
+            label adjacency graph
+        background : int|None
+            background label
+        """
+        self.adjacency = adjacency
+        self.background = background
+        labels = adjacency.labels
+        if background is not None:
+            labels = labels[labels != background]
+        self.labels = labels
+        self.layers = label_layers(adjacency, labels, background)
+
+    @classmethod
+    def from_image(cls, seg_im, background=None):
+        """
+        Compute the label adjacency and cell layers of a segmented image.
+        """
+        return cls(LabelAdjacency.from_image(seg_im), background)
+
+    def layer_dict(self):
+        """
+        Return the label indexed dictionary of layers.
+        """
+        return dict(zip(self.labels.tolist(), self.layers.tolist()))
+
+    def labels_in(self, layer='all'):
+        """
+        Return the list of labels of a layer, 'all' (default), 'L1', 'L2', ...
+        or its number.
+        """
+        if layer == 'all':
+            return self.labels.tolist()
+        if isinstance(layer, str):
+            try:
+                assert layer in LAYER_NAMES
+            except AssertionError:
+                raise ValueError("Unknown layer '{}', availables are: {}".format(layer, ['all'] + LAYER_NAMES))
+            layer = LAYER_NAMES.index(layer) + 1
+        return self.labels[self.layers == layer].tolist()
+
+    def walls(self, kind='all', min_count=0):
+        """
+        Return a list of walls, as sorted label pairs.
+
+        Parameters
+        ----------
+        kind : str, optional
+            'all' walls between cells (default), 'epidermal' walls between L1
+            cells and the background, 'L1_anticlinal' walls between L1 cells
+            or 'L1/L2' walls between L1 & L2 cells
+        min_count : int, optional
+            minimal number of contact voxel faces of the walls
+        """
+        pairs, counts, _ = self.adjacency.pairs()
+        # - Layer of both labels of each pair, '0' for the background:
+        lookup = np.zeros(int(pairs.max()) + 1 if len(pairs) else 1, dtype=np.int64)
+        lookup[self.labels] = self.layers
+        layer_a, layer_b = lookup[pairs[:, 0]], lookup[pairs[:, 1]]
+        if self.background is not None:
+            is_back = (pairs == self.background).any(axis=1)
+        else:
+            is_back = np.zeros(len(pairs), dtype=bool)
+        if kind == 'all':
+            mask = ~is_back
+        elif kind == 'epidermal':
+            mask = is_back
+        elif kind == 'L1_anticlinal':
+            mask = (layer_a == 1) & (layer_b == 1)
+        elif kind == 'L1/L2':
+            mask = np.minimum(layer_a, layer_b) == 1
+            mask &= np.maximum(layer_a, layer_b) == 2
+        else:
+            raise ValueError("Unknown kind of walls '{}', availables are: {}".format(kind, ['all', 'epidermal', 'L1_anticlinal', 'L1/L2']))
+        mask &= counts >= min_count
+        return [tuple(lp) for lp in pairs[mask].tolist()]
+
+
+def cached_cell_layers(seg_fname, seg_im=None, background=None):
+    """
+    Return the cell layers of a segmented image file, using its cached label
+    adjacency graph, see `cached_label_adjacency`.
+
+    Parameters
+    ----------
+    seg_fname : str
+        filename of the segmented image
+    seg_im : SpatialImage, optional
+        segmented image, read from 'seg_fname', only required if not cached
+    background : int, optional
+        background label, required to define the layers
+
+    Returns
+    -------
+    CellLayers
+        the cell layers
+    """
+    return CellLayers(cached_label_adjacency(seg_fname, seg_im), background)
@@ -0,0 +1,192 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the computation of label statistics from segmented
+images.
+
+All statistics are obtained with 'np.bincount' & 'nd.find_objects', thus
+indexed by label value: the label 'l' is at index 'l' of the returned arrays.
+"""
+
+import numpy as np
+import scipy.ndimage as nd
+
+
+def _label_array(label_img):
+    """
+    Return the flattened array of labels, checking they are non-negative
+    integers as required by 'np.bincount'.
+    """
+    label_arr = np.asarray(label_img)
+    try:
+        assert np.issubdtype(label_arr.dtype, np.integer)
+    except AssertionError:
+        raise ValueError("Labelled image should be of integer type, got '{}'!".format(label_arr.dtype))
+    return label_arr.ravel()
+
+
+def label_counts(label_img, minlength=0):
+    """
+    Return the number of voxels of each label.
+
+    Parameters
+    ----------
+    label_img : SpatialImage|np.array
+        labelled image
+    minlength : int, optional
+        minimal length of the returned array
+
+    Returns
+    -------
+    np.array
+        label indexed array of voxel counts
+    """
+    return np.bincount(_label_array(label_img), minlength=minlength)
+
+
+def n_labels(label_img, exclude=(0,)):
+    """
+    Return the number of labels found in an image, without sorting it.
+
+    Parameters
+    ----------
+    label_img : SpatialImage|np.array
+        labelled image
+    exclude : list(int), optional
+        labels not to count, '0' by default
+
+    Returns
+    -------
+    int
+        number of labels found in the image
+    """
+    present = label_counts(label_img) > 0
+    for lab in exclude:
+        if lab is not None and lab < len(present):
+            present[lab] = False
+    return int(np.count_nonzero(present))
+
+
+def label_statistics(label_img, intensity_imgs=None, real=True, voxelsize=None, offset=None):
+    """
+    Compute the counts, volumes, bounding boxes, barycenters and intensity
+    sums of every label of an image, in one pass for each quantity.
+
+    Parameters
+    ----------
+    label_img : SpatialImage
+        labelled image
+    intensity_imgs : dict, optional
+        channel name indexed dictionary of intensity images, with the same
+        shape as 'label_img', to sum under each label
+    real : bool, optional
+        if True (default), barycenters are in real units, else in voxels
+    voxelsize : list(float), optional
+        voxelsize of 'label_img', its 'voxelsize' attribute by default
+    offset : list(int), optional
+        voxel coordinates of the first voxel of 'label_img' in a larger image
+        (eg. when 'label_img' is a crop), added to the barycenters
+
+    Returns
+    -------
+    stats : dict
+        dictionary with the following label indexed arrays:
+          * 'count': number of voxels;
+          * 'volume': volume in real units (µm³);
+          * 'barycenter': array of shape (n, ndim), NaN for missing labels;
+          * 'bbox': list of slices tuples, None for missing labels;
+          * 'labels': the labels found in the image;
+          * 'intensity_sum': channel name indexed dictionary of intensity sums.
+    """
+    lab = _label_array(label_img)
+    shape = label_img.shape
+    if voxelsize is None:
+        voxelsize = getattr(label_img, 'voxelsize', [1.] * len(shape))
+    voxelsize = np.array(voxelsize, dtype=float)
+
+    count = np.bincount(lab)
+    n = len(count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # - Coordinates along each axis are broadcasted instead of building the whole grid:
+        bary = np.zeros((n, len(shape)))
+        for axis, size in enumerate(shape):
+            coord_shape = [1] * len(shape)
+            coord_shape[axis] = size
+            coord = np.broadcast_to(np.arange(size, dtype=float).reshape(coord_shape), shape)
+            bary[:, axis] = np.bincount(lab, weights=coord.ravel(), minlength=n) / count
+    if offset is not None:
+        bary += np.array(offset, dtype=float)
+    if real:
+        bary *= voxelsize
+
+    stats = {}
+    stats['count'] = count
+    stats['volume'] = count * np.prod(voxelsize)
+    stats['barycenter'] = bary
+    stats['bbox'] = [None] + nd.find_objects(np.asarray(label_img), max_label=n - 1)
+    stats['labels'] = np.where(count > 0)[0]
+    stats['intensity_sum'] = {}
+    if intensity_imgs is not None:
+        for ch_name, int_img in intensity_imgs.items():
+            try:
+                assert int_img.shape == shape
+            except AssertionError:
+                raise ValueError("Intensity image '{}' has shape {}, the labelled image has {}!".format(ch_name, int_img.shape, shape))
+            stats['intensity_sum'][ch_name] = np.bincount(lab, weights=np.asarray(int_img, dtype=float).ravel(), minlength=n)
+
+    return stats
+
+
+def stats2dict(stats, name, labels=None):
+    """
+    Return a label indexed dictionary for one of the statistics.
+
+    Parameters
+    ----------
+    stats : dict
+        statistics returned by `label_statistics`
+    name : str
+        name of the statistic, eg. 'volume' or 'barycenter'
+    labels : list(int), optional
+        labels to return, by default all those found in the image
+
+    Returns
+    -------
+    dict
+        label indexed dictionary
+    """
+    if labels is None:
+        labels = stats['labels']
+    values = stats[name]
+    return {l: (values[l].tolist() if isinstance(values, np.ndarray) and values.ndim > 1 else values[l]) for l in labels}
+
+
+def remove_labels(label_img, labels, no_label_value=0):
+    """
+    Return a copy of a labelled image where some labels are replaced.
+
+    Parameters
+    ----------
+    label_img : SpatialImage
+        labelled image
+    labels : list(int)
+        labels to remove
+    no_label_value : int, optional
+        value given to the voxels of the removed labels, '0' by default
+
+    Returns
+    -------
+    np.array
+        the labelled array without the given labels
+    """
+    label_arr = np.array(label_img)
+    if len(labels) == 0:
+        return label_arr
+    lut = np.arange(max(label_arr.max(), max(labels)) + 1, dtype=label_arr.dtype)
+    lut[list(labels)] = no_label_value
+    return lut[label_arr]
@@ -0,0 +1,237 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the columnar storage of label-pair (wall) quantities.
+
+A LabelPairTable holds two integer arrays for the labels and one typed array
+per quantity, so symmetrizing, inverting and joining tables are vectorized
+operations on sorted integer keys instead of loops over tuple-keyed dicts.
+Tables are saved as CSV, Parquet, Feather or npz files, see `table_io`.
+"""
+
+import numpy as np
+import pandas as pd
+
+from table_io import save_table
+from table_io import read_table
+
+LABEL_COLUMNS = ['left_label', 'right_label']
+
+
+class LabelPairTable(object):
+    """
+    Table of values indexed by (oriented) label pairs.
+    """
+
+    def __init__(self, label_1, label_2, columns=None):
+        """
+        Parameters
+        ----------
+        label_1 : np.array
+            first (left) labels of the label pairs
+        label_2 : np.array
+            second (right) labels of the label pairs
+        columns : list(tuple), optional
+            list of (name, values) columns, values being ordered as the
+            label pairs
+        """
+        self.label_1 = np.asarray(label_1, dtype=np.int64)
+        self.label_2 = np.asarray(label_2, dtype=np.int64)
+        try:
+            assert self.label_1.shape == self.label_2.shape
+        except AssertionError:
+            raise ValueError("Label arrays should have the same length!")
+        self.names = []
+        self.columns = {}
+        for name, values in columns or []:
+            self[name] = values
+
+    @classmethod
+    def from_labelpairs(cls, labelpairs, columns=None):
+        """
+        Create a table from a list of label pairs.
+        """
+        lp = np.array(labelpairs, dtype=np.int64).reshape(-1, 2)
+        return cls(lp[:, 0], lp[:, 1], columns)
+
+    @classmethod
+    def from_dict(cls, dico, name):
+        """
+        Create a table from a labelpair dictionary, None values become NaN.
+        """
+        labelpairs = dico.keys()
+        values = [np.nan if v is None else v for v in dico.values()]
+        return cls.from_labelpairs(labelpairs, [(name, values)])
+
+    def __len__(self):
+        return len(self.label_1)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        try:
+            assert len(values) == len(self)
+        except AssertionError:
+            raise ValueError("Column '{}' has {} values for {} label pairs!".format(name, len(values), len(self)))
+        if name not in self.columns:
+            self.names.append(name)
+        self.columns[name] = values
+
+    @property
+    def labelpairs(self):
+        """
+        Return the list of label pairs, as tuples.
+        """
+        return zip(self.label_1.tolist(), self.label_2.tolist())
+
+    def keys(self):
+        """
+        Return the int64 keys of the oriented label pairs, used for sorting and
+        matching label pairs of tables.
+        """
+        return _labelpair_keys(self.label_1, self.label_2)
+
+    def to_dict(self, name):
+        """
+        Return a labelpair dictionary of a column, with None for NaN values.
+        """
+        values = self.columns[name]
+        if np.issubdtype(values.dtype, np.floating):
+            values = [None if np.isnan(v) else v for v in values.tolist()]
+        else:
+            values = values.tolist()
+        return dict(zip(self.labelpairs, values))
+
+    def take(self, index):
+        """
+        Return the table of the label pairs selected by an index or a mask.
+        """
+        return LabelPairTable(self.label_1[index], self.label_2[index],
+                              [(name, self.columns[name][index]) for name in self.names])
+
+    def invert(self, opposed=(), swapped=()):
+        """
+        Return the table with inverted label pairs, (lab2, lab1).
+
+        Parameters
+        ----------
+        opposed : list(str), optional
+            names of the columns whose values are opposed by the inversion (eg.
+            a signed ratio or a normal vector coordinate)
+        swapped : list(tuple), optional
+            pairs of column names whose values are swapped by the inversion
+            (eg. 'left' and 'right' signals)
+        """
+        swap = {}
+        for name_1, name_2 in swapped:
+            swap[name_1], swap[name_2] = name_2, name_1
+        columns = []
+        for name in self.names:
+            values = self.columns[swap.get(name, name)]
+            columns.append((name, -values if name in opposed else values))
+        return LabelPairTable(self.label_2, self.label_1, columns)
+
+    def symmetrize(self, opposed=(), swapped=()):
+        """
+        Return a symmetric table, ie. containing (lab1, lab2) & (lab2, lab1).
+
+        Missing inverted label pairs are added using `invert` with the same
+        parameters, existing ones are kept unchanged.
+        """
+        inverted = self.invert(opposed, swapped)
+        missing = ~np.in1d(inverted.keys(), self.keys())
+        return self.concatenate(inverted.take(missing))
+
+    def concatenate(self, other):
+        """
+        Return the table with the rows of another table (with the same
+        columns) appended.
+        """
+        return LabelPairTable(np.concatenate([self.label_1, other.label_1]),
+                              np.concatenate([self.label_2, other.label_2]),
+                              [(name, np.concatenate([self.columns[name], other[name]])) for name in self.names])
+
+    def join(self, other, names=None):
+        """
+        Add the columns of another table, matched by oriented label pairs.
+        Values of label pairs missing in 'other' are NaN.
+
+        Parameters
+        ----------
+        other : LabelPairTable
+            table to join
+        names : list(str), optional
+            names of the columns to join, all by default
+        """
+        if names is None:
+            names = other.names
+        other_keys = other.keys()
+        order = np.argsort(other_keys)
+        sorted_keys = other_keys[order]
+        keys = self.keys()
+        idx = np.clip(np.searchsorted(sorted_keys, keys), 0, max(len(sorted_keys) - 1, 0))
+        found = sorted_keys[idx] == keys if len(sorted_keys) else np.zeros(len(keys), dtype=bool)
+        rows = order[idx] if len(sorted_keys) else idx
+        for name in names:
+            values = np.full(len(self), np.nan)
+            values[found] = other[name][rows[found]]
+            self[name] = values
+        return self
+
+    def sort(self):
+        """
+        Return the table sorted by label pairs.
+        """
+        return self.take(np.argsort(self.keys(), kind='mergesort'))
+
+    def to_dataframe(self):
+        """
+        Return the table as a pandas DataFrame, with 'left_label' and
+        'right_label' columns first.
+        """
+        df = pd.DataFrame({LABEL_COLUMNS[0]: self.label_1, LABEL_COLUMNS[1]: self.label_2})
+        for name in self.names:
+            df[name] = self.columns[name]
+        return df
+
+    def save(self, fname):
+        """
+        Save the table, the format (CSV, Parquet, Feather or npz) being given
+        by the file extension, see `table_io.save_table`.
+        """
+        save_table(fname, self.to_dataframe())
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Load a table saved with `save`.
+        """
+        return cls.from_dataframe(read_table(fname))
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Create a table from a DataFrame with 'left_label' & 'right_label'
+        columns.
+        """
+        return cls(df[LABEL_COLUMNS[0]].values, df[LABEL_COLUMNS[1]].values,
+                   [(name, df[name].values) for name in df.columns if name not in LABEL_COLUMNS])
+
+
+def _labelpair_keys(label_1, label_2):
+    """
+    Return int64 keys of oriented label pairs (labels should be < 2**31).
+    """
+    return (np.asarray(label_1, dtype=np.int64) << 32) | np.asarray(label_2, dtype=np.int64)
@@ -0,0 +1,258 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the lazy reading of multi-channel CZI & LSM images.
+
+Channels are only decoded when first accessed, so the memory used and the
+reading time depend on the channels actually required by the caller.
+"""
+
+import numpy as np
+import xml.etree.ElementTree as etree
+
+from timagetk.components import SpatialImage
+
+
+class LazyChannels(object):
+    """
+    Channel name indexed, read-only dictionary of SpatialImages.
+
+    Each channel is read by the 'reader' function the first time it is
+    accessed, then kept in memory until `release` is called.
+    """
+
+    def __init__(self, channel_names, reader):
+        """
+        Parameters
+        ----------
+        channel_names : list
+            list of channel names, in the order of the channels in the file
+        reader : function
+            function returning the SpatialImage of a channel given its index
+        """
+        self._names = list(channel_names)
+        self._reader = reader
+        self._loaded = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            try:
+                ch_idx = self._names.index(name)
+            except ValueError:
+                raise KeyError("Unknown channel '{}', availables are: {}".format(name, self._names))
+            self._loaded[name] = self._reader(ch_idx)
+        return self._loaded[name]
+
+    def keys(self):
+        return list(self._names)
+
+    def values(self):
+        return [self[name] for name in self._names]
+
+    def items(self):
+        return [(name, self[name]) for name in self._names]
+
+    def has_key(self, name):
+        return name in self
+
+    def release(self, name=None):
+        """
+        Forget a decoded channel (all of them by default) to free memory.
+        """
+        if name is None:
+            self._loaded = {}
+        else:
+            self._loaded.pop(name, None)
+
+
+def channel_name_list(n_channels, channel_names=None):
+    """
+    Return the list of channel names, their index by default.
+    """
+    if channel_names is None:
+        return range(n_channels)
+    try:
+        assert len(channel_names) == n_channels
+    except AssertionError:
+        raise ValueError("Not enought channel names ({}) for image channels ({})!".format(len(channel_names), n_channels))
+    return list(channel_names)
+
+
+def czi_voxelsize(czi):
+    """
+    Return the voxelsize (in µm) found in the metadata of a CZI file.
+
+    Parameters
+    ----------
+    czi : czifile.CziFile
+        opened CZI file
+
+    Returns
+    -------
+    list
+        [x, y, z] voxelsize, '1.' for missing axis
+    """
+    md = czi.metadata
+    if callable(md):
+        md = md()
+    if not isinstance(md, basestring):
+        md = etree.tostring(md)
+    root = etree.fromstring(md)
+    vxs = {}
+    for dist in root.findall('.//Scaling/Items/Distance'):
+        value = dist.find('Value')
+        if value is not None:
+            vxs[dist.get('Id')] = float(value.text) * 1e6  # meters to micrometers
+    return [vxs.get(axis, 1.) for axis in 'XYZ']
+
+
+def _subblock_data(czi_fname, entry):
+    """
+    Return the array of a CZI sub-block, memory-mapped if not compressed.
+    """
+    segment = entry.data_segment()
+    offset = getattr(segment, 'data_offset', None)
+    if entry.compression == 0 and offset is not None:
+        shape = entry.stored_shape
+        if tuple(shape) == tuple(entry.shape):
+            return np.memmap(czi_fname, dtype=entry.dtype, mode='r', offset=offset, shape=shape)
+    return segment.data()
+
+
+def read_czi_channel(czi_fname, ch_idx):
+    """
+    Read one channel of a CZI file, decoding only its sub-blocks.
+
+    Parameters
+    ----------
+    czi_fname : str
+        filename of the CZI
+    ch_idx : int
+        index of the channel to read
+
+    Returns
+    -------
+    SpatialImage
+        the image of the channel, ordered as [x, y, z]
+    """
+    from czifile import CziFile
+    czi = CziFile(czi_fname)
+    try:
+        axes = czi.axes
+        c_axis = axes.index('C') if 'C' in axes else None
+        shape = list(czi.shape)
+        if c_axis is not None:
+            shape[c_axis] = 1
+        out = np.zeros(shape, dtype=czi.dtype)
+        for entry in czi.filtered_subblock_directory:
+            if c_axis is not None and entry.start[c_axis] - czi.start[c_axis] != ch_idx:
+                continue
+            tile = _subblock_data(czi_fname, entry)
+            index = [slice(i - j, i - j + k) for i, j, k in zip(entry.start, czi.start, tile.shape)]
+            if c_axis is not None:
+                index[c_axis] = slice(0, 1)
+            out[tuple(index)] = tile
+        vxs = czi_voxelsize(czi)
+    finally:
+        czi.close()
+    # - Keep the first index of non-spatial axes and re-order as [x, y, z]:
+    out = out[tuple(slice(None) if ax in 'XYZ' else 0 for ax in axes)]
+    spatial_axes = [ax for ax in axes if ax in 'XYZ']
+    out = np.transpose(out, [spatial_axes.index(ax) for ax in 'XYZ' if ax in spatial_axes])
+    return SpatialImage(np.ascontiguousarray(out), voxelsize=vxs[:out.ndim])
+
+
+def read_lsm_channel(lsm_fname, ch_idx):
+    """
+    Read one channel of a LSM file, plane by plane.
+
+    Parameters
+    ----------
+    lsm_fname : str
+        filename of the LSM
+    ch_idx : int
+        index of the channel to read
+
+    Returns
+    -------
+    SpatialImage
+        the image of the channel, ordered as [x, y, z]
+    """
+    from tifffile import TiffFile
+    with TiffFile(lsm_fname) as lsm:
+        md = lsm.lsm_metadata
+        vxs = [md['VoxelSizeX'] * 1e6, md['VoxelSizeY'] * 1e6, md['VoxelSizeZ'] * 1e6]
+        pages = lsm.series[0].pages
+        out = None
+        for z, page in enumerate(pages):
+            # - Only one plane of all channels is decoded at once:
+            plane = page.asarray()
+            if plane.ndim == 2:
+                plane = plane[np.newaxis]
+            if out is None:
+                out = np.zeros(plane.shape[1:][::-1] + (len(pages),), dtype=plane.dtype)
+            out[:, :, z] = plane[ch_idx].T
+    return SpatialImage(out, voxelsize=vxs)
+
+
+def czi_n_channels(czi_fname):
+    """
+    Return the number of channels of a CZI file, from its header.
+    """
+    from czifile import CziFile
+    czi = CziFile(czi_fname)
+    try:
+        n_channels = czi.shape[czi.axes.index('C')] if 'C' in czi.axes else 1
+    finally:
+        czi.close()
+    return n_channels
+
+
+def lsm_n_channels(lsm_fname):
+    """
+    Return the number of channels of a LSM file, from its header.
+    """
+    from tifffile import TiffFile
+    with TiffFile(lsm_fname) as lsm:
+        n_channels = lsm.lsm_metadata['DimensionChannels']
+    return n_channels
+
+
+def lazy_read(im_fname, channel_names=None):
+    """
+    Return a lazy channel-indexed dictionary of a CZI or LSM image.
+
+    Parameters
+    ----------
+    im_fname : str
+        filename of the CZI or LSM to read
+    channel_names : list(str), optional
+        list of channel names, channel indexes by default
+
+    Returns
+    -------
+    LazyChannels
+        channel-indexed dictionary of SpatialImages
+    """
+    if im_fname.endswith(".czi"):
+        names = channel_name_list(czi_n_channels(im_fname), channel_names)
+        return LazyChannels(names, lambda ch_idx: read_czi_channel(im_fname, ch_idx))
+    elif im_fname.endswith(".lsm"):
+        names = channel_name_list(lsm_n_channels(im_fname), channel_names)
+        return LazyChannels(names, lambda ch_idx: read_lsm_channel(im_fname, ch_idx))
+    else:
+        raise TypeError("No lazy reader for file '{}'".format(im_fname))
@@ -11,8 +11,14 @@ Library associated to the defined nomenclature and its 'rules'.
 
 import pandas as pd
 from os.path import exists
+from os.path import abspath
+from os.path import getmtime
 from os.path import splitext
 from timagetk.io.io_image import POSS_EXT
+from chunked_image import CHUNKED_EXT
+
+# - Parsed nomenclature files, indexed by (path, mtime, sep):
+_NOMENCLATURE_CACHE = {}
 
 
 def exists_file(f):
@@ -36,10 +42,24 @@ def get_nomenclature_name(nomenclature_file, sep=','):
         the path to the nomenclature file to use
     sep : str, optional
         separator used in nomencalture file to separate data
+
+    Notes
+    -----
+    The file is parsed once and kept in memory until it is modified, a copy
+    of the parsed dictionary is returned.
+    """
+    return dict(_nomenclature_names(nomenclature_file, sep))
+
+
+def _nomenclature_names(nomenclature_file, sep=','):
+    """
+    Return the shared (not to be modified) parsed nomenclature dictionary.
     """
-    n_data = pd.read_csv(nomenclature_file, sep=sep)[:-1]
-    n_names = dict(zip(n_data['Name'], n_data['Nomenclature Name']))
-    return n_names
+    key = (abspath(nomenclature_file), getmtime(nomenclature_file), sep)
+    if key not in _NOMENCLATURE_CACHE:
+        n_data = pd.read_csv(nomenclature_file, sep=sep)[:-1]
+        _NOMENCLATURE_CACHE[key] = dict(zip(n_data['Name'], n_data['Nomenclature Name']))
+    return _NOMENCLATURE_CACHE[key]
 
 
 def get_nomenclature_channel_fname(czi_fname, nomenclature_file, channel_name, ext='.inr.gz'):
@@ -59,7 +79,7 @@ def get_nomenclature_channel_fname(czi_fname, nomenclature_file, channel_name, e
         the extension of the file containing the channel of interest
     """
     # - Read NOMENCLATURE file defining naming conventions:
-    n_names = get_nomenclature_name(nomenclature_file)
+    n_names = _nomenclature_names(nomenclature_file)
     return n_names[czi_fname]+"/", n_names[czi_fname] +  "_" + channel_name + ext
 
 
@@ -116,7 +136,7 @@ def get_res_img_fname(base_fname, t_ref, t_float, trsf_types):
     if ext == "":
         ext = '.inr'
     else:
-        if ext==".lsm" or ext not in POSS_EXT:
+        if ext==".lsm" or (ext not in POSS_EXT and ext != CHUNKED_EXT):
             ext = '.inr'
     compo_trsf = '_o_'.join(trsf_types)
     return base_fname + "-T{}_on_T{}-{}{}".format(t_float, t_ref, compo_trsf, ext)
@@ -0,0 +1,368 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the registration of time-series of images.
+
+The blockmatching registrations of the consecutive pairs of a time-series are
+independent until they are composed to the last time-point. They can thus be
+computed in a pool of processes, each worker reading only its two images and
+saving the estimated transformation to a file, the files being collected for
+the composition step.
+
+A transformation is applied to several images (eg. intensity, extra intensity
+and segmented images) with `apply_trsf_images`: the source coordinates of the
+template voxels are computed once, by z-slab, and every image is resampled
+through them, with a linear interpolation for intensity images and the nearest
+voxel for labelled images.
+
+The successive registrations of a pair of images (eg. rigid, affine then
+deformable) are chained by a `RegistrationSession`: the pair is read and
+isometrically resampled once, and each stage is initialized with the
+transformation of the previous one instead of starting from the identity.
+"""
+
+import numpy as np
+import scipy.ndimage as nd
+from collections import OrderedDict
+from multiprocessing import Pool
+from os.path import join
+from os.path import exists
+from os.path import abspath
+from os.path import basename
+from os.path import getsize
+from os.path import getmtime
+
+from timagetk.components import SpatialImage
+from timagetk.io.io_trsf import save_trsf
+from timagetk.io.io_trsf import read_trsf
+from timagetk.plugins import registration
+from timagetk.algorithms import apply_trsf
+from timagetk.algorithms import isometric_resampling
+from timagetk.algorithms.exposure import z_slice_contrast_stretch
+
+from stage_cache import stage_key
+from segmentation_pipeline import read_image
+from segmentation_pipeline import z_slabs
+
+# Memory used by the coordinate map of a z-slab (in Mb):
+DEF_SLAB_MEM = 256.
+# Chained registration stages, as (name, method, params):
+DEF_REG_STAGES = [('rigid', 'rigid_registration', {'pyramid_highest_level': 3, 'pyramid_lowest_level': 1}),
+                  ('affine', 'affine_registration', {'pyramid_highest_level': 3, 'pyramid_lowest_level': 1}),
+                  ('deformable', 'deformable_registration', {'pyramid_highest_level': 3, 'pyramid_lowest_level': 0})]
+
+
+def pairwise_registration(job, reader=read_image):
+    """
+    Compute the blockmatching registration of a pair of image files and save
+    the transformation.
+
+    Parameters
+    ----------
+    job : tuple
+        (float_fname, ref_fname, trsf_fname, method, params, stretch) with the
+        floating & reference image filenames, the filename of the
+        transformation to save, the registration method, a dictionary of
+        extra registration parameters (eg. pyramid levels) and whether to
+        apply a z-slice contrast stretching to the images first
+    reader : function, optional
+        function used to read the images, `read_image` by default
+
+    Returns
+    -------
+    str
+        the filename of the saved transformation
+
+    Notes
+    -----
+    The floating image is read first, so with an `ImageCache.read` reader the
+    reference image is the most recently used one when it becomes the
+    floating image of the next consecutive pair.
+    """
+    float_fname, ref_fname, trsf_fname, method, params, stretch = job
+    float_img = reader(float_fname)
+    ref_img = reader(ref_fname)
+    if stretch:
+        float_img = z_slice_contrast_stretch(float_img)
+        ref_img = z_slice_contrast_stretch(ref_img)
+    trsf, _ = registration(float_img, ref_img, method=method, **params)
+    save_trsf(trsf, trsf_fname)
+    return trsf_fname
+
+
+def pairwise_registrations(jobs, n_jobs=1, reader=read_image):
+    """
+    Compute the blockmatching registrations of a list of pairs of image files,
+    in a pool of processes.
+
+    Parameters
+    ----------
+    jobs : list(tuple)
+        list of registration jobs, see `pairwise_registration`
+    n_jobs : int, optional
+        number of processes, each holding two images in memory, '1' by default
+    reader : function, optional
+        function used to read the images when registering in this process
+        (eg. `ImageCache.read`), the processes of a pool use `read_image`
+
+    Returns
+    -------
+    list(str)
+        filenames of the saved transformations, ordered as 'jobs'
+    """
+    try:
+        assert n_jobs > 0
+    except AssertionError:
+        raise ValueError("The number of jobs should be strictly positive!")
+    n_jobs = min(n_jobs, len(jobs))
+    if n_jobs <= 1:
+        results = (pairwise_registration(job, reader) for job in jobs)
+    else:
+        pool = Pool(n_jobs)
+        results = pool.imap(pairwise_registration, jobs)
+    trsf_fnames = []
+    for trsf_fname in results:
+        trsf_fnames.append(trsf_fname)
+        print "[{}/{}] Saved transformation file: '{}'".format(len(trsf_fnames), len(jobs), trsf_fname)
+    if n_jobs > 1:
+        pool.close()
+        pool.join()
+    return trsf_fnames
+
+
+def trsf_displacements(trsf):
+    """
+    Return the (x, y, z) displacement arrays of a non-linear transformation,
+    None for a linear one.
+    """
+    if trsf.isLinear():
+        return None
+    return [np.asarray(v.to_spatial_image()) for v in (trsf.vx, trsf.vy, trsf.vz)]
+
+
+def trsf_coordinates(trsf, template_img, start, stop, displacements=None):
+    """
+    Return the real coordinates, in the floating images, of the template
+    voxels of the z-slices [start, stop[.
+
+    Parameters
+    ----------
+    trsf : BalTransformation
+        transformation from the template (reference) to the floating frame,
+        as returned by the blockmatching registration
+    template_img : SpatialImage
+        template image, defining the shape & voxelsize of the result
+    start, stop : int
+        z-slices of the template to transform
+    displacements : list(np.array), optional
+        displacement arrays of a non-linear 'trsf', see `trsf_displacements`
+
+    Returns
+    -------
+    np.array
+        (3, nx, ny, stop - start) array of real coordinates
+    """
+    sx, sy, _ = template_img.shape
+    vxs = np.array(template_img.voxelsize, dtype=np.float64).reshape(3, 1, 1, 1)
+    pts = np.mgrid[0:sx, 0:sy, start:stop].astype(np.float64) * vxs
+    if displacements is None:
+        mat = trsf.mat.to_np_array()
+        pts = np.tensordot(mat[:3, :3], pts, axes=1) + mat[:3, 3].reshape(3, 1, 1, 1)
+    else:
+        pts += np.array([disp[:, :, start:stop] for disp in displacements])
+    return pts
+
+
+def apply_trsf_images(trsf, imgs, template_img, labels=(), max_mem=DEF_SLAB_MEM):
+    """
+    Apply a transformation to several images, computing the coordinate map of
+    the template voxels only once.
+
+    Parameters
+    ----------
+    trsf : BalTransformation
+        transformation from the template (reference) to the floating frame,
+        linear (matrix) or non-linear (vectorfield)
+    imgs : dict
+        name indexed dictionary of 3D SpatialImages to resample
+    template_img : SpatialImage
+        template image, defining the shape & voxelsize of the results
+    labels : list(str), optional
+        names of the labelled images, resampled with the nearest voxel value
+        instead of a linear interpolation
+    max_mem : float, optional
+        memory (in Mb) used by the coordinate map of a z-slab, the whole map
+        is never computed at once
+
+    Returns
+    -------
+    dict
+        name indexed dictionary of resampled SpatialImages
+    """
+    sx, sy, sz = template_img.shape
+    # - Number of z-slices of a slab: real coordinates & voxel indexes, 3 float64 each:
+    thickness = max(1, min(sz, int(max_mem * 2. ** 20 / (sx * sy * 6 * 8))))
+    displacements = trsf_displacements(trsf)
+    arrays = {name: np.asarray(img) for name, img in imgs.items()}
+    out_arrays = {name: np.zeros((sx, sy, sz), dtype=arr.dtype) for name, arr in arrays.items()}
+    for start, stop, _, _ in z_slabs(sz, thickness, 0):
+        pts = trsf_coordinates(trsf, template_img, start, stop, displacements)
+        for name, arr in arrays.items():
+            # - Voxel indexes in this floating image, from its own voxelsize:
+            idx = pts / np.array(imgs[name].voxelsize, dtype=np.float64).reshape(3, 1, 1, 1)
+            if name in labels:
+                out_arrays[name][:, :, start:stop] = nd.map_coordinates(arr, idx, order=0, mode='constant', cval=0)
+            else:
+                values = nd.map_coordinates(arr, idx, output=np.float64, order=1, mode='constant', cval=0)
+                if np.issubdtype(arr.dtype, np.integer):
+                    info = np.iinfo(arr.dtype)
+                    values = np.clip(np.round(values), info.min, info.max)
+                out_arrays[name][:, :, start:stop] = values
+    vxs = template_img.voxelsize
+    return {name: SpatialImage(out_arr, voxelsize=vxs) for name, out_arr in out_arrays.items()}
+
+
+class RegistrationSession(object):
+    """
+    Chained blockmatching registrations of a pair of image files.
+
+    The floating and reference images are read, and isometrically resampled
+    if their filename does not contain 'iso', only once for all the stages.
+    Each stage is initialized with the transformation of the previous one,
+    so the deformable stage starts from the affine result. With a cache, the
+    resampled images are saved in the StageCache and the transformation of
+    each stage in its directory, so a new session on the same pair loads them
+    instead of computing them again.
+    """
+
+    def __init__(self, float_fname, ref_fname, stages=DEF_REG_STAGES, cache=None):
+        """
+        Parameters
+        ----------
+        float_fname : str
+            filename of the floating image
+        ref_fname : str
+            filename of the reference image
+        stages : list(tuple), optional
+            ordered list of (name, method, params) registration stages, see
+            `DEF_REG_STAGES`
+        cache : StageCache, optional
+            if given, used to save and load the resampled images and the
+            stage transformations
+        """
+        self.float_fname = float_fname
+        self.ref_fname = ref_fname
+        self.stages = OrderedDict((name, (method, params)) for name, method, params in stages)
+        self.cache = cache
+        self.float_img, self.ref_img = None, None
+        self.trsfs = {}
+        self.results = {}
+
+    def _file_key(self, fname):
+        """
+        Return the cache key of an image file, from its path, modification
+        time and size, so it is known without reading the file.
+        """
+        return stage_key(repr((abspath(fname), getmtime(fname), getsize(fname))), 'read_image', {})
+
+    def _read(self, fname):
+        """
+        Return the (isometric) image of a file, from the cache if possible.
+        """
+        if fname.find('iso') != -1:
+            return read_image(fname)
+        if self.cache is None:
+            return isometric_resampling(read_image(fname))
+        key = stage_key(self._file_key(fname), 'isometric_resampling', {})
+        img = self.cache.load(key)
+        if img is None:
+            img = isometric_resampling(read_image(fname))
+            self.cache.save(key, img)
+        else:
+            print " -- Loading cached isometric image: '{}'".format(basename(fname))
+        return img
+
+    def images(self):
+        """
+        Return the floating & reference images, read on the first call.
+        """
+        if self.float_img is None:
+            self.float_img = self._read(self.float_fname)
+            self.ref_img = self._read(self.ref_fname)
+        return self.float_img, self.ref_img
+
+    def _previous(self, name):
+        """
+        Return the name of the stage preceding 'name', None for the first one.
+        """
+        names = self.stages.keys()
+        try:
+            assert name in names
+        except AssertionError:
+            raise ValueError("Unknown registration stage '{}', choose among: {}".format(name, names))
+        n = names.index(name)
+        return names[n - 1] if n > 0 else None
+
+    def _stage_key(self, name):
+        """
+        Return the cache key of a stage, depending on the pair and on all the
+        stages leading to it.
+        """
+        previous = self._previous(name)
+        if previous is None:
+            parent = stage_key(self._file_key(self.float_fname), 'pair', {'ref': self._file_key(self.ref_fname)})
+        else:
+            parent = self._stage_key(previous)
+        method, params = self.stages[name]
+        return stage_key(parent, name, {'method': method, 'params': params})
+
+    def run(self, name):
+        """
+        Return the transformation of a stage, running the previous stages
+        first if necessary.
+
+        Parameters
+        ----------
+        name : str
+            name of the registration stage
+
+        Returns
+        -------
+        BalTransformation
+            transformation from the reference to the floating image frame,
+            including the initialization by the previous stages
+        """
+        if name in self.trsfs:
+            return self.trsfs[name]
+        trsf_fname = None
+        if self.cache is not None:
+            trsf_fname = join(self.cache.cache_dir, self._stage_key(name) + '.trsf')
+            if exists(trsf_fname):
+                print " -- Loading cached '{}' transformation...".format(name)
+                self.trsfs[name] = read_trsf(trsf_fname)
+                return self.trsfs[name]
+        previous = self._previous(name)
+        init_trsf = None if previous is None else self.run(previous)
+        float_img, ref_img = self.images()
+        method, params = self.stages[name]
+        print "\n# - {} registration{}:".format(name.upper(), '' if previous is None else ' initialized by ' + previous.upper())
+        trsf, res_img = registration(float_img, ref_img, method=method, init_trsf=init_trsf, **params)
+        self.trsfs[name], self.results[name] = trsf, res_img
+        if trsf_fname is not None:
+            save_trsf(trsf, trsf_fname)
+        return trsf
+
+    def result(self, name):
+        """
+        Return the floating image registered by the transformation of a stage.
+        """
+        trsf = self.run(name)
+        if name not in self.results:
+            float_img, ref_img = self.images()
+            self.results[name] = apply_trsf(float_img, trsf, template_img=ref_img)
+        return self.results[name]
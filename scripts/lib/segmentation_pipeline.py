@@ -10,8 +10,11 @@ Library associated to the segmentation process.
 """
 import time
 import numpy as np
+import scipy.ndimage as nd
+from os.path import join
 
 from timagetk.io import imread
+from timagetk.io import imsave
 from timagetk.components import SpatialImage
 from timagetk.plugins import morphology
 from timagetk.plugins import h_transform
@@ -37,9 +40,26 @@ else:
 sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from nomenclature import splitext_zip
+from lazy_reader import lazy_read
+from chunked_image import CHUNKED_EXT
+from chunked_image import read_chunked
+from chunked_image import save_chunked
+from chunked_image import read_chunked_header
+from inr_io import read_inr
+from inr_io import read_inr_header
+from image_store import default_image_store
+from image_store import stored_read
+from stage_cache import image_hash
+from stage_cache import run_stages
+from label_statistics import n_labels
+from label_statistics import label_counts
+from label_statistics import remove_labels
 
+# Real radius of the largest expected basin (cell), defining the h-transform halo of a z-slab:
+DEF_SEED_RADIUS = 5.
 
-def segmentation_fname(img2seg_fname, h_min, iso, equalize, stretch):
+
+def segmentation_fname(img2seg_fname, h_min, iso, equalize, stretch, ext='.inr'):
     """
     Generate the segmentation filename using some of the pipeline steps.
 
@@ -55,13 +75,17 @@ def segmentation_fname(img2seg_fname, h_min, iso, equalize, stretch):
         indicate if adaptative equalization of intensity was performed
     stretch : bool
         indicate if intensity histogram stretching was performed
+    ext : str, optional
+        extension of the segmentation file, '.inr' by default
     """
     suffix = '-seg'
     suffix += '-iso' if iso else ''
     suffix += '-adpat_eq' if equalize else ''
     suffix += '-hist_stretch' if stretch else ''
     suffix += '-h_min{}'.format(h_min)
-    seg_img_fname = splitext_zip(img2seg_fname)[0] + suffix + '.inr'
+    if not ext.startswith('.'):
+        ext = '.' + ext
+    seg_img_fname = splitext_zip(img2seg_fname)[0] + suffix + ext
     return seg_img_fname
 
 
@@ -78,13 +102,12 @@ def signal_subtraction(img2seg, img2sub):
     """
     vxs = img2seg.voxelsize
     ori = img2seg.origin()
-    md = img.metadata
+    md = img2seg.metadata
 
     try:
         assert np.allclose(img2seg.shape, img2sub.shape)
     except AssertionError:
         raise ValueError("Input images does not have the same shape!")
-    img2sub = read_image(substract_inr)
     # img2sub = morphology(img2sub, method='erosion', radius=3.)
     tmp_im = img2seg - img2sub
     tmp_im[img2seg <= img2sub] = 0
@@ -93,7 +116,7 @@ def signal_subtraction(img2seg, img2sub):
     return img2seg
 
 
-def read_image(im_fname, channel_names=None, pattern='..CZXY.'):
+def read_image(im_fname, channel_names=None, pattern='..CZXY.', lazy=False, store=None, bbox=None):
     """
     Read CZI, LSM, TIF and INR images based on the 'im_fname' extension.
 
@@ -104,14 +127,48 @@ def read_image(im_fname, channel_names=None, pattern='..CZXY.'):
     channel_names : list(str), optional
         list of channel names to use if im_fname is a multi-channel image
     pattern : str, optional
-        CZI data ordering pattern, often '..CZXY.' or '.C.ZXY.'
+        CZI data ordering pattern, often '..CZXY.' or '.C.ZXY.', not used
+        with 'lazy' as the ordering is then read from the CZI header
+    lazy : bool, optional
+        if True (default, False), multi-channel CZI & LSM images are returned
+        as a `LazyChannels` dictionary, decoding each channel only when first
+        accessed
+    store : ImageStore|bool, optional
+        store used to convert CZI & LSM images once and memory-map them on
+        later reads, by default the one defined by the 'SAMMAPS_IMAGE_STORE'
+        environment variable (if any), use False to disable it
+    bbox : list, optional
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded, to
+        read only a sub-volume of a single channel image, only the required
+        chunks are decompressed for chunked images ('.cimg') and only the
+        required z-slices are read for INR images
 
     Returns
     -------
     im : SpatialImage|dict(SpatialImage)
         SpatialImage or dictionary of SpatialImages if a multi-channel images
+
+    Notes
+    -----
+    With a store, 'pattern' is not used as the ordering is read from the CZI
+    header, and all channels are memory-mapped if 'lazy' is False.
     """
-    if im_fname.endswith(".inr") or im_fname.endswith(".inr.gz"):
+    if im_fname.endswith(CHUNKED_EXT):
+        return read_chunked(im_fname, bbox)
+    if bbox is not None and (im_fname.endswith(".inr") or im_fname.endswith(".inr.gz")):
+        return read_inr(im_fname, bbox)
+    if store is None:
+        store = default_image_store()
+    if (lazy or store) and (im_fname.endswith(".czi") or im_fname.endswith(".lsm")):
+        if store:
+            im = stored_read(store, im_fname, channel_names)
+        else:
+            im = lazy_read(im_fname, channel_names)
+        if im_fname.endswith(".lsm") and len(im) == 1:
+            im = im.values()[0]
+        elif not lazy:
+            im = dict(im.items())
+    elif im_fname.endswith(".inr") or im_fname.endswith(".inr.gz"):
         im = imread(im_fname)
     elif im_fname.endswith(".tif"):
         im = imread(im_fname)
@@ -137,9 +194,87 @@ def read_image(im_fname, channel_names=None, pattern='..CZXY.'):
                 im[k] = SpatialImage(ch, voxelsize=ch.voxelsize)
     else:
         raise TypeError("Unknown reader for file '{}'".format(im_fname))
+
+    if bbox is not None:
+        try:
+            assert isinstance(im, SpatialImage)
+        except AssertionError:
+            raise ValueError("Can not use a bounding box with a multi-channel image!")
+        im = crop_bbox(im, bbox)
     return im
 
 
+def read_image_header(im_fname):
+    """
+    Return the shape and voxelsize of an image, reading only the file header
+    for INR and chunked images ('.cimg').
+
+    Parameters
+    ----------
+    im_fname : str
+        filename of the image
+
+    Returns
+    -------
+    shape : list
+        shape of the image
+    voxelsize : list
+        voxelsize of the image
+    """
+    if im_fname.endswith(CHUNKED_EXT):
+        header = read_chunked_header(im_fname)
+    elif im_fname.endswith(".inr") or im_fname.endswith(".inr.gz"):
+        header = read_inr_header(im_fname)
+        # - 2D images are read as such by `imread`:
+        if header['shape'][2] == 1:
+            header['shape'], header['voxelsize'] = header['shape'][:2], header['voxelsize'][:2]
+    else:
+        im = read_image(im_fname)
+        header = {'shape': list(im.shape), 'voxelsize': list(im.voxelsize)}
+    return header['shape'], header['voxelsize']
+
+
+def crop_bbox(img, bbox):
+    """
+    Return a sub-volume of an image, with its origin moved accordingly.
+
+    Parameters
+    ----------
+    img : SpatialImage
+        image to crop
+    bbox : list
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded
+
+    Returns
+    -------
+    SpatialImage
+        the cropped image
+    """
+    sl = tuple(slice(start, stop) for start, stop in bbox)
+    vxs = img.voxelsize
+    ori = [o + s.indices(n)[0] * v for o, s, n, v in zip(img.origin(), sl, img.shape, vxs)]
+    return SpatialImage(np.array(img[sl]), voxelsize=vxs, origin=ori)
+
+
+def save_image(im_fname, img):
+    """
+    Save an image based on the 'im_fname' extension, adding the chunked
+    image container ('.cimg') to the formats handled by `imsave`.
+
+    Parameters
+    ----------
+    im_fname : str
+        filename of the image to write
+    img : SpatialImage
+        image to save
+    """
+    if im_fname.endswith(CHUNKED_EXT):
+        save_chunked(im_fname, img)
+    else:
+        imsave(im_fname, img)
+    return
+
+
 def replace_channel_names(img_dict, channel_names):
     """Replace the keys (channel names) of an image dictionary.
 
@@ -167,7 +302,615 @@ def replace_channel_names(img_dict, channel_names):
     return img_dict
 
 
-def seg_pipe(img2seg, h_min, img2sub=None, iso=True, equalize=True, stretch=False, std_dev=0.8, min_cell_volume=20., back_id=1, to_8bits=False):
+def intensity_rescaling(img2seg, equalize=True, stretch=False, verbose=True):
+    """Performs z-slice intensity rescaling of the image to segment.
+
+    Parameters
+    ----------
+    img2seg : SpatialImage
+        image to segment.
+    equalize : bool, optional
+        if True (default), intensity adaptative equalization is performed
+    stretch : bool, optional
+        if True (default, False), intensity histogram stretching is performed
+    verbose : bool, optional
+        if True (default), print the performed steps
+
+    Returns
+    -------
+    img2seg : SpatialImage
+        the rescaled image
+
+    Notes
+    -----
+    Both methods work z-slice by z-slice, so the result for a given slice does
+    not depend on the other slices of the stack.
+    """
+    if equalize:
+        if verbose:
+            print "\n - Performing z-slices adaptative histogram equalisation on the intensity image to segment..."
+        img2seg = z_slice_equalize_adapthist(img2seg)
+    if stretch:
+        if verbose:
+            print "\n - Performing z-slices histogram contrast stretching on the intensity image to segment..."
+        img2seg = z_slice_contrast_stretch(img2seg)
+    return img2seg
+
+
+def gaussian_smoothing(img2seg, std_dev, verbose=True):
+    """Performs Gaussian smoothing, on an isometric version of the image if
+    'std_dev' is smaller than the smallest voxelsize.
+
+    Parameters
+    ----------
+    img2seg : SpatialImage
+        image to smooth.
+    std_dev : float
+        real unit standard deviation used for Gaussian smoothing
+    verbose : bool, optional
+        if True (default), print the performed steps
+
+    Returns
+    -------
+    iso_smooth_img : SpatialImage
+        the smoothed image, isometric if a resampling was required
+    smooth_img : SpatialImage
+        the smoothed image with the voxelsize of 'img2seg'
+    """
+    ori_vxs = img2seg.voxelsize
+    ori_shape = img2seg.shape
+    min_vxs = min(ori_vxs)
+    if std_dev < min_vxs:
+        if verbose:
+            print " -- Isometric resampling prior to Gaussian smoothing...".format(std_dev)
+        img2seg = isometric_resampling(img2seg)
+
+    if verbose:
+        print " -- Gaussian smoothing with std_dev={}...".format(std_dev)
+    iso_smooth_img = linear_filtering(img2seg, std_dev=std_dev, method='gaussian_smoothing', real=True)
+
+    if std_dev < min_vxs:
+        if verbose:
+            print " -- Down-sampling a copy back to original voxelsize (to use with `h-transform`)..."
+        smooth_img = resample(iso_smooth_img, ori_vxs)
+        if not np.allclose(ori_shape, smooth_img.shape) and verbose:
+            print "WARNING: shape missmatch after down-sampling from isometric image:"
+            print " -- original image shape: {}".format(ori_shape)
+            print " -- down-sampled image shape: {}".format(smooth_img.shape)
+    else:
+        if verbose:
+            print " -- Copying original image (to use with `h-transform`)..."
+        smooth_img = iso_smooth_img
+
+    return iso_smooth_img, smooth_img
+
+
+def seed_detection(smooth_img, h_min, to_8bits=False, verbose=True):
+    """Detect the seeds as the connected components of the h-minima.
+
+    Parameters
+    ----------
+    smooth_img : SpatialImage
+        smoothed intensity image.
+    h_min : int
+        h-minima used with the h-transform function
+    to_8bits : bool, optional
+        transform the image as an unsigned 8 bits image for the h-transform
+    verbose : bool, optional
+        if True (default), print the performed steps
+
+    Returns
+    -------
+    seed_img : SpatialImage
+        the labelled image of seeds
+    """
+    if verbose:
+        print " -- H-minima transform with h-min={}...".format(h_min)
+    if to_8bits:
+        ext_img = h_transform(smooth_img.to_8bits(), h=h_min, method='h_transform_min')
+    else:
+        ext_img = h_transform(smooth_img, h=h_min, method='h_transform_min')
+
+    if verbose:
+        print " -- Region labelling: connexe components detection..."
+    seed_img = region_labeling(ext_img, low_threshold=1, high_threshold=h_min, method='connected_components')
+    del ext_img  # no need to keep this image after this step!
+    return seed_img
+
+
+def preprocessing_stages(voxelsize, img2sub=None, equalize=True, stretch=False, std_dev=0.8, cache=None):
+    """Return the stages leading from the image to segment to the smoothed
+    image used by the h-transform, to use with `run_stages`.
+
+    Parameters
+    ----------
+    voxelsize : list(float)
+        voxelsize of the image to segment.
+    img2sub : SpatialImage, optional
+        image to subtract to the image to segment.
+    equalize : bool, optional
+        if True (default), intensity adaptative equalization is performed
+    stretch : bool, optional
+        if True (default, False), intensity histogram stretching is performed
+    std_dev : float, optional
+        real unit standard deviation used for Gaussian smoothing
+    cache : StageCache, optional
+        if given, the content hash of 'img2sub' is added to the stage parameters
+
+    Returns
+    -------
+    list(tuple)
+        list of (name, params, func) stages, the 'smoothing' stage returns the
+        (isometric if needed) smoothed image and the last one the smoothed
+        image with original voxelsize
+    """
+    def subtraction(img):
+        print "\n - Performing signal substraction..."
+        return signal_subtraction(img, img2sub)
+
+    def isometric(img):
+        print " -- Isometric resampling prior to Gaussian smoothing...".format(std_dev)
+        return isometric_resampling(img)
+
+    def smoothing(img):
+        print " -- Gaussian smoothing with std_dev={}...".format(std_dev)
+        return linear_filtering(img, std_dev=std_dev, method='gaussian_smoothing', real=True)
+
+    def down_sampling(img):
+        print " -- Down-sampling a copy back to original voxelsize (to use with `h-transform`)..."
+        return resample(img, voxelsize)
+
+    stages = []
+    if img2sub is not None:
+        sub_key = image_hash(img2sub) if cache is not None else None
+        stages.append(('subtraction', {'img2sub': sub_key}, subtraction))
+    stages.append(('rescaling', {'equalize': equalize, 'stretch': stretch},
+                   lambda img: intensity_rescaling(img, equalize, stretch)))
+    if std_dev < min(voxelsize):
+        stages.append(('isometric', {}, isometric))
+    stages.append(('smoothing', {'std_dev': std_dev}, smoothing))
+    if std_dev < min(voxelsize):
+        stages.append(('down-sampling', {'voxelsize': list(voxelsize)}, down_sampling))
+    return stages
+
+
+def seed_stages(h_min, to_8bits=False):
+    """Return the stages leading from the smoothed image to the seed image,
+    to use with `run_stages`.
+
+    Parameters
+    ----------
+    h_min : int
+        h-minima used with the h-transform function
+    to_8bits : bool, optional
+        transform the image as an unsigned 8 bits image for the h-transform
+
+    Returns
+    -------
+    list(tuple)
+        list of (name, params, func) stages
+    """
+    def h_transform_min(img):
+        print " -- H-minima transform with h-min={}...".format(h_min)
+        if to_8bits:
+            img = img.to_8bits()
+        return h_transform(img, h=h_min, method='h_transform_min')
+
+    def labelling(img):
+        print " -- Region labelling: connexe components detection..."
+        return region_labeling(img, low_threshold=1, high_threshold=h_min, method='connected_components')
+
+    return [('h_transform', {'h_min': h_min, 'to_8bits': to_8bits}, h_transform_min),
+            ('seeds', {'h_min': h_min}, labelling)]
+
+
+def seed_halo(std_dev, voxelsize, seed_radius=DEF_SEED_RADIUS, extra=1):
+    """Number of z-slices to add on each side of a slab to compute its seeds.
+
+    Parameters
+    ----------
+    std_dev : float
+        real unit standard deviation used for Gaussian smoothing
+    voxelsize : list(float)
+        voxelsize of the image to segment
+    seed_radius : float, optional
+        real radius of the largest expected basin, covered by the halo of the
+        h-transform
+    extra : int, optional
+        number of z-slices added to the Gaussian kernel half-width (3 sigmas)
+
+    Returns
+    -------
+    int
+        the halo size, in z-slices
+
+    Notes
+    -----
+    The halo covers the Gaussian kernel support, so the smoothed slab core
+    equals the smoothed image, plus 'seed_radius' for the h-transform.
+    The h-transform is a morphological reconstruction: whether a basin passes
+    the 'h_min' test depends on its whole extent up to a depth of 'h_min'.
+    'h_min' is an intensity depth and gives no spatial bound on this extent,
+    so basins reaching more than 'seed_radius' beyond the slab core may be
+    detected differently than on the full image: slab seeds can then differ
+    from full-image seeds (eg. a large flat basin split or merged).
+    Minima spanning a slab boundary are detected in both slabs and their
+    labels are merged by `stitch_slab_labels`.
+    """
+    return int(np.ceil(3. * std_dev / voxelsize[2])) + int(np.ceil(seed_radius / voxelsize[2])) + extra
+
+
+def slab_thickness(shape, voxelsize, itemsize, std_dev, max_mem, halo):
+    """Number of z-slices in a slab core so the seed detection stays below a
+    given memory ceiling.
+
+    Parameters
+    ----------
+    shape : list(int)
+        shape of the image to segment
+    voxelsize : list(float)
+        voxelsize of the image to segment
+    itemsize : int
+        number of bytes used by a voxel of the image to segment
+    std_dev : float
+        real unit standard deviation used for Gaussian smoothing
+    max_mem : float
+        memory ceiling, in Mb
+    halo : int
+        number of z-slices added on each side of a slab
+
+    Returns
+    -------
+    int
+        the slab core thickness, in z-slices
+    """
+    min_vxs = min(voxelsize)
+    iso_ratio = 0.
+    if std_dev < min_vxs:
+        iso_ratio = np.prod(voxelsize) / min_vxs ** 3
+    # raw, rescaled, smoothed & h-transform slabs, two isometric copies and the uint32 seeds:
+    slice_bytes = shape[0] * shape[1] * (itemsize * (4 + 2 * iso_ratio) + 4)
+    n_z = int(max_mem * 2 ** 20 // slice_bytes) - 2 * halo
+    try:
+        assert n_z >= 1
+    except AssertionError:
+        raise ValueError("Memory ceiling of {}Mb is too small for a z-slab with a {} slices halo!".format(max_mem, halo))
+    return n_z
+
+
+def z_slabs(n_z, thickness, halo):
+    """Split the z-axis into overlapping slabs.
+
+    Parameters
+    ----------
+    n_z : int
+        number of z-slices in the image
+    thickness : int
+        number of z-slices in the core of a slab
+    halo : int
+        number of z-slices added on each side of a slab core
+
+    Returns
+    -------
+    list(tuple)
+        list of (start, stop, core_start, core_stop) z-slice indexes
+    """
+    slabs = []
+    for core_start in range(0, n_z, thickness):
+        core_stop = min(core_start + thickness, n_z)
+        slabs.append((max(core_start - halo, 0), min(core_stop + halo, n_z), core_start, core_stop))
+    return slabs
+
+
+def slab_label_lut(label_arr, boundaries):
+    """Look-up table merging the labels of components split across slab
+    boundaries and relabelling them consecutively.
+
+    Parameters
+    ----------
+    label_arr : np.array
+        3D labelled array, 0 is the background
+    boundaries : list(int)
+        first z-slice index of each slab core, except the first one
+
+    Returns
+    -------
+    np.array
+        the look-up table, indexed by the labels of 'label_arr'
+    """
+    max_lab = int(label_arr.max())
+    parent = np.arange(max_lab + 1)
+
+    def find(lab):
+        while parent[lab] != lab:
+            parent[lab] = parent[parent[lab]]
+            lab = parent[lab]
+        return lab
+
+    for b in boundaries:
+        below = label_arr[:, :, b - 1]
+        above = label_arr[:, :, b]
+        mask = (below != 0) & (above != 0)
+        pairs = np.unique(below[mask].astype(np.int64) * (max_lab + 1) + above[mask])
+        for lab_1, lab_2 in zip(pairs // (max_lab + 1), pairs % (max_lab + 1)):
+            root_1, root_2 = find(lab_1), find(lab_2)
+            if root_1 != root_2:
+                parent[max(root_1, root_2)] = min(root_1, root_2)
+
+    roots = np.array([find(lab) for lab in range(max_lab + 1)])
+    # - Labels dropped with the halos leave no root, only keep the used ones:
+    used = np.zeros(max_lab + 1, dtype=bool)
+    for start in range(0, label_arr.shape[2], 16):
+        used[np.unique(label_arr[:, :, start:start + 16])] = True
+    used[0] = False
+    uniq_roots = np.unique(roots[used])
+    lut = np.zeros(max_lab + 1, dtype=label_arr.dtype)
+    lut[used] = np.searchsorted(uniq_roots, roots[used]) + 1
+    return lut
+
+
+def stitch_slab_labels(label_arr, boundaries):
+    """Merge the labels of components split across slab boundaries and
+    relabel them consecutively.
+
+    Parameters
+    ----------
+    label_arr : np.array
+        3D labelled array, 0 is the background
+    boundaries : list(int)
+        first z-slice index of each slab core, except the first one
+
+    Returns
+    -------
+    int
+        the number of labels after stitching
+    """
+    lut = slab_label_lut(label_arr, boundaries)
+    for start in range(0, label_arr.shape[2], 16):
+        label_arr[:, :, start:start + 16] = lut[label_arr[:, :, start:start + 16]]
+    return int(lut.max())
+
+
+def fit_to_shape(img, shape):
+    """Crop or edge-pad an image so it has the given shape.
+
+    Parameters
+    ----------
+    img : SpatialImage
+        image to crop or pad
+    shape : list(int)
+        the expected shape
+
+    Returns
+    -------
+    SpatialImage
+        image with the expected shape and the voxelsize of 'img'
+    """
+    if np.allclose(img.shape, shape):
+        return img
+    arr = img[tuple(slice(0, s) for s in shape)]
+    pad = [(0, max(s - a, 0)) for s, a in zip(shape, arr.shape)]
+    arr = np.pad(arr, pad, mode='edge')
+    return SpatialImage(arr, voxelsize=img.voxelsize, origin=img.origin())
+
+
+def chunked_seed_detection(img2seg, h_min, img2sub=None, equalize=True, stretch=False, std_dev=0.8, to_8bits=False, max_mem=1024., tmp_dir=None, seed_radius=DEF_SEED_RADIUS):
+    """Stream overlapping z-slabs through intensity rescaling, smoothing,
+    h-minima transform and seed labelling.
+
+    Parameters
+    ----------
+    img2seg : SpatialImage
+        image to segment, may be backed by a memory-mapped array.
+    h_min : int
+        h-minima used with the h-transform function
+    img2sub : SpatialImage, optional
+        image to subtract to the image to segment.
+    equalize : bool, optional
+        if True (default), intensity adaptative equalization is performed
+    stretch : bool, optional
+        if True (default, False), intensity histogram stretching is performed
+    std_dev : float, optional
+        real unit standard deviation used for Gaussian smoothing
+    to_8bits : bool, optional
+        transform the slabs as unsigned 8 bits images for the h-transform
+    max_mem : float, optional
+        memory ceiling for a slab, in Mb
+    tmp_dir : str
+        directory where the smoothed and seed stacks are memory-mapped, so
+        only the slabs are held in memory, required
+    seed_radius : float, optional
+        real radius of the largest expected basin, see `seed_halo`
+
+    Returns
+    -------
+    smooth_img : SpatialImage
+        the smoothed image with original voxelsize
+    seed_img : SpatialImage
+        the labelled image of stitched seeds
+    """
+    try:
+        assert tmp_dir is not None
+    except AssertionError:
+        raise ValueError("A directory is required to memory-map the smoothed and seed stacks!")
+    vxs = img2seg.voxelsize
+    ori = img2seg.origin()
+    shape = img2seg.shape
+    halo = seed_halo(std_dev, vxs, seed_radius)
+    thickness = slab_thickness(shape, vxs, img2seg.dtype.itemsize, std_dev, max_mem, halo)
+    slabs = z_slabs(shape[2], thickness, halo)
+    print " -- Processing {} z-slabs of {} slices (+{} slices halo)...".format(len(slabs), thickness, halo)
+
+    smooth_arr = np.memmap(join(tmp_dir, 'smooth.dat'), dtype=img2seg.dtype, mode='w+', shape=shape, order='F')
+    seed_arr = np.memmap(join(tmp_dir, 'seeds.dat'), dtype=np.uint32, mode='w+', shape=shape, order='F')
+
+    offset = 0
+    for n, (start, stop, core_start, core_stop) in enumerate(slabs):
+        print "  - slab {}/{}: z-slices {} to {}...".format(n + 1, len(slabs), core_start, core_stop - 1)
+        slab = SpatialImage(np.array(img2seg[:, :, start:stop]), voxelsize=vxs, origin=ori)
+        if img2sub is not None:
+            sub_slab = SpatialImage(np.array(img2sub[:, :, start:stop]), voxelsize=vxs, origin=ori)
+            slab = signal_subtraction(slab, sub_slab)
+        slab = intensity_rescaling(slab, equalize, stretch, verbose=False)
+        _, smooth_slab = gaussian_smoothing(slab, std_dev, verbose=False)
+        smooth_slab = fit_to_shape(smooth_slab, slab.shape)
+        seed_slab = seed_detection(smooth_slab, h_min, to_8bits, verbose=False)
+        # - Keep the core of the slab and make its seed labels unique:
+        core = slice(core_start - start, core_stop - start)
+        smooth_arr[:, :, core_start:core_stop] = smooth_slab[:, :, core]
+        core_seeds = np.array(seed_slab[:, :, core], dtype=np.uint32)
+        core_seeds[core_seeds != 0] += offset
+        seed_arr[:, :, core_start:core_stop] = core_seeds
+        offset += int(seed_slab.max())
+        del slab, smooth_slab, seed_slab, core_seeds
+
+    print " -- Stitching seed labels across slab boundaries..."
+    lut = slab_label_lut(seed_arr, [core_start for _, _, core_start, _ in slabs[1:]])
+    seed_dtype = np.uint16 if lut.max() < 2 ** 16 else np.uint32
+    # - Write the stitched seeds directly with their final dtype, never copying the whole stack:
+    if seed_dtype == np.uint32:
+        out_arr = seed_arr
+    else:
+        out_arr = np.memmap(join(tmp_dir, 'stitched_seeds.dat'), dtype=seed_dtype, mode='w+', shape=shape, order='F')
+    for start in range(0, shape[2], 16):
+        out_arr[:, :, start:start + 16] = lut[seed_arr[:, :, start:start + 16]]
+    del seed_arr
+    smooth_img = SpatialImage(smooth_arr, voxelsize=vxs, origin=ori)
+    seed_img = SpatialImage(out_arr, voxelsize=vxs, origin=ori)
+    return smooth_img, seed_img
+
+
+def seeded_watershed(smooth_img, seed_img, to_8bits=False):
+    """Performs the seeded watershed segmentation.
+
+    Parameters
+    ----------
+    smooth_img : SpatialImage
+        smoothed intensity image, isometric if 'iso' is True
+    seed_img : SpatialImage
+        labelled image of seeds with the voxelsize of 'smooth_img'
+    to_8bits : bool, optional
+        transform the intensity image as an unsigned 8 bits image
+
+    Returns
+    -------
+    seg_im : SpatialImage
+        the labelled image obtained by seeded-watershed
+    """
+    print "\n - Performing seeded watershed segmentation..."
+    if to_8bits:
+        seg_im = segmentation(smooth_img.to_8bits(), seed_img, method='seeded_watershed')
+    else:
+        seg_im = segmentation(smooth_img, seed_img, method='seeded_watershed')
+    # seg_im[seg_im == 0] = back_id
+    print "Detected {} labels!".format(n_labels(seg_im))
+    return seg_im
+
+
+def local_reflooding(seg_im, smooth_img, labels):
+    """Remove labels from a segmented image by re-flooding only their region
+    from the surrounding cells.
+
+    Parameters
+    ----------
+    seg_im : SpatialImage
+        labelled image obtained by seeded-watershed
+    smooth_img : SpatialImage
+        smoothed intensity image used to obtain 'seg_im'
+    labels : list(int)
+        list of labels to remove
+
+    Returns
+    -------
+    seg_im : SpatialImage
+        the labelled image without the given labels
+
+    Notes
+    -----
+    For each removed label, the seeded watershed is computed in its bounding
+    box, enlarged by one voxel to include its neighbors, using the current
+    labels of the other cells as markers. Only the voxels of the removed cell
+    are merged back. If all the labels of the box are removed (eg. a cluster
+    of small cells), the margin is doubled until the box contains a kept
+    label; labels with no kept label in the whole image are left unchanged.
+    Using the seeds of the neighbors instead of their region as markers would
+    let the cells kept as markers invade them.
+    """
+    seg_arr = np.array(seg_im)
+    shape = seg_arr.shape
+    removed = np.zeros(seg_arr.max() + 1, dtype=bool)
+    removed[labels] = True
+    objects = nd.find_objects(seg_arr)
+
+    for lab in labels:
+        if objects[lab - 1] is None:
+            continue
+        margin = 1
+        while True:
+            box = tuple(slice(max(s.start - margin, 0), min(s.stop + margin, n)) for s, n in zip(objects[lab - 1], shape))
+            crop = seg_arr[box]
+            reflood = removed[crop]
+            markers = np.where(reflood, 0, crop).astype(seg_arr.dtype)
+            # - Grow the box until it contains a kept label to flood from:
+            if markers.any() or all(b.stop - b.start == n for b, n in zip(box, shape)):
+                break
+            margin *= 2
+        if not reflood.any():
+            continue  # already re-flooded with a previous label
+        if not markers.any():
+            print "WARNING: no kept label to re-flood label {} from, it is kept!".format(lab)
+            continue
+        local_seg = segmentation(SpatialImage(np.array(smooth_img[box]), voxelsize=smooth_img.voxelsize),
+                                 SpatialImage(markers, voxelsize=seg_im.voxelsize), method='seeded_watershed')
+        crop[reflood] = np.asarray(local_seg)[reflood]
+
+    return SpatialImage(seg_arr, voxelsize=seg_im.voxelsize, origin=seg_im.origin())
+
+
+def cell_volume_filtering(seg_im, seed_img, smooth_img, min_cell_volume, local=False):
+    """Remove the seeds leading to cells smaller than 'min_cell_volume' and
+    performs the seeded watershed segmentation again.
+
+    Parameters
+    ----------
+    seg_im : SpatialImage
+        labelled image obtained by seeded-watershed
+    seed_img : SpatialImage
+        labelled image of seeds used to obtain 'seg_im'
+    smooth_img : SpatialImage
+        smoothed intensity image used to obtain 'seg_im'
+    min_cell_volume : float
+        minimal volume accepted in the segmented image
+    local : bool, optional
+        if True (default, False), only re-flood the region of the small cells,
+        see `local_reflooding`, else performs the seeded watershed on the whole
+        image
+
+    Returns
+    -------
+    seg_im : SpatialImage
+        the filtered labelled image
+    """
+    print "\n - Performing cell volume filtering..."
+    vol = label_counts(seg_im) * np.prod(seg_im.voxelsize)
+    too_small_labels = [k for k in np.where(vol < min_cell_volume)[0] if vol[k] > 0 and k != 0]
+    if too_small_labels != []:
+        print "Detected {} labels with a volume < {}µm2".format(len(too_small_labels), min_cell_volume)
+        if local:
+            print " -- Re-flooding small cells from their neighbors..."
+            seg_im = local_reflooding(seg_im, smooth_img, too_small_labels)
+        else:
+            print " -- Removing seeds leading to small cells..."
+            seed_arr = remove_labels(seed_img, too_small_labels)
+            seed_img = SpatialImage(seed_arr, voxelsize=seed_img.voxelsize, origin=seed_img.origin())
+            print " -- Performing final seeded watershed segmentation..."
+            seg_im = segmentation(smooth_img, seed_img, method='seeded_watershed')
+        # seg_im[seg_im == 0] = back_id
+        print "Detected {} labels!".format(n_labels(seg_im))
+    return seg_im
+
+
+def seg_pipe(img2seg, h_min, img2sub=None, iso=True, equalize=True, stretch=False, std_dev=0.8, min_cell_volume=20., back_id=1, to_8bits=False, seed_max_mem=None, tmp_dir=None, cache=None, local_reflood=False, seed_radius=DEF_SEED_RADIUS):
     """Define the sementation pipeline
 
     Parameters
@@ -196,6 +939,23 @@ def seg_pipe(img2seg, h_min, img2sub=None, iso=True, equalize=True, stretch=Fals
     to_8bits : bool, optional
         transform the image to segment as an unsigned 8 bits image for the h-transform
         and seed-labelleing steps
+    seed_max_mem : float, optional
+        if given, memory ceiling (in Mb) of the seed detection only, performed
+        by overlapping z-slabs, see `chunked_seed_detection`
+    tmp_dir : str, optional
+        directory where the smoothed and seed stacks are memory-mapped,
+        required with 'seed_max_mem'
+    cache : StageCache, optional
+        if given, the intermediate images (rescaled, isometric, smoothed,
+        h-transform & seeds) are loaded from or saved to this on-disk cache,
+        not used with 'seed_max_mem'
+    local_reflood : bool, optional
+        if True (default, False), small cells are removed by re-flooding only
+        their region instead of performing a second watershed on the whole
+        image
+    seed_radius : float, optional
+        with 'seed_max_mem', real radius of the largest expected basin, used to
+        size the halo of the z-slabs, see `seed_halo`
 
     Returns
     -------
@@ -218,6 +978,16 @@ def seg_pipe(img2seg, h_min, img2sub=None, iso=True, equalize=True, stretch=Fals
       * Segmentation will be performed on the isometric images if iso is True, in
         such case we resample the image of detected seeds and use the isometric
         smoothed intensity image;
+      * 'seed_max_mem' does not bound the memory of the whole pipeline: the
+        isometric resampling, the watershed and the cell volume filtering
+        still work on the whole image;
+      * With 'seed_max_mem', the isometric smoothed image used by the watershed
+        is obtained by resampling the stitched smoothed image;
+      * With 'seed_max_mem', seeds of basins reaching further than 'seed_radius'
+        beyond a slab core may differ from the full-image ones, see `seed_halo`;
+      * With a 'cache', each intermediate image is identified by the content
+        hash of 'img2seg' and the parameters of all the stages leading to it,
+        so changing 'h_min' only recomputes the h-transform and the seeds.
     """
     t_start = time.time()
     # - Check we have only one intensity rescaling method called:
@@ -231,84 +1001,164 @@ def seg_pipe(img2seg, h_min, img2sub=None, iso=True, equalize=True, stretch=Fals
     except AssertionError:
         raise ValueError("Standard deviation for Gaussian smoothing should be superior or equal to 1!")
 
-    ori_vxs = img2seg.voxelsize
-    ori_shape = img2seg.shape
+    # - Check the seed detection by z-slabs can memory-map its stacks:
+    try:
+        assert seed_max_mem is None or tmp_dir is not None
+    except AssertionError:
+        raise ValueError("A temporary directory is required with a seed detection memory ceiling!")
 
-    if img2sub is not None:
-        print "\n - Performing signal substraction..."
-        img2seg = signal_subtraction(img2seg, img2sub)
+    if seed_max_mem is not None:
+        print "\n - Automatic seed detection by z-slabs (seed_max_mem={}Mb)...".format(seed_max_mem)
+        smooth_img, seed_img = chunked_seed_detection(img2seg, h_min, img2sub, equalize, stretch, std_dev, to_8bits, seed_max_mem, tmp_dir, seed_radius)
+        print "Detected {} seeds!".format(seed_img.max())
+        if iso:
+            smooth_img = isometric_resampling(smooth_img)
+    else:
+        print "\n - Automatic seed detection...".format(h_min)
+        # morpho_radius = 1.0
+        # asf_img = morphology(img2seg, max_radius=morpho_radius, method='co_alternate_sequential_filter')
+        # ext_img = h_transform(asf_img, h=h_min, method='h_transform_min')
+        stages = preprocessing_stages(img2seg.voxelsize, img2sub, equalize, stretch, std_dev, cache)
+        smooth_name = stages[-1][0]
+        stages += seed_stages(h_min, to_8bits)
+        # - Keep the (isometric if 'iso') smoothed image for the watershed:
+        keep = ['smoothing'] if iso else [smooth_name]
+        seed_img, kept, _ = run_stages(img2seg, stages, cache, keep=keep)
+        smooth_img = kept[keep[0]]
+        del kept
+        print "Detected {} seeds!".format(n_labels(seed_img))
 
-    if equalize:
-        print "\n - Performing z-slices adaptative histogram equalisation on the intensity image to segment..."
-        img2seg = z_slice_equalize_adapthist(img2seg)
-    if stretch:
-        print "\n - Performing z-slices histogram contrast stretching on the intensity image to segment..."
-        img2seg = z_slice_contrast_stretch(img2seg)
+    if iso:
+        seed_img = isometric_resampling(seed_img, option='label')
+    seg_im = seeded_watershed(smooth_img, seed_img, to_8bits)
+    if min_cell_volume > 0.:
+        seg_im = cell_volume_filtering(seg_im, seed_img, smooth_img, min_cell_volume, local_reflood)
 
-    print "\n - Automatic seed detection...".format(h_min)
-    # morpho_radius = 1.0
-    # asf_img = morphology(img2seg, max_radius=morpho_radius, method='co_alternate_sequential_filter')
-    # ext_img = h_transform(asf_img, h=h_min, method='h_transform_min')
-    min_vxs = min(img2seg.voxelsize)
-    if std_dev < min_vxs:
-        print " -- Isometric resampling prior to Gaussian smoothing...".format(std_dev)
-        img2seg = isometric_resampling(img2seg)
+    print "\nDone in {}s".format(round(time.time() - t_start, 3))
+    return seg_im
 
-    print " -- Gaussian smoothing with std_dev={}...".format(std_dev)
-    iso_smooth_img = linear_filtering(img2seg, std_dev=std_dev, method='gaussian_smoothing', real=True)
 
-    if std_dev < min_vxs:
-        print " -- Down-sampling a copy back to original voxelsize (to use with `h-transform`)..."
-        smooth_img = resample(iso_smooth_img, ori_vxs)
-        if not np.allclose(ori_shape, smooth_img.shape):
-            print "WARNING: shape missmatch after down-sampling from isometric image:"
-            print " -- original image shape: {}".format(ori_shape)
-            print " -- down-sampled image shape: {}".format(smooth_img.shape)
-    else:
-        print " -- Copying original image (to use with `h-transform`)..."
-        smooth_img = iso_smooth_img
+# - Images and parameters shared with the `seg_pipe_sweep` workers, inherited when forking:
+_SWEEP_DATA = {}
 
-    if not iso:
-        del iso_smooth_img  # no need to keep this image after this step!
 
-    print " -- H-minima transform with h-min={}...".format(h_min)
-    if to_8bits:
-        ext_img = h_transform(smooth_img.to_8bits(), h=h_min, method='h_transform_min')
-    else:
-        ext_img = h_transform(smooth_img, h=h_min, method='h_transform_min')
-    if iso:
-        smooth_img = iso_smooth_img  # no need to keep both images after this step!
+def _sweep_worker(h_min):
+    """Seed detection, seeded watershed and cell volume filtering for one
+    h-minima value of `seg_pipe_sweep`.
+    """
+    data = _SWEEP_DATA
+    print "\n - Automatic seed detection with h-min={}...".format(h_min)
+    seed_img = run_stages(data['smooth_img'], seed_stages(h_min, data['to_8bits']), data['cache'], data['key'])[0]
+    print "Detected {} seeds with h-min={}!".format(n_labels(seed_img), h_min)
+    if data['iso']:
+        seed_img = isometric_resampling(seed_img, option='label')
+    seg_im = seeded_watershed(data['ws_img'], seed_img, data['to_8bits'])
+    if data['min_cell_volume'] > 0.:
+        seg_im = cell_volume_filtering(seg_im, seed_img, data['ws_img'], data['min_cell_volume'], data['local_reflood'])
+    if h_min in data['out_fnames']:
+        print "\n - Saving h-min={} segmentation under '{}'".format(h_min, data['out_fnames'][h_min])
+        save_image(data['out_fnames'][h_min], seg_im)
+        return h_min, data['out_fnames'][h_min]
+    # - SpatialImage attributes are not pickled, send them along the array:
+    return h_min, (np.asarray(seg_im), list(seg_im.voxelsize), list(seg_im.origin()))
 
-    print " -- Region labelling: connexe components detection..."
-    seed_img = region_labeling(ext_img, low_threshold=1, high_threshold=h_min, method='connected_components')
-    print "Detected {} seeds!".format(len(np.unique(seed_img))-1)  # '0' is in the list!
-    del ext_img  # no need to keep this image after this step!
 
-    print "\n - Performing seeded watershed segmentation..."
-    if iso:
-        seed_img = isometric_resampling(seed_img, option='label')
-    if to_8bits:
-        seg_im = segmentation(smooth_img.to_8bits(), seed_img, method='seeded_watershed')
-    else:
-        seg_im = segmentation(smooth_img, seed_img, method='seeded_watershed')
-    # seg_im[seg_im == 0] = back_id
-    print "Detected {} labels!".format(len(np.unique(seg_im)))
+def seg_pipe_sweep(img2seg, h_min_list, img2sub=None, iso=True, equalize=True, stretch=False, std_dev=0.8, min_cell_volume=20., to_8bits=False, n_jobs=1, out_fnames=None, cache=None, local_reflood=False):
+    """Segmentation pipeline for a list of h-minima values, sharing the
+    preprocessing steps.
 
-    if min_cell_volume > 0.:
-        from vplants.tissue_analysis.spatial_image_analysis import SpatialImageAnalysis
-        print "\n - Performing cell volume filtering..."
-        spia = SpatialImageAnalysis(seg_im, background=None)
-        vol = spia.volume()
-        too_small_labels = [k for k, v in vol.items() if v < min_cell_volume and k != 0]
-        if too_small_labels != []:
-            print "Detected {} labels with a volume < {}µm2".format(len(too_small_labels), min_cell_volume)
-            print " -- Removing seeds leading to small cells..."
-            spia = SpatialImageAnalysis(seed_img, background=None)
-            seed_img = spia.get_image_without_labels(too_small_labels)
-            print " -- Performing final seeded watershed segmentation..."
-            seg_im = segmentation(smooth_img, seed_img, method='seeded_watershed')
-            # seg_im[seg_im == 0] = back_id
-            print "Detected {} labels!".format(len(np.unique(seg_im)))
+    Parameters
+    ----------
+    img2seg : SpatialImage
+        image to segment.
+    h_min_list : list(int)
+        list of h-minima values to use with the h-transform function
+    img2sub : SpatialImage, optional
+        image to subtract to the image to segment.
+    iso : bool, optional
+        if True (default), isometric resampling is performed after h-minima
+        detection and before watershed segmentation
+    equalize : bool, optional
+        if True (default), intensity adaptative equalization is performed before
+        h-minima detection
+    stretch : bool, optional
+        if True (default, False), intensity histogram stretching is performed
+        before h-minima detection
+    std_dev : float, optional
+        real unit standard deviation used for Gaussian smoothing of the image to segment
+    min_cell_volume : float, optional
+        minimal volume accepted in the segmented image
+    to_8bits : bool, optional
+        transform the image to segment as an unsigned 8 bits image for the h-transform
+        and seed-labelleing steps
+    n_jobs : int, optional
+        number of processes used to segment the image with each h-minima value
+    out_fnames : dict, optional
+        h-minima indexed dictionary of filenames, if given the labelled images
+        are saved by the workers instead of being returned
+    cache : StageCache, optional
+        if given, the intermediate images are loaded from or saved to this
+        on-disk cache
+    local_reflood : bool, optional
+        if True (default, False), small cells are removed by re-flooding only
+        their region
+
+    Returns
+    -------
+    dict
+        h-minima indexed dictionary of labelled images, or of filenames if
+        'out_fnames' is given
+
+    Notes
+    -----
+      * Intensity rescaling and Gaussian smoothing are performed once, see
+        `seg_pipe` for the details of each step;
+      * Workers are forked from this process and share the smoothed images
+        without copying them, each worker holds its own h-transform, seed and
+        labelled images.
+    """
+    from multiprocessing import Pool
+    t_start = time.time()
+    # - Check we have only one intensity rescaling method called:
+    try:
+        assert equalize + stretch < 2
+    except AssertionError:
+        raise ValueError("Both 'equalize' & 'stretch' can not be True at once!")
+    # - Check the standard deviation value for Gaussian smoothing is valid:
+    try:
+        assert std_dev <= 1.
+    except AssertionError:
+        raise ValueError("Standard deviation for Gaussian smoothing should be superior or equal to 1!")
+    if out_fnames is None:
+        out_fnames = {}
+
+    print "\n - Preprocessing the image to segment for {} h-minima values...".format(len(h_min_list))
+    stages = preprocessing_stages(img2seg.voxelsize, img2sub, equalize, stretch, std_dev, cache)
+    smooth_name = stages[-1][0]
+    smooth_img, kept, keys = run_stages(img2seg, stages, cache, keep=['smoothing'])
+    _SWEEP_DATA.update({'smooth_img': smooth_img, 'ws_img': kept['smoothing'] if iso else smooth_img,
+                        'key': keys.get(smooth_name), 'cache': cache, 'iso': iso, 'to_8bits': to_8bits,
+                        'min_cell_volume': min_cell_volume, 'out_fnames': out_fnames,
+                        'local_reflood': local_reflood})
+    del kept
+
+    try:
+        if n_jobs > 1:
+            pool = Pool(min(n_jobs, len(h_min_list)))
+            results = pool.map(_sweep_worker, h_min_list, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            results = [_sweep_worker(h_min) for h_min in h_min_list]
+    finally:
+        _SWEEP_DATA.clear()
+
+    seg_ims = {}
+    for h_min, res in results:
+        if isinstance(res, tuple):
+            arr, vxs, ori = res
+            res = SpatialImage(arr, voxelsize=vxs, origin=ori)
+        seg_ims[h_min] = res
 
     print "\nDone in {}s".format(round(time.time() - t_start, 3))
-    return seg_im
+    return seg_ims
@@ -1,3 +1,4 @@
+import numpy as np
 from matplotlib import gridspec
 import matplotlib.pyplot as plt
 
@@ -71,6 +72,45 @@ def slice_n_hist(image, title="", img_title="", figname="", aspect_ratio=None):
     return
 
 
+def read_slices(im_fname, x_slice=None, y_slice=None, z_slice=None):
+    """
+    Read only the required slices of an image file.
+    Slice numbering starts at 1, not 0 (like indexing).
+
+    Parameters
+    ----------
+    im_fname : str
+        filename of the image, only the required z-slices are read for INR
+        and chunked images ('.cimg')
+    x_slice : int, optional
+        Value defining the slice to read in x direction.
+    y_slice : int, optional
+        Value defining the slice to read in y direction.
+    z_slice : int, optional
+        Value defining the slice to read in z direction.
+
+    Returns
+    -------
+    shape : list
+        shape of the image
+    slices : list
+        list of the 2D x, y and z slices, None if not required
+    """
+    # - Imported here, as it requires the SamMaps path setup (timagetk, vplants):
+    from segmentation_pipeline import read_image
+    from segmentation_pipeline import read_image_header
+    shape = read_image_header(im_fname)[0]
+    slices = []
+    for axis, sl in enumerate([x_slice, y_slice, z_slice]):
+        if sl is None:
+            slices.append(None)
+            continue
+        bbox = [[0, s] for s in shape]
+        bbox[axis] = [sl - 1, sl]
+        slices.append(np.asarray(read_image(im_fname, bbox=bbox)).take(0, axis))
+    return shape, slices
+
+
 def slice_view(img, x_slice=None, y_slice=None, z_slice=None, title="", fig_name="", cmap='gray'):
     """
     Matplotlib representation of an image slice.
@@ -80,8 +120,9 @@ def slice_view(img, x_slice=None, y_slice=None, z_slice=None, title="", fig_name
 
     Parameters
     ----------
-    img : np.array or SpatialImage
-        Image from which to extract the slice
+    img : np.array or SpatialImage or str
+        Image from which to extract the slice, given as a filename only the
+        required slices are read (see `read_slices`)
     x_slice : int
         Value defining the slice to represent in x direction.
     y_slice : int
@@ -97,13 +138,17 @@ def slice_view(img, x_slice=None, y_slice=None, z_slice=None, title="", fig_name
         assert x_slice is not None or y_slice is not None or z_slice is not None
     except:
         raise ValueError("Provide at least one x, y or z slice to extract!")
-    x_sl, y_sl, z_sl = None, None, None
-    if x_slice is not None:
-        x_sl = img[x_slice-1, :, :]
-    if y_slice is not None:
-        y_sl = img[:, y_slice-1, :]
-    if z_slice is not None:
-        z_sl = img[:, :, z_slice-1]
+    if isinstance(img, str):
+        shape, (x_sl, y_sl, z_sl) = read_slices(img, x_slice, y_slice, z_slice)
+    else:
+        shape = img.shape
+        x_sl, y_sl, z_sl = None, None, None
+        if x_slice is not None:
+            x_sl = img[x_slice-1, :, :]
+        if y_slice is not None:
+            y_sl = img[:, y_slice-1, :]
+        if z_slice is not None:
+            z_sl = img[:, :, z_slice-1]
     # If only one slice is required, display it "alone":
     if sum([sl is not None for sl in [x_sl, y_sl, z_sl]]) == 1:
         sl = [s for s in [x_sl, y_sl, z_sl] if s is not None][0]
@@ -115,8 +160,8 @@ def slice_view(img, x_slice=None, y_slice=None, z_slice=None, title="", fig_name
             plt.savefig(fig_name)
     # If three slices are required, display them "orthogonaly":
     elif sum([sl is not None for sl in [x_sl, y_sl, z_sl]]) == 3:
-        x_sh, y_sh, z_sh = img.shape
-        mini, maxi = type_to_range(img)
+        x_sh, y_sh, z_sh = shape
+        mini, maxi = type_to_range(z_sl)
         plt.figure()
         gs = gridspec.GridSpec(2, 2, width_ratios=[x_sh, z_sh], height_ratios=[y_sh, z_sh])
         # plot z_slice:
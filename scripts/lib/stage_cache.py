@@ -0,0 +1,245 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the on-disk cache of intermediate images.
+
+Each cached image is identified by a key combining the content hash of the
+input image with the name and parameters of every stage that led to it.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from os import listdir
+from os.path import join
+from os.path import exists
+from os.path import getsize
+from os.path import getmtime
+
+from timagetk.components import SpatialImage
+
+
+def image_hash(img, n_slices=16):
+    """
+    Return the content hash of an image, computed by chunks of z-slices.
+
+    Parameters
+    ----------
+    img : SpatialImage
+        image to hash
+    n_slices : int, optional
+        number of z-slices hashed at once
+
+    Returns
+    -------
+    str
+        hexadecimal SHA1 digest of the image shape, dtype, voxelsize and values
+    """
+    sha = hashlib.sha1()
+    sha.update(repr((img.shape, str(img.dtype), list(getattr(img, 'voxelsize', [])))))
+    for start in range(0, img.shape[-1], n_slices):
+        sha.update(np.ascontiguousarray(img[..., start:start + n_slices]).tostring())
+    return sha.hexdigest()
+
+
+def stage_key(parent_key, stage, params):
+    """
+    Return the key of a stage given the key of the previous one.
+
+    Parameters
+    ----------
+    parent_key : str
+        key of the previous stage (or hash of the input image)
+    stage : str
+        name of the stage
+    params : dict
+        parameters of the stage
+
+    Returns
+    -------
+    str
+        hexadecimal SHA1 digest
+    """
+    sha = hashlib.sha1()
+    sha.update(parent_key)
+    sha.update(stage)
+    sha.update(json.dumps(params, sort_keys=True))
+    return sha.hexdigest()
+
+
+class StageCache(object):
+    """
+    On-disk cache of SpatialImages with least-recently-used eviction.
+
+    Each entry is saved as a '.npy' array with a '.json' sidecar holding the
+    voxelsize and origin. The modification time of the array file is updated
+    on each access and used to order evictions.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            directory where to save the cached images, created if missing
+        max_size : float, optional
+            maximum total size of the cache in Mb, unlimited by default
+        """
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _fnames(self, key):
+        return join(self.cache_dir, key + '.npy'), join(self.cache_dir, key + '.json')
+
+    def __contains__(self, key):
+        return all(exists(f) for f in self._fnames(key))
+
+    def load(self, key, mmap_mode=None):
+        """
+        Return the cached image for this key, or None if missing.
+
+        Parameters
+        ----------
+        key : str
+            key of the entry to load
+        mmap_mode : str, optional
+            if given, the array is memory-mapped with this mode (eg. 'r')
+        """
+        arr_fname, md_fname = self._fnames(key)
+        if key not in self:
+            return None
+        with open(md_fname, 'r') as f:
+            md = json.load(f)
+        img = SpatialImage(np.load(arr_fname, mmap_mode=mmap_mode), voxelsize=md['voxelsize'], origin=md['origin'])
+        if md.get('metadata'):
+            img.metadata.update(md['metadata'])
+        os.utime(arr_fname, None)
+        return img
+
+    def save(self, key, img):
+        """
+        Save an image under this key, then evict the least recently used
+        entries if the cache is too big.
+        """
+        arr_fname, md_fname = self._fnames(key)
+        # - Write to temporary files first so an interrupted run never leaves a partial entry:
+        with open(arr_fname + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(img))
+        md = {'voxelsize': list(img.voxelsize), 'origin': list(img.origin())}
+        # - Only keep the image metadata if it can be saved as json:
+        try:
+            md['metadata'] = json.loads(json.dumps(getattr(img, 'metadata', {})))
+        except (TypeError, ValueError):
+            pass
+        with open(md_fname + '.tmp', 'w') as f:
+            json.dump(md, f)
+        os.rename(arr_fname + '.tmp', arr_fname)
+        os.rename(md_fname + '.tmp', md_fname)
+        self.evict(keep=key)
+
+    def size(self):
+        """
+        Return the total size of the cached arrays, in Mb.
+        """
+        return sum(getsize(join(self.cache_dir, f)) for f in listdir(self.cache_dir) if f.endswith('.npy')) / 2. ** 20
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in 'max_size'.
+
+        Parameters
+        ----------
+        keep : str, optional
+            key of an entry that should not be evicted
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for f in listdir(self.cache_dir):
+            if f.endswith('.npy'):
+                fname = join(self.cache_dir, f)
+                entries.append((getmtime(fname), getsize(fname), f[:-4]))
+        total = sum(e[1] for e in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size * 2 ** 20:
+                break
+            if key == keep:
+                continue
+            for fname in self._fnames(key):
+                # - Another process sharing this cache may have removed it already:
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+            total -= size
+        return
+
+
+def run_stages(img, stages, cache=None, key=None, keep=()):
+    """
+    Run a chain of image processing stages, reusing cached results.
+
+    Parameters
+    ----------
+    img : SpatialImage
+        input image of the first stage
+    stages : list(tuple)
+        list of (name, params, func) where 'func' takes the output image of
+        the previous stage and 'params' is a json serializable dict
+    cache : StageCache, optional
+        if given, used to load and save the output of each stage
+    key : str, optional
+        key of the input image, computed by `image_hash` if missing
+    keep : list(str), optional
+        names of the stages whose output should also be returned
+
+    Returns
+    -------
+    img : SpatialImage
+        output image of the last stage
+    kept : dict
+        stage name indexed dictionary of kept images
+    keys : dict
+        stage name indexed dictionary of stage keys (empty without cache)
+    """
+    kept, keys = {}, {}
+    if cache is None:
+        for name, params, func in stages:
+            img = func(img)
+            if name in keep:
+                kept[name] = img
+        return img, kept, keys
+
+    if key is None:
+        key = image_hash(img)
+    for name, params, func in stages:
+        key = stage_key(key, name, params)
+        keys[name] = key
+    # - Start from the deepest stage found in the cache, with all the stages to keep before it:
+    names = [name for name, _, _ in stages]
+    start = 0
+    for n in range(len(stages) - 1, -1, -1):
+        kept_cached = all(keys[name] in cache for name in names[:n] if name in keep)
+        if keys[names[n]] in cache and kept_cached:
+            print " -- Loading cached '{}' image...".format(names[n])
+            img = cache.load(keys[names[n]])
+            start = n + 1
+            break
+    # - Load images to keep before saving new entries may evict them:
+    for name in names[:start]:
+        if name in keep:
+            kept[name] = img if name == names[start - 1] else cache.load(keys[name])
+    for name, params, func in stages[start:]:
+        img = func(img)
+        cache.save(keys[name], img)
+        if name in keep:
+            kept[name] = img
+    return img, kept, keys
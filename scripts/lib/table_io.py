@@ -0,0 +1,173 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the reading & writing of quantification tables.
+
+The format is selected by the file extension:
+  * '.csv': text, always available;
+  * '.parquet' & '.feather': binary columnar formats, require 'pyarrow';
+  * '.npz': binary numpy archive of the columns, always available.
+
+Binary formats keep the column types and load much faster than CSV files,
+eg. when reading the tables of every time-point of a sequence.
+"""
+
+import numpy as np
+import pandas as pd
+from os.path import exists
+from os.path import getmtime
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+TABLE_EXT = ['.parquet', '.feather', '.npz', '.csv']
+ARROW_EXT = ['.parquet', '.feather']
+# - Index columns of the CSV files saved by pandas with their index:
+CSV_INDEX_COLUMNS = ['Unnamed: 0', 'Unnamed: 1']
+
+
+def table_ext(fname):
+    """
+    Return the table extension of a filename, raise a ValueError if unknown.
+    """
+    for ext in TABLE_EXT:
+        if fname.endswith(ext):
+            return ext
+    raise ValueError("Unknown table file extension for '{}', availables are: {}".format(fname, TABLE_EXT))
+
+
+def default_table_ext():
+    """
+    Return the fastest binary table extension available, '.parquet' if
+    'pyarrow' is installed, else '.npz'.
+    """
+    return '.parquet' if pyarrow is not None else '.npz'
+
+
+def save_table(fname, df):
+    """
+    Save a DataFrame to a file, the format being given by its extension.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the table, ending with one of TABLE_EXT
+    df : pd.DataFrame
+        table to save, its index is not saved
+    """
+    ext = table_ext(fname)
+    if ext in ARROW_EXT and pyarrow is None:
+        raise ImportError("Please install 'pyarrow' to save '{}' files, or use '.npz'!".format(ext))
+    if ext == '.csv':
+        df.to_csv(fname, index=False)
+    elif ext == '.parquet':
+        df.to_parquet(fname, index=False)
+    elif ext == '.feather':
+        df.reset_index(drop=True).to_feather(fname)
+    else:
+        arrays = {'col_{}'.format(n): df[name].values for n, name in enumerate(df.columns)}
+        np.savez(fname, __columns__=np.array([str(c) for c in df.columns]), **arrays)
+    return
+
+
+def read_table(fname):
+    """
+    Read a table saved by `save_table` (or any CSV file).
+
+    Parameters
+    ----------
+    fname : str
+        filename of the table, ending with one of TABLE_EXT
+
+    Returns
+    -------
+    pd.DataFrame
+        the table
+    """
+    ext = table_ext(fname)
+    if not exists(fname):
+        raise IOError("Could not find table file '{}'!".format(fname))
+    if ext in ARROW_EXT and pyarrow is None:
+        raise ImportError("Please install 'pyarrow' to read '{}' files!".format(ext))
+    if ext == '.csv':
+        return pd.read_csv(fname)
+    elif ext == '.parquet':
+        return pd.read_parquet(fname)
+    elif ext == '.feather':
+        return pd.read_feather(fname)
+    else:
+        arrays = np.load(fname)
+        columns = arrays['__columns__'].tolist()
+        return pd.DataFrame({name: arrays['col_{}'.format(n)] for n, name in enumerate(columns)}, columns=columns)
+
+
+def find_table(fname):
+    """
+    Return the filename of the newest existing table with the same base name,
+    binary formats first if as recent, or 'fname' itself if none is found.
+
+    Parameters
+    ----------
+    fname : str
+        filename of the table, eg. the historical '.csv' one
+
+    Notes
+    -----
+    The newest table is returned so a regenerated CSV file (eg. with
+    '--force') is not shadowed by an older binary table.
+    """
+    base = fname[:-len(table_ext(fname))]
+    fnames = [base + ext for ext in TABLE_EXT if (ext not in ARROW_EXT or pyarrow is not None) and exists(base + ext)]
+    if fnames == []:
+        return fname
+    return max(fnames, key=lambda f: (getmtime(f), -fnames.index(f)))
+
+
+def label_columns(df, names):
+    """
+    Return the names of the label columns of a table, 'names' if found (eg.
+    tables saved by `save_table`), else the index columns of CSV files saved
+    by pandas with their index ('Unnamed: 0', 'Unnamed: 1').
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the table
+    names : list(str)
+        names of the label columns, eg. ['left_label', 'right_label']
+    """
+    for cnames in [names, CSV_INDEX_COLUMNS[:len(names)]]:
+        if all(cname in df.columns for cname in cnames):
+            return cnames
+    raise ValueError("Could not find the label columns {} in the table!".format(names))
+
+
+def labelpair_dict(df, values_cname, label_cnames=('left_label', 'right_label')):
+    """
+    Return a label-pair dictionary of a table column, without its NaN values.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the table
+    values_cname : str
+        name of the column containing the values
+    label_cnames : list(str), optional
+        names of the two label columns, see `label_columns`
+
+    Returns
+    -------
+    dictionary {(label_1, label_2): values}
+    """
+    lab1_cname, lab2_cname = label_columns(df, list(label_cnames))
+    values = df[values_cname].values
+    keep = ~pd.isnull(values)
+    labelpairs = zip(df[lab1_cname].values[keep].tolist(), df[lab2_cname].values[keep].tolist())
+    return dict(zip(labelpairs, values[keep].tolist()))
@@ -0,0 +1,1075 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Library associated to the quantification of membrane-targetted signals for all
+walls at once.
+
+The sampling voxels of each wall side are extracted once from the segmented
+image: the voxels of 'label' closer than 'membrane_dist' to the wall shared
+with 'neighbour' define the side '(label, neighbour)'. They are stored as a sparse
+array of flat voxel indices sorted by side (CSR-like), so each channel is then
+reduced for all walls with a single 'np.bincount' (or 'nd.labeled_comprehension'
+-like function for order statistics).
+
+This geometry does not depend on the signal channel, so it can be saved once
+per segmented image as a 'wall index' (see `WallIndex`) and reused to
+quantify other channels, distances or methods.
+
+Large images can be quantified by overlapping z-tiles, within a memory
+ceiling, each wall being quantified by the tile owning it, along with the wall
+geometry (see `tiled_quantify_walls`).
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import scipy.ndimage as nd
+from os.path import join
+from os.path import exists
+from os.path import abspath
+from os.path import getsize
+from os.path import getmtime
+from multiprocessing import Pool
+
+from nomenclature import splitext_zip
+from labelpair_table import LabelPairTable
+from segmentation_pipeline import z_slabs
+from segmentation_pipeline import read_image
+from segmentation_pipeline import read_image_header
+from label_statistics import label_statistics
+from label_adjacency import face_areas
+from label_adjacency import label_contacts
+from label_adjacency import LabelAdjacency
+
+QUANTIF_METHODS = ['mean', 'sum', 'median', 'min', 'max', 'std']
+ND_METHODS = {'median': nd.median, 'min': nd.minimum, 'max': nd.maximum,
+              'std': nd.standard_deviation}
+# - Bytes used per voxel of a z-tile: labels & neighbours (int64), distance
+# (float64), nearest boundary indices (3 int32), masks and one signal tile:
+TILE_VOXEL_BYTES = 8 + 8 + 8 + 12 + 4 + 8
+
+
+def boundary_neighbour(label_arr):
+    """
+    Return, for each voxel, the label of a 6-connected neighbour with a
+    different label, '-1' for voxels not on a boundary.
+
+    Parameters
+    ----------
+    label_arr : np.array
+        labelled array
+
+    Returns
+    -------
+    np.array
+        array of neighbour labels (int64), '-1' where not on a boundary
+    """
+    neighbour = np.full(label_arr.shape, -1, dtype=np.int64)
+    for axis in range(label_arr.ndim):
+        for src, dst in [(slice(1, None), slice(None, -1)), (slice(None, -1), slice(1, None))]:
+            sl_src = [slice(None)] * label_arr.ndim
+            sl_dst = [slice(None)] * label_arr.ndim
+            sl_src[axis], sl_dst[axis] = src, dst
+            sl_src, sl_dst = tuple(sl_src), tuple(sl_dst)
+            nb = label_arr[sl_src]
+            mask = (nb != label_arr[sl_dst]) & (neighbour[sl_dst] == -1)
+            neighbour[sl_dst][mask] = nb[mask]
+    return neighbour
+
+
+def wall_sampling_voxels(seg_im, membrane_dist, voxelsize=None, exclude=(0,)):
+    """
+    Extract the sampling voxels of every wall side in a single pass.
+
+    Each voxel is assigned to the wall of its nearest boundary voxel, so a
+    voxel close to a junction samples only its closest wall. The sampled
+    voxels are strictly closer than 'membrane_dist' to their boundary voxel,
+    as `MembraneQuantif` does (see 'test/test_wall_quantification.py').
+
+    Parameters
+    ----------
+    seg_im : SpatialImage|np.array
+        segmented image
+    membrane_dist : float
+        real distance to the wall of the sampling voxels
+    voxelsize : list, optional
+        voxelsize of the image, 'seg_im.voxelsize' by default
+    exclude : list(int), optional
+        labels without sampling voxels (eg. the background), '0' by default
+
+    Returns
+    -------
+    sides : np.array
+        (n_sides, 2) array of oriented wall sides (label, neighbour), sorted
+    indices : np.array
+        flat voxel indices, sorted by wall side
+    offsets : np.array
+        voxel indices of side 'n' are 'indices[offsets[n]:offsets[n+1]]'
+    distances : np.array
+        real distance of each voxel to its wall, sorted as 'indices'
+
+    Notes
+    -----
+    The distance transform, with the indices of the nearest boundary voxel,
+    is computed on the whole image and uses about 36 bytes per voxel (eg.
+    42Gb for a 2048x2048x300 image), use `tiled_quantify_walls` to bound it.
+    """
+    label_arr = np.asarray(seg_im)
+    if voxelsize is None:
+        voxelsize = seg_im.voxelsize
+    neighbour = boundary_neighbour(label_arr)
+    # - Distance (and index) of the nearest boundary voxel, computed once:
+    indices = np.zeros((label_arr.ndim,) + label_arr.shape, dtype=np.int32)
+    dist = nd.distance_transform_edt(neighbour == -1, sampling=voxelsize, return_indices=True, indices=indices)
+    sampled = dist < membrane_dist
+    for lab in exclude:
+        if lab is not None:
+            sampled &= label_arr != lab
+    vox = np.flatnonzero(sampled)
+    del sampled
+    vox_dist = dist.ravel()[vox].astype(np.float32)
+    del dist
+    nearest = np.ravel_multi_index([ind.ravel()[vox] for ind in indices], label_arr.shape)
+    del indices
+
+    labels = label_arr.ravel()[vox].astype(np.int64)
+    nearest_label = label_arr.ravel()[nearest].astype(np.int64)
+    # - The nearest boundary voxel is on the same side of the wall, or on the other side:
+    partners = np.where(nearest_label == labels, neighbour.ravel()[nearest], nearest_label)
+    del neighbour, nearest, nearest_label
+
+    base = int(max(labels.max(), partners.max())) + 1 if len(vox) else 1
+    keys, side_id = np.unique(labels * base + partners, return_inverse=True)
+    order = np.argsort(side_id, kind='mergesort')
+    sides = np.array([keys // base, keys % base]).T
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(side_id, minlength=len(keys)))])
+    return sides, vox[order], offsets, vox_dist[order]
+
+
+class WallIndex(object):
+    """
+    Wall geometry of a segmented image, independent of the signal channels.
+
+    Holds the CSR-packed sampling voxels of every wall side up to 'max_dist'
+    with their distance to the wall, so any smaller membrane distance is a
+    selection of these voxels. Named sets of walls (labelpairs, area, median
+    & normal) can be attached to it.
+
+    Saved as a directory of '.npy' arrays with an 'index.json' description,
+    so the arrays can be memory-mapped when loaded.
+    """
+    ARRAYS = ['sides', 'indices', 'offsets', 'distances']
+    WALL_ARRAYS = ['labelpairs', 'area', 'median', 'normal']
+
+    def __init__(self, sides, indices, offsets, distances, shape, voxelsize, max_dist, background=None, bbox=None, source=None):
+        self.sides = sides
+        self.indices = indices
+        self.offsets = offsets
+        self.distances = distances
+        self.shape = list(shape)
+        self.voxelsize = list(voxelsize)
+        self.max_dist = max_dist
+        self.background = background
+        self.bbox = bbox
+        self.source = source
+        self.walls = {}
+        # - Directory where the index is saved, if any:
+        self.dirname = None
+
+    @classmethod
+    def from_image(cls, seg_im, max_dist, background=None, bbox=None, source=None):
+        """
+        Compute the wall index of a segmented image.
+
+        Parameters
+        ----------
+        seg_im : SpatialImage
+            segmented image
+        max_dist : float
+            maximal real distance to the wall of the sampling voxels
+        background : int, optional
+            background label, no signal is sampled in it
+        bbox : list, optional
+            list of [start, stop] voxel bounds for each axis, 'stop' excluded,
+            restricting the index to this sub-volume
+        source : dict, optional
+            description of the segmented image file, see `file_source`
+        """
+        seg_arr = crop_array(seg_im, bbox)
+        sides, indices, offsets, distances = wall_sampling_voxels(seg_arr, max_dist, seg_im.voxelsize, exclude=(0, background))
+        return cls(sides, indices, offsets, distances, seg_arr.shape, seg_im.voxelsize, max_dist, background, bbox, source)
+
+    def matches(self, max_dist, background=None, bbox=None, source=None):
+        """
+        Return True if this index can be used for these parameters.
+        """
+        return (self.max_dist >= max_dist and self.background == background and
+                self.bbox == bbox and (source is None or self.source == source))
+
+    def set_walls(self, name, labelpairs, area=None, median=None, normal=None):
+        """
+        Attach a named set of walls, with their area, median & normal
+        (labelpair dictionaries or arrays ordered as 'labelpairs').
+        """
+        self.walls[name] = wall_geometry(labelpairs, area, median, normal)
+
+    def get_walls(self, name):
+        """
+        Return a named set of walls as a dict of arrays, None if missing.
+        """
+        return self.walls.get(name)
+
+    def walls_dict(self, name, key):
+        """
+        Return a labelpair dictionary of a value ('area', 'median' or
+        'normal') of a named set of walls, with None for NaN values.
+        """
+        walls = self.walls[name]
+        dico = {}
+        for lp, v in zip(walls['labelpairs'].tolist(), walls[key]):
+            v = None if np.isnan(v).any() else (float(v[0]) if len(v) == 1 else v.tolist())
+            dico[tuple(lp)] = v
+        return dico
+
+    def save(self, dirname, arrays=True):
+        """
+        Save the index in a directory.
+
+        Parameters
+        ----------
+        dirname : str
+            directory where to save the index, created if missing
+        arrays : bool, optional
+            if False, only save the sets of walls and the description, eg.
+            when the voxel arrays are memory-mapped from this directory
+        """
+        if not exists(dirname):
+            os.makedirs(dirname)
+        if arrays:
+            for key in self.ARRAYS:
+                np.save(join(dirname, key + '.npy'), getattr(self, key))
+        for name, walls in self.walls.items():
+            np.savez(join(dirname, 'walls_{}.npz'.format(name)), **walls)
+        desc = {'shape': self.shape, 'voxelsize': self.voxelsize, 'max_dist': self.max_dist,
+                'background': self.background, 'bbox': self.bbox, 'source': self.source,
+                'walls': sorted(self.walls.keys())}
+        # - The description is written last, so an interrupted save is not valid:
+        with open(join(dirname, 'index.json.tmp'), 'w') as f:
+            json.dump(desc, f)
+        os.rename(join(dirname, 'index.json.tmp'), join(dirname, 'index.json'))
+        self.dirname = dirname
+
+    @classmethod
+    def load(cls, dirname, mmap_mode='r'):
+        """
+        Load an index saved in a directory, None if missing.
+
+        Parameters
+        ----------
+        dirname : str
+            directory of the saved index
+        mmap_mode : str, optional
+            memory-map mode of the voxel arrays, 'r' by default
+        """
+        if not exists(join(dirname, 'index.json')):
+            return None
+        with open(join(dirname, 'index.json'), 'r') as f:
+            desc = json.load(f)
+        arrays = [np.load(join(dirname, key + '.npy'), mmap_mode=mmap_mode) for key in cls.ARRAYS]
+        index = cls(*arrays, shape=desc['shape'], voxelsize=desc['voxelsize'], max_dist=desc['max_dist'],
+                    background=desc['background'], bbox=desc['bbox'], source=desc['source'])
+        for name in desc['walls']:
+            walls = np.load(join(dirname, 'walls_{}.npz'.format(name)))
+            index.walls[name] = {k: walls[k] for k in walls.files}
+        index.dirname = dirname
+        return index
+
+
+def wall_geometry(labelpairs, area=None, median=None, normal=None):
+    """
+    Return a set of walls as a dict of arrays ordered as 'labelpairs', from
+    their area, median & normal (labelpair dictionaries or arrays ordered as
+    'labelpairs'), NaN for missing values.
+    """
+    labelpairs = [tuple(lp) for lp in labelpairs]
+    walls = {'labelpairs': np.array(labelpairs, dtype=np.int64).reshape(-1, 2)}
+    for key, values, dim in [('area', area, 1), ('median', median, 3), ('normal', normal, 3)]:
+        if isinstance(values, dict):
+            values = [values.get(lp) for lp in labelpairs]
+        if values is not None:
+            values = [np.full(dim, np.nan) if v is None else np.ravel(v) for v in values]
+            walls[key] = np.array(values, dtype=np.float64).reshape(len(labelpairs), -1)
+    return walls
+
+
+def file_source(fname):
+    """
+    Return a description (path, mtime & size) of a file, used to check an
+    index is up to date.
+    """
+    return {'path': abspath(fname), 'mtime': getmtime(fname), 'size': getsize(fname)}
+
+
+def crop_array(img, bbox=None):
+    """
+    Return the array of an image, cropped to a list of [start, stop] bounds.
+
+    An array with the shape of the bounding box is considered already cropped
+    (eg. read with `read_image(fname, bbox=bbox)`) and is returned as is.
+    """
+    arr = np.asarray(img)
+    if bbox is not None and list(arr.shape) != [stop - start for start, stop in bbox]:
+        arr = arr[tuple(slice(start, stop) for start, stop in bbox)]
+    return arr
+
+
+def wall_index_dirname(seg_fname):
+    """
+    Return the directory of the wall index of a segmented image file.
+    """
+    return splitext_zip(seg_fname)[0] + '_wall_index'
+
+
+def cached_wall_index(seg_fname, seg_im, max_dist, background=None, bbox=None, dirname=None, params=None):
+    """
+    Load the wall index of a segmented image file, or compute & save it if
+    missing or outdated.
+
+    Parameters
+    ----------
+    seg_fname : str
+        filename of the segmented image
+    seg_im : SpatialImage
+        segmented image, read from 'seg_fname'
+    max_dist : float
+        maximal real distance to the wall of the sampling voxels
+    background : int, optional
+        background label, no signal is sampled in it
+    bbox : list, optional
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded
+    dirname : str, optional
+        directory of the index, next to the segmented image by default
+    params : dict, optional
+        json serializable parameters of the edition of the segmented image
+        after reading (eg. cell volume filtering), if any
+
+    Returns
+    -------
+    WallIndex
+        the wall index, its voxel arrays are memory-mapped if loaded
+    """
+    if dirname is None:
+        dirname = wall_index_dirname(seg_fname)
+    source = file_source(seg_fname)
+    if params is not None:
+        source['params'] = json.loads(json.dumps(params))
+    index = WallIndex.load(dirname)
+    if index is not None and index.matches(max_dist, background, bbox, source):
+        print "Loaded wall index from '{}'".format(dirname)
+        return index
+    index = WallIndex.from_image(seg_im, max_dist, background, bbox, source)
+    index.save(dirname)
+    print "Saved wall index under '{}'".format(dirname)
+    return index
+
+
+class WallSignalQuantif(object):
+    """
+    Quantify membrane-targetted signals of a list of walls, for both sides at
+    once, reusing the wall sampling voxels for every channel and quantity.
+
+    Several membrane distances can be quantified at once: each sampling voxel
+    is assigned to the smallest distance shell containing it, and the
+    statistics of the nested shells are accumulated from a single read of the
+    signal image.
+    """
+
+    def __init__(self, wall_index, membrane_dist, wall_labelpairs=None):
+        """
+        Parameters
+        ----------
+        wall_index : WallIndex
+            wall index of the segmented image
+        membrane_dist : float|list(float)
+            real distance(s) to the wall of the sampling voxels, should not be
+            greater than the index 'max_dist'
+        wall_labelpairs : list(tuple), optional
+            list of walls to quantify as label pairs, all walls by default
+        """
+        self.membrane_dists = sorted(set(np.atleast_1d(membrane_dist).tolist()))
+        max_dist = self.membrane_dists[-1]
+        try:
+            assert max_dist <= wall_index.max_dist
+        except AssertionError:
+            raise ValueError("Membrane distance ({}) greater than the wall index one ({})!".format(max_dist, wall_index.max_dist))
+        self.bbox = wall_index.bbox
+        sides, offsets = wall_index.sides, wall_index.offsets
+
+        if wall_labelpairs is None:
+            wall_labelpairs = sorted(set(tuple(sorted(s)) for s in sides.tolist()))
+        self.wall_labelpairs = [tuple(lp) for lp in wall_labelpairs]
+        # - Oriented labelpairs: 'left' is (lab1, lab2), 'right' is (lab2, lab1)
+        lp = np.array(self.wall_labelpairs, dtype=np.int64).reshape(-1, 2)
+        left_idx = self._side_index(sides, lp)
+        right_idx = self._side_index(sides, lp[:, ::-1])
+
+        # - Gather the sampling voxels of the selected wall sides only, within the largest distance:
+        selected = np.zeros(len(sides), dtype=bool)
+        selected[left_idx[left_idx >= 0]] = True
+        selected[right_idx[right_idx >= 0]] = True
+        sel_sides = np.flatnonzero(selected)
+        starts, lengths = offsets[sel_sides], np.diff(offsets)[sel_sides]
+        side_id = np.repeat(np.arange(len(sel_sides)), lengths)
+        positions = np.arange(len(side_id)) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        distances = np.asarray(wall_index.distances[positions])
+        keep = distances < max_dist
+        positions = positions[keep]
+        self.side_id = side_id[keep]
+        # - Index of the smallest distance shell containing each voxel (compared with the 'distances' precision):
+        self.shell = np.searchsorted(np.asarray(self.membrane_dists, dtype=distances.dtype), distances[keep], side='right')
+        # - Voxel coordinates, so signal images are not flattened (copied if not C-contiguous):
+        self.coords = np.unravel_index(np.asarray(wall_index.indices[positions]), wall_index.shape)
+        # - Re-index selected sides: 0 to n_sel-1
+        new_id = np.cumsum(selected) - 1
+        self.n_sides = len(sel_sides)
+        self.left_idx = np.where(left_idx >= 0, new_id[left_idx], -1)
+        self.right_idx = np.where(right_idx >= 0, new_id[right_idx], -1)
+        # - Cumulated voxel counts, shape (n_distances, n_sides):
+        self.voxel_counts = self._shell_cumsum(np.ones(len(self.side_id)))
+
+    def _shell_cumsum(self, weights):
+        """
+        Return the sums of 'weights' by side within each membrane distance,
+        with a shape (n_distances, n_sides), from a single 'np.bincount'.
+        """
+        n_dist = len(self.membrane_dists)
+        sums = np.bincount(self.side_id * n_dist + self.shell, weights=weights, minlength=self.n_sides * n_dist)
+        return sums.reshape(self.n_sides, n_dist).cumsum(axis=1).T
+
+    @staticmethod
+    def _side_index(sides, labelpairs):
+        """
+        Return the index of each oriented labelpair in 'sides', '-1' if absent.
+        """
+        if len(sides) == 0:
+            return np.full(len(labelpairs), -1, dtype=np.int64)
+        base = int(max(sides.max(), labelpairs.max() if len(labelpairs) else 0)) + 1
+        keys = sides[:, 0] * base + sides[:, 1]
+        query = labelpairs[:, 0] * base + labelpairs[:, 1]
+        idx = np.clip(np.searchsorted(keys, query), 0, len(keys) - 1)
+        return np.where(keys[idx] == query, idx, -1)
+
+    def side_signals(self, signal_im, method='mean'):
+        """
+        Return the signal of every selected wall side, for each membrane
+        distance.
+
+        Parameters
+        ----------
+        signal_im : SpatialImage
+            signal image, with the same shape as the segmented image
+        method : str, optional
+            quantification method, in QUANTIF_METHODS, 'mean' by default
+
+        Returns
+        -------
+        np.array
+            signal value of each side (columns) for each distance of
+            'self.membrane_dists' (rows), NaN for sides without sampling voxels
+
+        Notes
+        -----
+        'mean' & 'sum' are accumulated over the nested distance shells, order
+        statistics are computed for each distance on the already read values.
+        """
+        try:
+            assert method in QUANTIF_METHODS
+        except AssertionError:
+            raise ValueError("Unknown quantification method '{}', availables are {}".format(method, QUANTIF_METHODS))
+        values = crop_array(signal_im, self.bbox)[self.coords].astype(np.float64)
+        out = np.full(self.voxel_counts.shape, np.nan)
+        valid = self.voxel_counts > 0
+        if method in ['mean', 'sum']:
+            sums = self._shell_cumsum(values)
+            if method == 'mean':
+                out[valid] = sums[valid] / self.voxel_counts[valid]
+            else:
+                out[valid] = sums[valid]
+        else:
+            for n in range(len(self.membrane_dists)):
+                in_dist = self.shell <= n
+                index = np.flatnonzero(valid[n])
+                out[n, valid[n]] = ND_METHODS[method](values[in_dist], self.side_id[in_dist], index)
+        return out
+
+    def side_signal(self, signal_im, method='mean'):
+        """
+        Return the signal of every selected wall side, for the largest membrane
+        distance, see `side_signals`.
+        """
+        return self.side_signals(signal_im, method)[-1]
+
+    def _wall_quantities(self, side):
+        """
+        Return the left, right, total & ratio signal of the selected walls from
+        the signal of every selected wall side.
+        """
+        side = np.append(side, np.nan)
+        # - Index '-1' (missing side) points to the appended NaN:
+        left, right = side[self.left_idx], side[self.right_idx]
+        total = left + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(total != 0, (left - right) / total, np.nan)
+        return {'left': left, 'right': right, 'total': total, 'ratio': ratio}
+
+    def quantify(self, signal_im, method='mean'):
+        """
+        Compute the left, right, total & ratio signal of the selected walls,
+        for the largest membrane distance.
+
+        The 'left' signal of (lab1, lab2) is sampled in 'lab1', the 'right'
+        one in 'lab2'. The total is 'left + right' and the ratio is
+        '(left - right) / (left + right)', so it is opposed for (lab2, lab1).
+
+        Parameters
+        ----------
+        signal_im : SpatialImage
+            signal image, with the same shape as the segmented image
+        method : str, optional
+            quantification method, in QUANTIF_METHODS, 'mean' by default
+
+        Returns
+        -------
+        dict
+            'left', 'right', 'total' & 'ratio' arrays, in the order of
+            'self.wall_labelpairs', NaN where not defined
+        """
+        return self._wall_quantities(self.side_signal(signal_im, method))
+
+    def quantify_distances(self, signal_im, method='mean'):
+        """
+        Compute the left, right, total & ratio signal of the selected walls,
+        for each membrane distance, see `quantify`.
+
+        Returns
+        -------
+        dict
+            distance indexed dictionary of 'left', 'right', 'total' & 'ratio'
+            arrays
+        """
+        sides = self.side_signals(signal_im, method)
+        return {dist: self._wall_quantities(side) for dist, side in zip(self.membrane_dists, sides)}
+
+    def to_dict(self, values, symetric=False, oppose=False):
+        """
+        Return a labelpair dictionary from an array of values ordered as
+        'self.wall_labelpairs', see `labelpair_dict`.
+        """
+        return labelpair_dict(self.wall_labelpairs, values, symetric, oppose)
+
+
+def labelpair_dict(labelpairs, values, symetric=False, oppose=False):
+    """
+    Return a labelpair dictionary from an array of values, with None for NaN
+    values.
+
+    Parameters
+    ----------
+    labelpairs : list(tuple)
+        list of label pairs
+    values : np.array
+        values of each label pair
+    symetric : bool, optional
+        if True, also add the inverted labelpairs (lab2, lab1)
+    oppose : bool, optional
+        if True, the value of the inverted labelpair is opposed
+    """
+    values = [None if np.isnan(v) else float(v) for v in values]
+    dico = dict(zip(labelpairs, values))
+    if symetric:
+        sign = -1 if oppose else 1
+        dico.update({(lab2, lab1): None if v is None else sign * v for (lab1, lab2), v in zip(labelpairs, values)})
+    return dico
+
+
+def _quantify_chunk(job):
+    """
+    Quantify the signals of a chunk of walls, from the saved wall index and
+    signal arrays (memory-mapped, so shared between the processes).
+    """
+    index_dirname, membrane_dist, labelpairs, signal_fnames, method = job
+    wall_index = WallIndex.load(index_dirname, mmap_mode='r')
+    wall_quantif = WallSignalQuantif(wall_index, membrane_dist, labelpairs)
+    return {ch: wall_quantif.quantify_distances(np.load(fname, mmap_mode='r'), method) for ch, fname in signal_fnames.items()}
+
+
+def quantify_walls(wall_index, membrane_dist, wall_labelpairs, signal_imgs, method='mean', n_jobs=1, tmp_dir=None):
+    """
+    Compute the left, right, total & ratio signal of a list of walls for
+    several signal images, and one or several membrane distances, see
+    `WallSignalQuantif.quantify_distances`.
+
+    With several jobs, the list of walls is split in chunks quantified in a
+    pool of processes. The wall index and the signal arrays are shared as
+    read-only memory-mapped '.npy' files, not pickled to each process.
+
+    Parameters
+    ----------
+    wall_index : WallIndex
+        wall index of the segmented image
+    membrane_dist : float|list(float)
+        real distance(s) to the wall of the sampling voxels
+    wall_labelpairs : list(tuple)
+        list of walls to quantify as label pairs
+    signal_imgs : dict
+        channel name indexed dictionary of signal images
+    method : str, optional
+        quantification method, in QUANTIF_METHODS, 'mean' by default
+    n_jobs : int, optional
+        number of processes, '1' by default
+    tmp_dir : str, optional
+        directory where to write the shared arrays, system default if None
+
+    Returns
+    -------
+    dict
+        channel name indexed dictionary of 'left', 'right', 'total' &
+        'ratio' arrays, in the order of 'wall_labelpairs', or a distance
+        indexed dictionary of those if a list of distances is given
+    """
+    if n_jobs == 1:
+        wall_quantif = WallSignalQuantif(wall_index, membrane_dist, wall_labelpairs)
+        results = [{ch: wall_quantif.quantify_distances(img, method) for ch, img in signal_imgs.items()}]
+        return _distance_results(results, membrane_dist, signal_imgs.keys())
+
+    tmp = tempfile.mkdtemp(dir=tmp_dir)
+    index_dirname = wall_index.dirname
+    try:
+        if index_dirname is None:
+            index_dirname = join(tmp, 'wall_index')
+            WallIndex(*[getattr(wall_index, k) for k in WallIndex.ARRAYS], shape=wall_index.shape,
+                      voxelsize=wall_index.voxelsize, max_dist=wall_index.max_dist, bbox=wall_index.bbox).save(index_dirname)
+        signal_fnames = {}
+        for n, (ch, img) in enumerate(signal_imgs.items()):
+            # - Reuse arrays already memory-mapped from a '.npy' file (eg. from an ImageStore):
+            fname = getattr(img, 'filename', None)
+            if fname is None or not _is_npy_array(fname, img):
+                fname = join(tmp, 'signal_{}.npy'.format(n))
+                np.save(fname, np.asarray(img))
+            signal_fnames[ch] = fname
+        n_chunks = min(len(wall_labelpairs), 4 * n_jobs) or 1
+        chunks = [[tuple(lp) for lp in chunk] for chunk in np.array_split(np.array(wall_labelpairs).reshape(-1, 2), n_chunks)]
+        jobs = [(index_dirname, membrane_dist, chunk, signal_fnames, method) for chunk in chunks]
+        pool = Pool(n_jobs)
+        results = pool.map(_quantify_chunk, jobs)
+        pool.close()
+        pool.join()
+    finally:
+        shutil.rmtree(tmp)
+    return _distance_results(results, membrane_dist, signal_imgs.keys())
+
+
+def _is_npy_array(fname, img):
+    """
+    Return True if 'img' is the whole array of the '.npy' file 'fname'.
+    A sliced memory-mapped array keeps the filename of its parent, it should
+    not be reused.
+    """
+    if not fname.endswith('.npy') or not exists(fname):
+        return False
+    arr = np.load(fname, mmap_mode='r')
+    return arr.shape == np.shape(img) and arr.dtype == img.dtype and np.asarray(img).flags.c_contiguous
+
+
+def _distance_results(results, membrane_dist, ch_names):
+    """
+    Merge the chunk results, in the order of the walls, as a distance indexed
+    dictionary of channel results if 'membrane_dist' is a list.
+    """
+    merged = {}
+    for dist in results[0][ch_names[0]]:
+        merged[dist] = {ch: {k: np.concatenate([res[ch][dist][k] for res in results]) for k in results[0][ch][dist]} for ch in ch_names}
+    if np.ndim(membrane_dist) == 0:
+        return merged.values()[0]
+    return merged
+
+
+def wall_signal_table(wall_labelpairs, walls, wall_signal, membrane_ch_name, signal_ch_names, side_suffixes=('_signal_left', '_signal_right')):
+    """
+    Gather the wall geometry and the signals of several channels in a single
+    symmetric label-pair table, with a set of columns per channel.
+
+    Parameters
+    ----------
+    wall_labelpairs : list(tuple)
+        list of quantified walls as label pairs
+    walls : dict
+        wall geometry ('area', 'median' & 'normal' arrays) ordered as
+        'wall_labelpairs', see `WallIndex.get_walls`
+    wall_signal : dict
+        channel name indexed dictionary of 'left', 'right', 'total' & 'ratio'
+        arrays, see `quantify_walls`
+    membrane_ch_name : str
+        name of the 'membrane labelling' channel, used for the significance
+    signal_ch_names : list(str)
+        names of the 'membrane-targetted signal' channels, with an
+        '<ch>_orientation' column each
+    side_suffixes : tuple(str), optional
+        suffixes of the left & right signal columns of each channel,
+        ('_signal_left', '_signal_right') by default
+
+    Returns
+    -------
+    LabelPairTable
+        table with (lab1, lab2) & (lab2, lab1) label pairs, left & right
+        signals being swapped, orientations & normals opposed for inverted ones
+    """
+    ch_names = [membrane_ch_name] + [ch for ch in signal_ch_names if ch != membrane_ch_name]
+    wall_table = LabelPairTable.from_labelpairs(wall_labelpairs)
+    for ch_name in ch_names:
+        wall_table[ch_name+'_signal'] = wall_signal[ch_name]['total']
+        wall_table[ch_name+side_suffixes[0]] = wall_signal[ch_name]['left']
+        wall_table[ch_name+side_suffixes[1]] = wall_signal[ch_name]['right']
+    memb_left, memb_right = wall_signal[membrane_ch_name]['left'], wall_signal[membrane_ch_name]['right']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ch_name in signal_ch_names:
+            ratio = wall_signal[ch_name]['ratio']
+            wall_table[ch_name+'_orientation'] = np.where(np.isnan(ratio), np.nan, np.where(ratio > 0, 1., -1.))
+        wall_table['significance'] = np.minimum(memb_left, memb_right) / np.maximum(memb_left, memb_right)
+    for n, dim in enumerate(['x', 'y', 'z']):
+        wall_table['wall_center_'+dim] = walls['median'][:, n]
+    for n, dim in enumerate(['x', 'y', 'z']):
+        wall_table['wall_normal_'+dim] = walls['normal'][:, n]
+    wall_table['wall_area'] = walls['area'][:, 0]
+
+    opposed = [ch_name+'_orientation' for ch_name in signal_ch_names] + ['wall_normal_'+dim for dim in ['x', 'y', 'z']]
+    swapped = [(ch_name+side_suffixes[0], ch_name+side_suffixes[1]) for ch_name in ch_names]
+    return wall_table.symmetrize(opposed=opposed, swapped=swapped)
+
+
+def tile_thickness(shape, max_mem, halo):
+    """
+    Number of z-slices in a tile core so the quantification of a tile stays
+    below a given memory ceiling.
+
+    Parameters
+    ----------
+    shape : list(int)
+        shape of the quantified (sub-)volume
+    max_mem : float
+        memory ceiling, in Mb
+    halo : int
+        number of z-slices added on each side of a tile
+
+    Returns
+    -------
+    int
+        the tile core thickness, in z-slices
+    """
+    slice_bytes = shape[0] * shape[1] * TILE_VOXEL_BYTES
+    n_z = int(max_mem * 2 ** 20 // slice_bytes) - 2 * halo
+    try:
+        assert n_z >= 1
+    except AssertionError:
+        raise ValueError("Memory ceiling of {}Mb is too small for a z-tile with a {} slices halo!".format(max_mem, halo))
+    return n_z
+
+
+def owned_walls(wall_index, n_z, lower, upper, core_start, core_stop):
+    """
+    Return the walls of a tile index owned by this tile, as sorted label pairs.
+
+    A wall is complete if all the voxels of its two sides are between 'lower'
+    and 'upper', where the sampling voxels are the same as in the whole
+    image. A complete wall is owned by the tile whose core contains its first
+    z-slice, so each wall is quantified by a single tile.
+
+    Parameters
+    ----------
+    wall_index : WallIndex
+        wall index of the tile
+    n_z : int
+        number of z-slices of the tile
+    lower, upper : int
+        first & last (excluded) z-slices of the tile with exact sampling voxels
+    core_start, core_stop : int
+        first & last (excluded) z-slices of the tile core
+
+    Returns
+    -------
+    owned : np.array
+        (n, 2) array of owned walls, (min label, max label)
+    n_incomplete : int
+        number of walls starting in the core but not complete in the tile
+    """
+    sides, offsets = wall_index.sides, wall_index.offsets
+    if len(sides) == 0:
+        return np.empty((0, 2), dtype=np.int64), 0
+    z = np.asarray(wall_index.indices) % n_z
+    side_zmin = np.minimum.reduceat(z, offsets[:-1])
+    side_zmax = np.maximum.reduceat(z, offsets[:-1])
+    keys, wall_id = np.unique((sides.min(axis=1) << 32) | sides.max(axis=1), return_inverse=True)
+    walls = np.array([keys >> 32, keys & 0xFFFFFFFF]).T
+    zmin = np.full(len(walls), n_z, dtype=z.dtype)
+    zmax = np.full(len(walls), -1, dtype=z.dtype)
+    np.minimum.at(zmin, wall_id, side_zmin)
+    np.maximum.at(zmax, wall_id, side_zmax)
+    complete = (zmin >= lower) & (zmax < upper)
+    in_core = (zmin >= core_start) & (zmin < core_stop)
+    return walls[complete & in_core], int(np.count_nonzero(~complete & in_core))
+
+
+def wall_face_medians(label_img, wall_keys, edge_label=None):
+    """
+    Return the median of the contact faces of a list of walls, as the upper
+    median of the coordinates of the face centers along each axis.
+
+    Parameters
+    ----------
+    label_img : SpatialImage|np.array
+        labelled image
+    wall_keys : np.array
+        sorted '(min label << 32) | max label' keys of the walls
+    edge_label : int, optional
+        if given, only the faces with a voxel next to this label are used, eg.
+        the background for the epidermal edge of the walls
+
+    Returns
+    -------
+    np.array
+        (n, ndim) array of medians in voxels, NaN for the walls without faces
+    """
+    label_arr = np.asarray(label_img)
+    ndim = label_arr.ndim
+    medians = np.full((len(wall_keys), ndim), np.nan)
+    if len(wall_keys) == 0:
+        return medians
+    if edge_label is not None:
+        near_edge = nd.binary_dilation(label_arr == edge_label)
+    wall_ids, coords = [], []
+    for axis in range(ndim):
+        sl_a = [slice(None)] * ndim
+        sl_b = [slice(None)] * ndim
+        sl_a[axis], sl_b[axis] = slice(None, -1), slice(1, None)
+        lab_a, lab_b = label_arr[tuple(sl_a)], label_arr[tuple(sl_b)]
+        faces = lab_a != lab_b
+        if edge_label is not None:
+            faces &= near_edge[tuple(sl_a)] | near_edge[tuple(sl_b)]
+        idx = np.nonzero(faces)
+        lab_a = lab_a[idx].astype(np.int64)
+        lab_b = lab_b[idx].astype(np.int64)
+        keys = (np.minimum(lab_a, lab_b) << 32) | np.maximum(lab_a, lab_b)
+        pos = np.minimum(np.searchsorted(wall_keys, keys), len(wall_keys) - 1)
+        found = wall_keys[pos] == keys
+        # - Center of a face, half a voxel after the first voxel along 'axis':
+        face_coords = np.array(idx, dtype=np.float64)[:, found].T
+        face_coords[:, axis] += 0.5
+        wall_ids.append(pos[found])
+        coords.append(face_coords)
+    wall_ids = np.concatenate(wall_ids)
+    coords = np.concatenate(coords)
+    counts = np.bincount(wall_ids, minlength=len(wall_keys))
+    has_faces = counts > 0
+    upper = (np.cumsum(counts) - counts + counts // 2)[has_faces]
+    for axis in range(ndim):
+        order = np.lexsort((coords[:, axis], wall_ids))
+        medians[has_faces, axis] = coords[order[upper], axis]
+    return medians
+
+
+def select_walls(values, labelpairs, wall_labelpairs):
+    """
+    Return values ordered as 'wall_labelpairs' from values ordered as
+    'labelpairs', NaN for the walls not in 'labelpairs'.
+
+    Parameters
+    ----------
+    values : np.array|dict
+        array of values of each wall of 'labelpairs', or (nested) dictionary
+        of such arrays, eg. returned by `quantify_walls`
+    labelpairs : np.array
+        (n, 2) array of sorted label pairs, in increasing order
+    wall_labelpairs : list(tuple)
+        list of sorted label pairs to select
+    """
+    keys = (labelpairs[:, 0] << 32) | labelpairs[:, 1]
+    lp = np.array([tuple(lp) for lp in wall_labelpairs], dtype=np.int64).reshape(-1, 2)
+    wall_keys = (lp[:, 0] << 32) | lp[:, 1]
+    pos = np.minimum(np.searchsorted(keys, wall_keys), max(len(keys) - 1, 0))
+    found = keys[pos] == wall_keys if len(keys) else np.zeros(len(wall_keys), dtype=bool)
+
+    def _select(v):
+        if isinstance(v, dict):
+            return {k: _select(sub_v) for k, sub_v in v.items()}
+        selected = np.full((len(wall_keys),) + np.shape(v)[1:], np.nan)
+        selected[found] = np.asarray(v)[pos[found]]
+        return selected
+
+    return _select(values)
+
+
+def tiled_quantify_walls(seg_fname, signal_fnames, membrane_dist, wall_labelpairs=None, method='mean', background=None, max_mem=1024., halo=10., bbox=None, edge_median=False):
+    """
+    Compute the left, right, total & ratio signal and the geometry of a list
+    of walls, reading the segmented and signal images by overlapping z-tiles,
+    so the memory used does not depend on the size of the images, see
+    `quantify_walls`.
+
+    Each tile is extended by a halo on both sides. The sampling voxels of a
+    tile are exact except within 'membrane_dist' of its extended borders, and
+    each wall is quantified, and its median computed, in the tile owning it,
+    see `owned_walls`. The contact faces and the voxels of each label are
+    counted in the tile core containing them, so the label adjacency and the
+    barycenters merged across tiles are those of the whole (sub-)volume.
+
+    Parameters
+    ----------
+    seg_fname : str
+        filename of the segmented image
+    signal_fnames : dict
+        channel name indexed dictionary of single channel signal image files
+    membrane_dist : float|list(float)
+        real distance(s) to the wall of the sampling voxels
+    wall_labelpairs : list(tuple), optional
+        list of walls to quantify as label pairs, by default all the walls
+        owned by a tile, as sorted label pairs in increasing order
+    method : str, optional
+        quantification method, in QUANTIF_METHODS, 'mean' by default
+    background : int, optional
+        background label, no signal is sampled in it
+    max_mem : float, optional
+        memory ceiling of a tile, in Mb, '1024' by default
+    halo : float, optional
+        real height added on each side of a tile core, should be greater than
+        the height of the walls, '10' by default
+    bbox : list, optional
+        list of [start, stop] voxel bounds for each axis, 'stop' excluded,
+        restricting the quantification to this sub-volume
+    edge_median : bool, optional
+        if True, the median of a wall is the one of its contact faces next to
+        the 'background' (its epidermal edge), else of all its contact faces
+        (default), see `wall_face_medians`
+
+    Returns
+    -------
+    dict
+        see `quantify_walls`, NaN for the walls higher than the halo
+    geometry : dict
+        dictionary with:
+          * 'labelpairs': (n, 2) array of the walls, ordered as the signals;
+          * 'median': (n, 3) array of wall medians, in voxels, NaN for the
+            walls higher than the halo;
+          * 'adjacency': `LabelAdjacency` of the (sub-)volume, real areas;
+          * 'barycenter': label indexed (n_labels, 3) array of barycenters,
+            in voxels, NaN for missing labels.
+        Medians and barycenters are in full image coordinates.
+
+    Notes
+    -----
+    Only INR (z-slices are streamed) and chunked ('.cimg') images are read by
+    tiles, other formats are read whole for each tile.
+    """
+    shape, voxelsize = read_image_header(seg_fname)
+    if bbox is None:
+        bbox = [[0, s] for s in shape]
+    max_dist = max(np.atleast_1d(membrane_dist))
+    # - Sampling voxels are exact at more than 'max_dist' from the tile borders:
+    margin = int(np.ceil(max_dist / voxelsize[2])) + 1
+    halo_z = int(np.ceil(halo / voxelsize[2])) + margin
+    (x0, x1), (y0, y1), (z0, z1) = bbox
+    thickness = min(tile_thickness([x1 - x0, y1 - y0], max_mem, halo_z), z1 - z0)
+    tiles = z_slabs(z1 - z0, thickness, halo_z)
+    print "Quantifying {} z-tiles of {} slices (+ {} slices halo)...".format(len(tiles), thickness, halo_z)
+
+    if wall_labelpairs is not None:
+        lp = np.array([tuple(lp) for lp in wall_labelpairs], dtype=np.int64).reshape(-1, 2)
+        wall_keys = (lp.min(axis=1) << 32) | lp.max(axis=1)
+    edge_label = background if edge_median else None
+    results, positions, medians = [], [], []
+    contact_keys, contact_counts = [], []
+    label_count, bary_sum = np.zeros(0, dtype=np.int64), np.zeros((0, 3))
+    n_incomplete = 0
+    for start, stop, core_start, core_stop in tiles:
+        tile_bbox = [[x0, x1], [y0, y1], [z0 + start, z0 + stop]]
+        tile_seg = read_image(seg_fname, bbox=tile_bbox)
+        tile_index = WallIndex.from_image(tile_seg, max_dist, background)
+        n_z = stop - start
+        lower = margin if start > 0 else 0
+        upper = n_z - margin if stop < z1 - z0 else n_z
+        core = [core_start - start, core_stop - start]
+        owned, n_inc = owned_walls(tile_index, n_z, lower, upper, core[0], core[1])
+        n_incomplete += n_inc
+
+        # - Contact faces & label voxels counted in the tile core only:
+        pairs, axis_counts = label_contacts(tile_seg, core)
+        contact_keys.append((pairs[:, 0] << 32) | pairs[:, 1])
+        contact_counts.append(axis_counts)
+        stats = label_statistics(np.asarray(tile_seg)[:, :, core[0]:core[1]], real=False, offset=[x0, y0, z0 + core_start])
+        count = stats['count']
+        if len(count) > len(label_count):
+            label_count = np.append(label_count, np.zeros(len(count) - len(label_count), dtype=np.int64))
+            bary_sum = np.vstack([bary_sum, np.zeros((len(count) - len(bary_sum), 3))])
+        found = np.flatnonzero(count)
+        label_count[found] += count[found]
+        bary_sum[found] += stats['barycenter'][found] * count[found, np.newaxis]
+
+        # - Walls owned by the tile:
+        owned_keys = (owned[:, 0] << 32) | owned[:, 1]
+        if wall_labelpairs is None:
+            pos, tile_lp = owned_keys, owned
+        else:
+            pos = np.flatnonzero(np.in1d(wall_keys, owned_keys))
+            tile_lp, owned_keys = lp[pos], wall_keys[pos]
+        if len(pos) == 0:
+            continue
+        wall_quantif = WallSignalQuantif(tile_index, membrane_dist, [tuple(l) for l in tile_lp.tolist()])
+        res = {}
+        for ch, fname in signal_fnames.items():
+            res[ch] = wall_quantif.quantify_distances(read_image(fname, bbox=tile_bbox), method)
+        keys = np.unique(owned_keys)
+        tile_median = wall_face_medians(tile_seg, keys, edge_label)[np.searchsorted(keys, owned_keys)]
+        results.append(res)
+        positions.append(pos)
+        medians.append(tile_median + [x0, y0, z0 + start])
+    if n_incomplete:
+        print "WARNING: {} walls are higher than the tile halo and are not quantified, increase it!".format(n_incomplete)
+
+    if wall_labelpairs is None:
+        # - All the owned walls, each one owned by a single tile:
+        wall_keys = np.sort(np.concatenate([np.zeros(0, dtype=np.int64)] + positions))
+        lp = np.array([wall_keys >> 32, wall_keys & 0xFFFFFFFF]).T.reshape(-1, 2)
+        positions = [np.searchsorted(wall_keys, keys) for keys in positions]
+
+    # - Fill the walls in the order of 'lp', NaN if not quantified:
+    dists = sorted(set(np.atleast_1d(membrane_dist).tolist()))
+    merged = {}
+    for dist in dists:
+        merged[dist] = {}
+        for ch in signal_fnames:
+            merged[dist][ch] = {k: np.full(len(lp), np.nan) for k in ['left', 'right', 'total', 'ratio']}
+            for res, pos in zip(results, positions):
+                for k in merged[dist][ch]:
+                    merged[dist][ch][k][pos] = res[ch][dist][k]
+    wall_median = np.full((len(lp), 3), np.nan)
+    for med, pos in zip(medians, positions):
+        wall_median[pos] = med
+
+    # - Label adjacency & barycenters of the whole (sub-)volume:
+    keys, inverse = np.unique(np.concatenate(contact_keys), return_inverse=True)
+    axis_counts = np.zeros((len(keys), 3), dtype=np.int64)
+    np.add.at(axis_counts, inverse, np.concatenate(contact_counts))
+    pairs = np.array([keys >> 32, keys & 0xFFFFFFFF]).T.reshape(-1, 2)
+    adjacency = LabelAdjacency.from_pairs(pairs, axis_counts.sum(axis=1), axis_counts.dot(face_areas(voxelsize)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        barycenter = bary_sum / label_count[:, np.newaxis]
+    geometry = {'labelpairs': lp, 'median': wall_median, 'adjacency': adjacency, 'barycenter': barycenter}
+    if np.ndim(membrane_dist) == 0:
+        return merged.values()[0], geometry
+    return merged, geometry
@@ -0,0 +1,62 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+"""
+Build or update the catalogue (SQLite) of the nomenclature image tree.
+
+Only the image headers are read, to record their shape, voxelsize, dtype,
+channels, size and modification time.
+
+Examples
+--------
+$ python nomenclature_catalogue.py nomenclature.csv /data/PIN_maps/ --channel_names PIN1 PI --source_dir /data/PIN_maps/czi/
+"""
+
+import time
+import argparse
+from os.path import join
+from os.path import dirname
+
+import sys, platform
+if platform.uname()[1] == "RDP-M7520-JL":
+    SamMaps_dir = '/data/Meristems/Carlos/SamMaps/'
+elif platform.uname()[1] == "calculus":
+    SamMaps_dir = '/projects/SamMaps/scripts/SamMaps_git/'
+else:
+    raise ValueError("Unknown custom path to 'SamMaps' for this system...")
+sys.path.append(SamMaps_dir+'/scripts/lib/')
+
+from catalogue import DEF_DB
+from catalogue import ImageCatalogue
+
+# PARAMETERS:
+# -----------
+parser = argparse.ArgumentParser(description='Build the catalogue of the nomenclature image tree.')
+# positional arguments:
+parser.add_argument('nomenclature', type=str,
+                    help="nomenclature CSV file")
+parser.add_argument('image_dir', type=str,
+                    help="directory containing the nomenclature named folders")
+# optional arguments:
+parser.add_argument('--channel_names', type=str, nargs='+', default=None,
+                    help="list of channel names to look for, none by default")
+parser.add_argument('--source_dir', type=str, default="",
+                    help="directory containing the source files (CZI, LSM) listed in the nomenclature, not catalogued by default")
+parser.add_argument('--ext', type=str, default='.inr.gz',
+                    help="extension of the channel & segmentation files, '.inr.gz' by default")
+parser.add_argument('--db', type=str, default="",
+                    help="filename of the SQLite catalogue, '{}' next to the nomenclature file by default".format(DEF_DB))
+
+args = parser.parse_args()
+
+db_fname = args.db if args.db != "" else join(dirname(args.nomenclature), DEF_DB)
+t_start = time.time()
+cat = ImageCatalogue(db_fname)
+cat.import_nomenclature(args.nomenclature, force=True)
+n_img = cat.scan(args.image_dir, args.source_dir or None, args.channel_names, args.ext)
+cat.close()
+print "Catalogued {} images in {}s under '{}'".format(n_img, round(time.time() - t_start, 1), db_fname)
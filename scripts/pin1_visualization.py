@@ -37,6 +37,12 @@ sys.path.append(SamMaps_dir+'/scripts/')
 sys.path.append(SamMaps_dir+'/scripts/lib/')
 
 from segmentation_pipeline import read_image
+from table_io import read_table
+from label_statistics import label_statistics
+from label_statistics import stats2dict
+from label_adjacency import CellLayers
+from label_adjacency import cached_cell_layers
+from table_io import find_table
 
 from openalea.image.spatial_image import SpatialImage
 from timagetk.components import SpatialImage as TissueImage
@@ -79,7 +85,7 @@ parser.add_argument('signal_im', type=str,
 parser.add_argument('segmented_im', type=str,
                     help="segmented image corresponding to the 'membrane labelling' channel")
 parser.add_argument('wall_quantif_csv', type=str,
-                    help="CSV file corresponding to wall-based quantification of signal image")
+                    help="table file (CSV, Parquet, Feather or npz) corresponding to wall-based quantification of signal image, a binary table with the same base name is used if found")
 
 # optional arguments:
 parser.add_argument('--clearing_im', type=str, default=None,
@@ -168,14 +174,21 @@ logging.info("--> Loading & resampling segmented image ["+str(current_time() - s
 # - Computing cellular features:
 start_time = current_time()
 p_img = PropertySpatialImage(seg_img, ignore_cells_at_stack_margins=False)
-p_img.compute_default_image_properties()
+# -- Only barycenters & layers are used, computed in single passes over the image:
+if resampling_voxelsize is None:
+    # --- Label adjacency graph saved next to the segmented image:
+    cell_layers = cached_cell_layers(seg_im_fname, seg_img, background=1)
+else:
+    cell_layers = CellLayers.from_image(seg_img, background=1)
+p_img.update_image_property('barycenter', stats2dict(label_statistics(seg_img, real=True), 'barycenter', cell_layers.labels_in('all')))
+p_img.update_image_property('layer', cell_layers.layer_dict())
 if all_walls:
     p_img.update_image_property('layer', dict(zip(p_img.labels,[1 for l in p_img.labels])))
 # p_img.compute_cell_meshes(sub_factor=1)
 logging.info("--> Computing image cell layers ["+str(current_time() - start_time)+" s]")
 
-# - Load CSV file:
-wall_csv_data = pd.read_csv(csv_data)
+# - Load wall table file (binary sibling of a CSV file first):
+wall_csv_data = read_table(find_table(csv_data))
 # -- get list of wall defining labelpairs:
 wall_cells = wall_csv_data[['right_label','left_label']].values
 # -- symmetric labelpairs dict (ie. dict[i,j]==dict[j,i]):
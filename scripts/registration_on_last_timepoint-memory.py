@@ -8,12 +8,10 @@ from os.path import join
 from os.path import split
 from os.path import exists
 
-from timagetk.algorithms import apply_trsf
 from timagetk.algorithms import compose_trsf
 from timagetk.io import imsave
 from timagetk.io.io_trsf import save_trsf
 from timagetk.io.io_trsf import read_trsf
-from timagetk.plugins import registration
 from timagetk.plugins.sequence_registration import compose_to_last
 
 import sys, platform
@@ -30,11 +28,16 @@ from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
 from equalization import z_slice_contrast_stretch
 from segmentation_pipeline import read_image
+from registration_pipeline import pairwise_registrations
+from registration_pipeline import apply_trsf_images
+from image_cache import ImageCache
 
 # - DEFAULT variables:
 POSS_TRSF = ['rigid', 'affine', 'deformable']
 # Microscope orientation:
 DEF_ORIENT = -1  # '-1' == inverted microscope!
+# Memory budget (in Mb) of the intensity images read cache:
+DEF_CACHE_MEM = 2048.
 
 
 # PARAMETERS:
@@ -61,6 +64,10 @@ parser.add_argument('--time_unit', type=str, default='h',
                     help="Time unist of the time-steps, in hours (h) by default.")
 parser.add_argument('--no_consecutive_reg_img', action='store_false',
                     help="if given, images obtained from consecutive registration will NOT be writen, by default write them. Also apply to optional `extra_im` & `seg_im` given.")
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of consecutive registrations computed in parallel, each process reading only its two images, '1' by default")
+parser.add_argument('--cache_mem', type=float, default=DEF_CACHE_MEM,
+                    help="memory budget (in Mb) used to keep the last read intensity images, so consecutive pairs reuse them, '{}' by default".format(DEF_CACHE_MEM))
 parser.add_argument('--force', action='store_true',
                     help="if given, force computation of registration matrix even if they already exists, else skip it, 'False' by default")
 args = parser.parse_args()
@@ -121,6 +128,17 @@ if write_cons_img:
 else:
     print " - Saving images obtained from consecutive registrations."
 
+# -- 'n_jobs' option:
+n_jobs = args.n_jobs
+try:
+    assert n_jobs > 0
+except AssertionError:
+    raise ValueError("The number of jobs should be strictly positive!")
+
+# -- 'cache_mem' option:
+cache_mem = args.cache_mem
+print " - Intensity images read cache of {}Mb.".format(cache_mem)
+
 # -- 'force' option:
 force =  args.force
 if force:
@@ -231,12 +249,15 @@ if seg_im is not None:
 ################################################################################
 sorted_time_steps = [time_steps[i] for i in t_index]
 time2index = {t: n for n, t in enumerate(time_steps)}
+# - Least-recently-used cache of intensity images, reference images are reused as floating images of the next pair
+#   (images are read floating first, also by the registrations computed in this process):
+img_cache = ImageCache(cache_mem)
 
 out_trsf_fnames = []  # list of transformation matrix filenames
+reg_jobs = []  # list of blockmatching registrations to compute
 for t_float, t_ref in zip(sorted_time_steps[:-1], sorted_time_steps[1:]):
     i_float = time2index[t_float]
     i_ref = time2index[t_ref]
-    print "\n\n# -- Blockmatching registration t{}->t{}!".format(i_float, i_ref)
     # - Get the intensity image filenames corresponding to `t_ref` & `t_float`:
     ref_img_path, ref_img_fname = split(indexed_img_fnames[i_ref])
     float_img_path, float_img_fname = split(indexed_img_fnames[i_float])
@@ -244,81 +265,80 @@ for t_float, t_ref in zip(sorted_time_steps[:-1], sorted_time_steps[1:]):
     out_trsf_fname = get_res_trsf_fname(float_img_fname, t_ref, t_float, trsf_type)
     # -- Add it to the list of transformation matrix filenames:
     out_trsf_fnames.append(out_trsf_fname)
-    # - Read the reference and floating images:
-    print "\n - Reading floating image (t{},{}{}): '{}'...".format(i_float, t_float, time_unit, float_img_fname)
-    float_img = read_image(join(float_img_path, float_img_fname))
-    print "\n - Reading reference image (t{},{}{}): '{}'...".format(i_ref, t_ref, time_unit, ref_img_fname)
-    ref_img = read_image(join(ref_img_path, ref_img_fname))
     if not exists(join(out_folder, out_trsf_fname)) or force:
-        print "\nComputing {} blockmatching registration t{}->t{}!".format(trsf_type.upper(), i_float, i_ref)
-        # - Blockmatching registration:
-        out_trsf, _ = registration(float_img, ref_img, method=trsf_type, pyramid_lowest_level=py_ll)
-        # -- Save the transformation matrix:
-        print "--> Saving {} transformation file: '{}'".format(trsf_type.upper(), out_trsf_fname)
-        save_trsf(out_trsf, out_folder + out_trsf_fname)
-    elif write_cons_img or extra_im is not None or seg_im is not None:
-        print "\nFound existing tranformation t{}->t{}!".format(i_float, i_ref)
-        print "--> Reading {} transformation file: '{}'".format(trsf_type.upper(), out_trsf_fname)
-        out_trsf = read_trsf(out_folder + out_trsf_fname)
+        # -- Each job reads only its floating & reference images:
+        reg_jobs.append((join(float_img_path, float_img_fname), join(ref_img_path, ref_img_fname),
+                         out_folder + out_trsf_fname, trsf_type, {'pyramid_lowest_level': py_ll}, False))
     else:
         print "\nFound existing tranformation t{}->t{}!".format(i_float, i_ref)
-        print "--> Nothing left to do here..."
+
+# - Blockmatching registrations of the (independent) consecutive pairs, in a pool of processes:
+if reg_jobs != []:
+    print "\n\n# -- Computing {} {} blockmatching registrations ({} processes)...".format(len(reg_jobs), trsf_type.upper(), n_jobs)
+    pairwise_registrations(reg_jobs, n_jobs, reader=img_cache.read)
+
+# - Apply the consecutive transformations to the floating images, if required:
+if write_cons_img or extra_im is not None or seg_im is not None:
+    consecutive_pairs = zip(sorted_time_steps[:-1], sorted_time_steps[1:])
+else:
+    consecutive_pairs = []
+for t_float, t_ref in consecutive_pairs:
+    i_float = time2index[t_float]
+    i_ref = time2index[t_ref]
+    print "\n\n# -- Applying registration t{}->t{}!".format(i_float, i_ref)
+    # - Get the intensity image filenames corresponding to `t_ref` & `t_float`:
+    ref_img_path, ref_img_fname = split(indexed_img_fnames[i_ref])
+    float_img_path, float_img_fname = split(indexed_img_fnames[i_float])
+    out_trsf_fname = get_res_trsf_fname(float_img_fname, t_ref, t_float, trsf_type)
+    # - Gather the image files to register with this transformation, from the existing outputs only:
+    to_register, out_fnames = {}, {}
     if write_cons_img:
-        print "\n{} registration of the float intensity image:".format(trsf_type.upper())
         # - Defines the registered image filename (output):
         out_img_fname = get_res_img_fname(float_img_fname, t_ref, t_float, trsf_type)
         if not exists(join(out_folder, out_img_fname)) or force:
-            # -- Apply the transformation to the intensity image:
-            print "--> Apply tranformation to the float intensity image..."
-            out_img = apply_trsf(float_img, trsf=out_trsf, template_img=ref_img)
-            # -- Save the registered image:
-            print "--> Saving t{} registered intensity image: '{}'".format(i_float, out_img_fname)
-            imsave(out_folder + out_img_fname, out_img)
-            del out_img
+            to_register['intensity'] = join(float_img_path, float_img_fname)
+            out_fnames['intensity'] = out_img_fname
         else:
             print "--> Found existing t{} registered intensity image: '{}'".format(i_float, out_img_fname)
     if extra_im is not None:
-        print "\n{} registration of the EXTRA intensity image:".format(trsf_type.upper())
         # -- Defines the registered extra intensity image filename (output):
         ximg_path, ximg_fname = split(indexed_ximg_fnames[i_float])
         out_ximg_fname = get_res_img_fname(ximg_fname, t_ref, t_float, trsf_type)
         if not exists(join(out_folder, out_ximg_fname)) or force:
-            # - Also apply transformation to extra image:
-            # -- Read this extra intensity image file:
-            print "--> Reading t{} EXTRA intensity image file: '{}'".format(i_float, out_ximg_fname)
-            ximg = read_image(join(ximg_path, ximg_fname))
-            # -- Apply the transformation to the extra intensity image:
-            print "--> Apply tranformation to the EXTRA intensity image..."
-            out_ximg = apply_trsf(ximg, trsf=out_trsf, template_img=ref_img)
-            # -- Save the registered extra intensity image:
-            print "--> Saving t{} registered EXTRA intensity image: '{}'".format(i_float, out_ximg_fname)
-            imsave(out_folder + out_ximg_fname, out_ximg)
-            del out_ximg
+            to_register['EXTRA intensity'] = join(ximg_path, ximg_fname)
+            out_fnames['EXTRA intensity'] = out_ximg_fname
         else:
             print "--> Found existing t{} registered EXTRA intensity image: '{}'".format(i_float, out_ximg_fname)
     if seg_im is not None:
-        print "\n{} registration of the segmented image:".format(trsf_type.upper())
         # -- Defines the registered segmented image filename (output):
         simg_path, simg_fname = split(indexed_simg_fnames[i_float])
         out_simg_fname = get_res_img_fname(simg_fname, t_ref, t_float, trsf_type)
         if not exists(join(out_folder, out_simg_fname)) or force:
-            # - Also apply transformation to segmented image:
-            # -- Read this segmented image file:
-            print "--> Reading t{} segmented image file: '{}'".format(i_float, out_simg_fname)
-            simg = read_image(join(simg_path, simg_fname))
-            # -- Apply the transformation to the segmented image:
-            print "--> Apply tranformation to the SEGMENTED image..."
-            out_simg = apply_trsf(simg, trsf=out_trsf, template_img=ref_img, param_str_2='-nearest')
-            # -- Save the registered segmented image:
-            print "--> Saving t{} registered SEGMENTED image: '{}'".format(i_float, out_ximg_fname)
-            imsave(out_folder + out_simg_fname, out_simg)
-            del out_simg
+            to_register['SEGMENTED'] = join(simg_path, simg_fname)
+            out_fnames['SEGMENTED'] = out_simg_fname
         else:
             print "--> Found existing t{} registered segmented image: '{}'".format(i_float, out_simg_fname)
-    try:
-        del out_trsf
-    except NameError:
-        pass
+    if to_register == {}:
+        continue
+    # - Read the images to register, the reference image and the transformation:
+    for name, fname in sorted(to_register.items()):
+        print "--> Reading t{} {} image file: '{}'".format(i_float, name, split(fname)[1])
+        if name == 'intensity':
+            to_register[name] = img_cache.read(fname)
+        else:
+            to_register[name] = read_image(fname)
+    # -- Read last, the reference is the most recently used image of the cache when it becomes the next floating image:
+    print "\n - Reading reference image (t{},{}{}): '{}'...".format(i_ref, t_ref, time_unit, ref_img_fname)
+    ref_img = img_cache.read(join(ref_img_path, ref_img_fname))
+    print "--> Reading {} transformation file: '{}'".format(trsf_type.upper(), out_trsf_fname)
+    out_trsf = read_trsf(out_folder + out_trsf_fname)
+    # -- Apply the transformation to all images, the coordinate map is computed once:
+    print "\n{} registration of the {} image(s)...".format(trsf_type.upper(), ', '.join(sorted(to_register)))
+    out_imgs = apply_trsf_images(out_trsf, to_register, ref_img, labels=['SEGMENTED'])
+    for name, out_im in out_imgs.items():
+        print "--> Saving t{} registered {} image: '{}'".format(i_float, name, out_fnames[name])
+        imsave(out_folder + out_fnames[name], out_im)
+    del out_imgs, to_register, out_trsf
 
 ################################################################################
 # - Consecutive transformation composition:
@@ -349,13 +369,13 @@ for t_float in sorted_time_steps[:-1]:
 
 print "\n\n# - Composing each consecutive transformations to the last one:"
 # - Check if the SEQUENCE transformation files exists:
-if np.all([exists(f) for f in seq_trsf_fnames]) and not force:
+if np.all([exists(join(out_folder, f)) for f in seq_trsf_fnames]) and not force:
     print "--> Found all SEQUENCE transformation files!"
     list_comp_trsf = None
 else:
     # -- Loading reference image (last time_point):
     print " - Loading reference image t{} ({}{}): '{}'".format(last_index, sorted_time_steps[last_index], time_unit, indexed_img_fnames[last_index])
-    ref_img = read_image(indexed_img_fnames[last_index])
+    ref_img = img_cache.read(indexed_img_fnames[last_index])
     # -- Loading all consecutive_trsf:
     print " - Loading CONSECUTIVE transformations..."
     consecutive_trsf = [read_trsf(join(out_folder, trsf_fname)) for trsf_fname in out_trsf_fnames]
@@ -373,58 +393,40 @@ else:
 ################################################################################
 # - Apply sequence transformation to intensity, extra intensity and segmented images:
 ################################################################################
-print "\n\n# - Applying SEQUENCE transformations to intensity images:"
+print "\n\n# - Applying SEQUENCE transformations to intensity, EXTRA intensity & segmented images:"
 # - Check if the SEQUENCE registered image files exists:
-if np.all([exists(f) for f in seq_img_fnames]) and not force:
-    print "--> Found all SEQUENCE registered intensity image files!"
-else:
+seq_out_fnames = {'intensity': seq_img_fnames}
+if extra_im is not None:
+    seq_out_fnames['EXTRA intensity'] = seq_ximg_fnames
+if seg_im is not None:
+    seq_out_fnames['SEGMENTED'] = seq_simg_fnames
+for name, out_seq_fnames in seq_out_fnames.items():
+    if np.all([exists(join(out_folder, f)) for f in out_seq_fnames]) and not force:
+        print "--> Found all SEQUENCE registered {} image files!".format(name)
+        seq_out_fnames.pop(name)
+
+if seq_out_fnames != {}:
     # -- Load list of sequence tranformation, if needed:
     if list_comp_trsf is None:
         print " - Loading SEQUENCE transformations..."
-        list_comp_trsf = [read_trsf(seq_trsf_fname) for seq_trsf_fname in seq_trsf_fnames]
-    # -- Apply sequence tranformation to intensity images:
-    for i_float, out_seq_img_fname in enumerate(seq_img_fnames):
-        print " - Loading t{} floating intensity image...".format(i_float)
-        float_img = read_image(indexed_img_fnames[i_float])
-        print " - Applying registration to floating intensity image..."
-        out_seq_img = apply_trsf(float_img, trsf=list_comp_trsf[i_float], template_img=ref_img)
-        print " - Saving SEQUENCE {} intensity image file: '{}'".format(trsf_type.upper(), out_seq_img_fname)
-        imsave(join(out_folder, out_seq_img_fname), out_seq_img)
-
-if extra_im is not None:
-    print "\n\n# - Applying SEQUENCE transformations to EXTRA intensity images:"
-    # - Check if the SEQUENCE registered EXTRA image files exists:
-    if np.all([exists(f) for f in seq_ximg_fnames]) and not force:
-        print "--> Found all SEQUENCE registered EXTRA intensity image files!"
-    else:
-        # -- Load list of sequence tranformation, if needed:
-        if list_comp_trsf is None:
-            print " - Loading SEQUENCE transformations..."
-            list_comp_trsf = [read_trsf(seq_trsf_fname) for seq_trsf_fname in seq_trsf_fnames]
-        # -- Apply sequence tranformation to EXTRA intensity images:
-        for i_float, out_seq_ximg_fname in enumerate(seq_ximg_fnames):
-            print " - Loading t{} EXTRA intensity image...".format(i_float)
-            float_ximg = read_image(indexed_ximg_fnames[i_float])
-            print " - Applying registration to EXTRA intensity image..."
-            out_seq_ximg = apply_trsf(float_ximg, trsf=list_comp_trsf[i_float], template_img=ref_img)
-            print " - Saving SEQUENCE {} EXTRA intensity image file: '{}'".format(trsf_type.upper(), out_seq_ximg_fname)
-            imsave(join(out_folder, out_seq_ximg_fname), out_seq_img)
-
-if seg_im is not None:
-    print "\n\n# - Applying SEQUENCE transformations to segmented images:"
-    # - Check if the SEQUENCE registered SEGMENTED image files exists:
-    if np.all([exists(f) for f in seq_simg_fnames]) and not force:
-        print "--> Found all SEQUENCE registered SEGMENTED image files!"
-    else:
-        # -- Load list of sequence tranformation, if needed:
-        if list_comp_trsf is None:
-            print " - Loading SEQUENCE transformations..."
-            list_comp_trsf = [read_trsf(seq_trsf_fname) for seq_trsf_fname in seq_trsf_fnames]
-        # -- Apply sequence tranformation to SEGMENTED images:
-        for i_float, out_seq_simg_fname in enumerate(seq_simg_fnames):
-            print " - Loading t{} segmented image...".format(i_float)
-            float_simg = read_image(indexed_simg_fnames[i_float])
-            print " - Applying registration to segmented image..."
-            out_seq_simg = apply_trsf(float_simg, trsf=list_comp_trsf[i_float], template_img=ref_img, param_str_2='-nearest')
-            print " - Saving SEQUENCE {} SEGMENTED image file: '{}'".format(trsf_type.upper(), out_seq_simg_fname)
-            imsave(join(out_folder, out_seq_simg_fname), out_seq_img)
+        list_comp_trsf = [read_trsf(join(out_folder, seq_trsf_fname)) for seq_trsf_fname in seq_trsf_fnames]
+    ref_img = img_cache.read(indexed_img_fnames[last_index])
+    # -- Apply each sequence tranformation to all images of its time-point in a single pass:
+    for i_float in range(len(seq_trsf_fnames)):
+        print " - Loading t{} floating {} image(s)...".format(i_float, ', '.join(sorted(seq_out_fnames)))
+        to_register = {}
+        if 'intensity' in seq_out_fnames:
+            to_register['intensity'] = img_cache.read(indexed_img_fnames[i_float])
+        if 'EXTRA intensity' in seq_out_fnames:
+            to_register['EXTRA intensity'] = read_image(indexed_ximg_fnames[i_float])
+        if 'SEGMENTED' in seq_out_fnames:
+            to_register['SEGMENTED'] = read_image(indexed_simg_fnames[i_float])
+        print " - Applying registration to floating image(s)..."
+        out_imgs = apply_trsf_images(list_comp_trsf[i_float], to_register, ref_img, labels=['SEGMENTED'])
+        for name, out_seq_im in out_imgs.items():
+            out_seq_fname = seq_out_fnames[name][i_float]
+            print " - Saving SEQUENCE {} {} image file: '{}'".format(trsf_type.upper(), name, out_seq_fname)
+            imsave(join(out_folder, out_seq_fname), out_seq_im)
+        del to_register, out_imgs
+
+print "\nIntensity images read cache: {} hits, {} reads.".format(img_cache.hits, img_cache.misses)
@@ -14,6 +14,7 @@ from timagetk.io import imread
 from timagetk.io import imsave
 from timagetk.plugins import registration
 from timagetk.plugins import sequence_registration
+from timagetk.plugins.sequence_registration import compose_to_last
 
 
 import sys, platform
@@ -34,6 +35,7 @@ from nomenclature import get_nomenclature_segmentation_name
 from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
 from equalization import z_slice_contrast_stretch
+from registration_pipeline import pairwise_registrations
 # Nomenclature file location:
 nomenclature_file = SamMaps_dir + "nomenclature.csv"
 # OUTPUT directory:
@@ -73,6 +75,8 @@ parser.add_argument('--extra_channels', type=str, nargs='+', default=DEF_SUPP_CH
                     help="list of channel names for which to apply the estimated transformation, '{}' by default".format(DEF_SUPP_CHANNELS))
 parser.add_argument('--microscope_orientation', type=int, default=DEF_ORIENT,
                     help="orientation of the microscope (i.e. set '-1' when using an inverted microscope), '{}' by default".format(DEF_ORIENT))
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of consecutive registrations computed in parallel, each process reading only its two images, '1' by default")
 parser.add_argument('--force', action='store_true',
                     help="if given, force computation of registration matrix even if they already exists, else skip it, 'False' by default")
 args = parser.parse_args()
@@ -105,6 +109,11 @@ if extra_channels != []:
 else:
     print "Estimated transformations will be applied only to the reference intensity image."
 
+n_jobs = args.n_jobs
+try:
+    assert n_jobs > 0
+except AssertionError:
+    raise ValueError("The number of jobs should be strictly positive!")
 force =  args.force
 if force:
     print "WARNING: any existing files will be overwritten!"
@@ -181,6 +190,22 @@ if not np.all([exists(f) for f in seq_res_trsf_list]) or force:
     if not_sequence:
         list_comp_trsf, list_res_img = registration(list_img[0], list_img[1], method='{}_registration'.format(trsf_type))
         list_comp_trsf = [list_comp_trsf]
+    elif n_jobs > 1:
+        # - Consecutive registrations are independent, each process reads only its two images:
+        print "\n# - Computing consecutive {} registrations ({} processes):".format(trsf_type.upper(), n_jobs)
+        reg_jobs = []
+        for t_float, t_next in zip(time_steps[:-1], time_steps[1:]):
+            float_img_fname = list_img_fname[time2index[t_float]]
+            res_path = split(float_img_fname)[0] + '/{}_registrations/'.format(trsf_type)
+            if not exists(res_path):
+                mkdir(res_path)
+            cons_trsf_fname = res_path + get_res_trsf_fname(split(float_img_fname)[1], t_next, t_float, "consecutive_"+trsf_type)
+            reg_jobs.append((float_img_fname, list_img_fname[time2index[t_next]], cons_trsf_fname,
+                             '{}_registration'.format(trsf_type), {}, ref_ch_name.find('raw') != -1))
+        consecutive_trsf = [read_trsf(trsf_fname) for trsf_fname in pairwise_registrations(reg_jobs, n_jobs)]
+        print "\n# - Composing consecutive {} transformations to the last time-point:".format(trsf_type.upper())
+        list_comp_trsf = compose_to_last(consecutive_trsf, list_img[-1])
+        list_res_img = [apply_trsf(img, comp_trsf, template_img=list_img[-1]) for img, comp_trsf in zip(list_img[:-1], list_comp_trsf)]
     else:
         print "\n# - Computing sequence {} registration:".format(trsf_type.upper())
         list_comp_trsf, list_res_img = sequence_registration(list_img, method='sequence_{}_registration'.format(trsf_type))
@@ -14,6 +14,7 @@ from timagetk.io.io_trsf import read_trsf
 from timagetk.io import imsave
 from timagetk.plugins import registration
 from timagetk.plugins import sequence_registration
+from timagetk.plugins.sequence_registration import compose_to_last
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -29,6 +30,7 @@ from nomenclature import get_res_img_fname
 from nomenclature import get_res_trsf_fname
 from equalization import z_slice_contrast_stretch
 from segmentation_pipeline import read_image
+from registration_pipeline import pairwise_registrations
 
 # - DEFAULT variables:
 POSS_TRSF = ['rigid', 'affine', 'deformable']
@@ -54,6 +56,8 @@ parser.add_argument('--microscope_orientation', type=int, default=DEF_ORIENT,
                     help="orientation of the microscope (i.e. set '-1' when using an inverted microscope), '{}' by default".format(DEF_ORIENT))
 parser.add_argument('--time_unit', type=str, default='h',
                     help="Time unist of the time-steps, in hours (h) by default.")
+parser.add_argument('--n_jobs', type=int, default=1,
+                    help="number of consecutive registrations computed in parallel, each process reading only its two images, '1' by default")
 parser.add_argument('--force', action='store_true',
                     help="if given, force computation of registration matrix even if they already exists, else skip it, 'False' by default")
 args = parser.parse_args()
@@ -87,6 +91,11 @@ if extra_im:
     except AssertionError:
         raise ValueError("Not the same number of images ({}) and extra images ({}).".format(len(imgs2reg), len(extra_im)))
 time_unit = args.time_unit
+n_jobs = args.n_jobs
+try:
+    assert n_jobs > 0
+except AssertionError:
+    raise ValueError("The number of jobs should be strictly positive!")
 force =  args.force
 if force:
     print "WARNING: any existing files will be overwritten!"
@@ -193,6 +202,19 @@ if not np.all([exists(f) for f in seq_res_trsf_list]) or force:
     if not_sequence:
         list_comp_trsf, list_res_img = registration(list_img[0], list_img[1], method=trsf_type, pyramid_highest_level=py_hl, pyramid_lowest_level=py_ll)
         list_comp_trsf = [list_comp_trsf]
+    elif n_jobs > 1:
+        # - Consecutive registrations are independent, each process reads only its two images:
+        print "\n# - Computing CONSECUTIVE {} registrations ({} processes):".format(trsf_type.upper(), n_jobs)
+        reg_jobs = []
+        for t_float, t_next in zip(time_steps[:-1], time_steps[1:]):
+            float_img_fname = list_img_fname[time2index[t_float]]
+            cons_trsf_fname = dest_folder + get_res_trsf_fname(split(float_img_fname)[1], t_next, t_float, "consecutive_"+trsf_type)
+            reg_jobs.append((float_img_fname, list_img_fname[time2index[t_next]], cons_trsf_fname, trsf_type,
+                             {'pyramid_highest_level': py_hl, 'pyramid_lowest_level': py_ll}, False))
+        consecutive_trsf = [read_trsf(trsf_fname) for trsf_fname in pairwise_registrations(reg_jobs, n_jobs)]
+        print "\n# - Composing CONSECUTIVE {} transformations to the last time-point:".format(trsf_type.upper())
+        list_comp_trsf = compose_to_last(consecutive_trsf, list_img[-1])
+        list_res_img = [apply_trsf(img, comp_trsf, template_img=list_img[-1]) for img, comp_trsf in zip(list_img[:-1], list_comp_trsf)]
     else:
         print "\n# - Computing SEQUENCE {} registration:".format(trsf_type.upper())
         list_comp_trsf, list_res_img = sequence_registration(list_img, method=trsf_type, return_images=True, pyramid_highest_level=py_hl, pyramid_lowest_level=py_ll)
@@ -11,7 +11,6 @@ from os.path import exists
 from os.path import join
 from os.path import split
 
-from timagetk.io import imsave
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -29,6 +28,8 @@ from nomenclature import exists_file
 from segmentation_pipeline import seg_pipe
 from segmentation_pipeline import read_image
 from segmentation_pipeline import segmentation_fname
+from segmentation_pipeline import save_image
+from stage_cache import StageCache
 
 # - DEFAULT variables:
 # Microscope orientation:
@@ -62,12 +63,26 @@ parser.add_argument('--output_fname', type=str, default="",
 parser.add_argument('--output_path', type=str, default="",
                     help="if specified, change the segmentation file path (MUST EXISTS!)")
 
+parser.add_argument('--out_fmt', type=str, default='inr',
+                    help="format of the segmented image file to write (eg. 'inr', 'tif' or 'cimg' for the chunked container), 'inr' by default")
+
+parser.add_argument('--seed_max_mem', type=float, default=None,
+                    help="if specified, memory ceiling (in Mb) of the seed detection only, performed by overlapping z-slabs (the watershed still uses the whole image), requires '--tmp_dir', None by default")
+parser.add_argument('--tmp_dir', type=str, default=None,
+                    help="directory used to memory-map the smoothed and seed stacks, required with '--seed_max_mem', None by default")
+parser.add_argument('--cache_dir', type=str, default=None,
+                    help="if specified, directory used to cache intermediate images (rescaled, smoothed, seeds...), None by default")
+parser.add_argument('--cache_size', type=float, default=None,
+                    help="maximum size (in Mb) of the cache directory, least recently used images are removed first, unlimited by default")
+
 parser.add_argument('--iso', action='store_true',
                     help="if given, performs resampling to isometric voxelsize before segmentation, 'False' by default")
 parser.add_argument('--equalize', action='store_true',
                     help="if given, performs adaptative equalization of the intensity image to segment, 'False' by default")
 parser.add_argument('--stretch', action='store_true',
                     help="if given, performs contrast strectching of the intensity image to segment, 'False' by default")
+parser.add_argument('--local_reflood', action='store_true',
+                    help="if given, cells smaller than 'min_cell_volume' are removed by re-flooding only their region, 'False' by default")
 parser.add_argument('--force', action='store_true',
                     help="if given, force computation of labelled image even if it already exists, 'False' by default")
 
@@ -96,6 +111,24 @@ stretch = args.stretch
 output_fname =  args.output_fname
 output_path =  args.output_path
 
+seed_max_mem = args.seed_max_mem
+tmp_dir = args.tmp_dir
+if seed_max_mem is not None:
+    try:
+        assert seed_max_mem > 0.
+    except AssertionError:
+        raise ValueError("Negative memory ceiling!")
+    try:
+        assert tmp_dir is not None
+    except AssertionError:
+        raise ValueError("Option '--seed_max_mem' requires a '--tmp_dir'!")
+    print "Seed detection will be performed by z-slabs using at most {}Mb.".format(seed_max_mem)
+
+cache = None
+if args.cache_dir is not None:
+    cache = StageCache(args.cache_dir, args.cache_size)
+    print "Intermediate images will be cached under '{}'.".format(args.cache_dir)
+
 force =  args.force
 if force:
     print "WARNING: any existing segmentation image will be overwritten!"
@@ -105,7 +138,7 @@ else:
 if output_fname:
     seg_img_fname = output_fname
 else:
-    seg_img_fname = segmentation_fname(scf_name, h_min, iso, equalize, stretch)
+    seg_img_fname = segmentation_fname(scf_name, h_min, iso, equalize, stretch, args.out_fmt)
 
 if output_path:
     assert exists(output_path)
@@ -120,6 +153,6 @@ else:
         im2sub = read_image(substract_inr)
     else:
         im2sub = None
-    seg_im = seg_pipe(im2seg, h_min, im2sub, iso, equalize, stretch, std_dev, min_cell_volume, back_id)
+    seg_im = seg_pipe(im2seg, h_min, im2sub, iso, equalize, stretch, std_dev, min_cell_volume, back_id, seed_max_mem=seed_max_mem, tmp_dir=tmp_dir, cache=cache, local_reflood=args.local_reflood)
     print "\n - Saving segmentation under '{}'".format(seg_img_fname)
-    imsave(seg_img_fname, seg_im)
+    save_image(seg_img_fname, seg_im)
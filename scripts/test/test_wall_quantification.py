@@ -0,0 +1,121 @@
+# -*- python -*-
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2018 CNRS - ENS Lyon - INRIA
+#
+#       File author(s): Jonathan LEGRAND <jonathan.legrand@ens-lyon.fr>
+################################################################################
+
+"""
+Regression test of the single-pass wall quantification ('wall_quantification'
+library) against the reference table obtained with `MembraneQuantif` on the
+artificial images of 'test_PIN_quantif.py'.
+
+Only the signal & wall geometry columns are compared: in the reference table,
+the 'PIN1_orientation' column is not opposed between (2, 3) & (3, 2) and the
+normals of (3, 2) are missing.
+"""
+
+import shutil
+import tempfile
+import numpy as np
+from os.path import join
+
+import sys, platform
+if platform.uname()[1] == "RDP-M7520-JL":
+    SamMaps_dir = '/data/Meristems/Carlos/SamMaps/'
+elif platform.uname()[1] == "calculus":
+    SamMaps_dir = '/projects/SamMaps/scripts/SamMaps_git/'
+else:
+    raise ValueError("Unknown custom path to 'SamMaps' for this system...")
+sys.path.append(SamMaps_dir+'/scripts/lib/')
+sys.path.append(SamMaps_dir+'/scripts/test/')
+
+from create_images import create_two_label_image
+from create_images import create_two_sided_intensity_image
+from create_images import create_left_sided_intensity_image
+from create_images import create_right_sided_intensity_image
+
+from table_io import read_table
+from table_io import labelpair_dict
+from wall_quantification import WallIndex
+from wall_quantification import quantify_walls
+from wall_quantification import select_walls
+from wall_quantification import tiled_quantify_walls
+from timagetk.io import imsave
+
+ref_fname = SamMaps_dir + '/scripts/test/test_PI_wall_PIN1_PI_mean_signal-D6.0.csv'
+membrane_dist = 6.
+
+
+def quantify(PIN1_im):
+    """
+    Return the (2, 3) 'PI' & 'PIN1' wall signals of the test images.
+    """
+    seg_im = create_two_label_image()
+    wall_index = WallIndex.from_image(seg_im, membrane_dist, background=None)
+    signal_imgs = {'PI': create_two_sided_intensity_image(), 'PIN1': PIN1_im}
+    return quantify_walls(wall_index, membrane_dist, [(2, 3)], signal_imgs, 'mean')
+
+
+def test_reference_signals():
+    """
+    Left, right & total signals of both sides of the wall, and significance.
+    """
+    ref_df = read_table(ref_fname)
+    wall_signal = quantify(create_left_sided_intensity_image())
+    for ch_name in ['PI', 'PIN1']:
+        left = labelpair_dict(ref_df, ch_name + '_left')
+        right = labelpair_dict(ref_df, ch_name + '_right')
+        total = labelpair_dict(ref_df, ch_name + '_signal')
+        res = {k: v[0] for k, v in wall_signal[ch_name].items()}
+        np.testing.assert_allclose([res['left'], res['right'], res['total']], [left[(2, 3)], right[(2, 3)], total[(2, 3)]])
+        # - Inverted wall, 'left' & 'right' are swapped:
+        np.testing.assert_allclose([res['right'], res['left'], res['total']], [left[(3, 2)], right[(3, 2)], total[(3, 2)]])
+    PI = wall_signal['PI']
+    significance = min(PI['left'][0], PI['right'][0]) / max(PI['left'][0], PI['right'][0])
+    np.testing.assert_allclose(significance, labelpair_dict(ref_df, 'significance')[(2, 3)])
+
+
+def test_sided_signal_ratio():
+    """
+    The left-sided signal has a ratio of 1, the right-sided one of -1.
+    """
+    left = quantify(create_left_sided_intensity_image())['PIN1']
+    right = quantify(create_right_sided_intensity_image())['PIN1']
+    np.testing.assert_allclose([left['ratio'][0], right['ratio'][0]], [1., -1.])
+    np.testing.assert_allclose([left['left'][0], left['right'][0]], [right['right'][0], right['left'][0]])
+
+
+def test_tiled_reference_geometry():
+    """
+    Signals, area, median & normal of the wall quantified by z-tiles, from
+    the image files.
+    """
+    ref_df = read_table(ref_fname)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        seg_fname = join(tmp_dir, 'seg.inr')
+        imsave(seg_fname, create_two_label_image())
+        signal_fnames = {'PI': join(tmp_dir, 'PI.inr'), 'PIN1': join(tmp_dir, 'PIN1.inr')}
+        imsave(signal_fnames['PI'], create_two_sided_intensity_image())
+        imsave(signal_fnames['PIN1'], create_left_sided_intensity_image())
+        wall_signal, walls = tiled_quantify_walls(seg_fname, signal_fnames, membrane_dist, max_mem=1., halo=1.)
+    finally:
+        shutil.rmtree(tmp_dir)
+    wall_signal = select_walls(wall_signal, walls['labelpairs'], [(2, 3)])
+    for ch_name in ['PI', 'PIN1']:
+        total = labelpair_dict(ref_df, ch_name + '_signal')
+        np.testing.assert_allclose(wall_signal[ch_name]['total'], [total[(2, 3)]])
+    np.testing.assert_allclose(walls['adjacency'].contact_area(2, 3), labelpair_dict(ref_df, 'wall_area')[(2, 3)])
+    median = select_walls(walls['median'], walls['labelpairs'], [(2, 3)])[0]
+    np.testing.assert_allclose(median, [labelpair_dict(ref_df, 'wall_center_' + axis)[(2, 3)] for axis in 'xyz'])
+    normal = walls['barycenter'][3] - walls['barycenter'][2]
+    np.testing.assert_allclose(normal / np.linalg.norm(normal), [labelpair_dict(ref_df, 'wall_normal_' + axis)[(2, 3)] for axis in 'xyz'])
+
+
+if __name__ == '__main__':
+    test_reference_signals()
+    test_sided_signal_ratio()
+    test_tiled_reference_geometry()
+    print "Wall quantification regression tests passed."
@@ -21,7 +21,6 @@ from timagetk.plugins import morphology
 from timagetk.plugins import h_transform
 from timagetk.plugins import region_labeling
 from timagetk.plugins import segmentation
-from vplants.tissue_analysis.temporal_graph_from_image import graph_from_image
 
 import sys, platform
 if platform.uname()[1] == "RDP-M7520-JL":
@@ -42,6 +41,10 @@ from detection_evaluation import evaluate_positions_detection
 from detection_evaluation import filter_topomesh_vertices
 from nomenclature import splitext_zip
 from nomenclature import get_nomenclature_channel_fname
+from label_statistics import n_labels
+from label_statistics import label_statistics
+from label_statistics import stats2dict
+from label_adjacency import CellLayers
 
 XP = 'E35'
 SAM = 4
@@ -205,7 +208,7 @@ for rescaling in rescale_type:
                     ext_img = h_transform(asf_img, h=h_min, method='h_transform_min')
                     print " --> Components labelling..."
                     con_img = region_labeling(ext_img, low_threshold=1, high_threshold=h_min, method='connected_components')
-                    nb_connectec_comp = len(np.unique(con_img.get_array()))
+                    nb_connectec_comp = n_labels(con_img, exclude=())
                     print nb_connectec_comp, "seeds detected!"
                     if nb_connectec_comp <= 3:
                         print "Not enough seeds, aborting!"
@@ -216,15 +219,17 @@ for rescaling in rescale_type:
                     seg_im = segmentation(img, con_img, method='seeded_watershed')
                     # - Performs topomesh creation from detected seeds:
                     print " --> Analysing segmented image...",
-                    img_graph = graph_from_image(seg_im, background=1, spatio_temporal_properties=['barycenter', 'L1'], ignore_cells_at_stack_margins=False)
-                    print img_graph.nb_vertices(), "seeds extracted by 'graph_from_image'!"
+                    cell_layers = CellLayers.from_image(seg_im, background=1)
+                    labels = cell_layers.labels_in('all')
+                    print len(labels), "seeds extracted from the label adjacency graph!"
+                    bary = stats2dict(label_statistics(seg_im, real=True), 'barycenter', labels)
                     # -- Create a topomesh from 'seed_positions':
                     print " --> Topomesh creation..."
-                    seed_positions = {v: img_graph.vertex_property('barycenter')[v]*microscope_orientation for v in img_graph.vertices()}
+                    seed_positions = {l: np.array(bary[l])*microscope_orientation for l in labels}
                     detected_topomesh = vertex_topomesh(seed_positions)
                     # -- Detect L1 using 'nuclei_layer':
                     oriented_seeds = {k: np.array([1.,1.,-1.])*v for k, v in seed_positions.items()}
-                    cell_layer = img_graph.vertex_property('L1')
+                    cell_layer = {l: int(layer == 1) for l, layer in cell_layers.layer_dict().items()}
                     # -- Update the topomesh with the 'layer' property:
                     detected_topomesh.update_wisp_property('layer', 0, cell_layer)
                     # -- Save the detected topomesh: